@@ -0,0 +1,54 @@
+# ** -- coding: utf-8 -- **
+# !/usr/bin/env python
+
+"""
+memory allocated by WeedOperation.get(rsp.content) vs WeedOperation.get_into(a preallocated buffer).
+
+the stub server runs in another process, so only the client's allocations are traced.
+
+run:
+    python benchmark/bench_get_into.py [size_in_mb] [n]
+"""
+
+import io
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from weed.operation import WeedOperation  # noqa: E402
+from weed.session import WeedSession  # noqa: E402
+
+
+def bench(name, n, fn):
+    tracemalloc.start()
+    begin = time.perf_counter()
+    for _ in range(n):
+        fn()
+    elapsed = time.perf_counter() - begin
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print('%-36s peak allocated: %8.2f MB, %6.1f ms/op' % (name, peak / 1e6, elapsed * 1000 / n))
+
+
+def main(size_in_mb=32, n=5):
+    proc = subprocess.Popen([sys.executable, os.path.join(HERE, 'stub_server.py')], stdout=subprocess.PIPE, text=True)
+    try:
+        url_base = proc.stdout.readline().strip()
+        op = WeedOperation(master_url_base=url_base, session=WeedSession())
+        fid = op.put(io.BytesIO(os.urandom(size_in_mb * 1024 * 1024)), file_name='a.bin').fid
+        size = len(op.get_content(fid))
+        buffer = bytearray(size)
+
+        bench('get(): rsp.content', n, lambda: op.get(fid).content)
+        bench('get_into(): preallocated bytearray', n, lambda: op.get_into(fid, buffer))
+    finally:
+        proc.kill()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,57 @@
+# ** -- coding: utf-8 -- **
+# !/usr/bin/env python
+
+"""
+client cpu time per GB uploaded: multipart streamed through python vs the kernel's sendfile.
+
+the stub server runs in another process and drains the bodies, so only the client's cpu is measured.
+
+run:
+    python benchmark/bench_sendfile.py [size_in_mb] [n]
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from weed import conf  # noqa: E402
+from weed.operation import WeedOperation  # noqa: E402
+from weed.session import WeedSession  # noqa: E402
+
+
+def bench(name, op, path, n):
+    size = os.path.getsize(path)
+    begin_cpu, begin = time.process_time(), time.perf_counter()
+    for _ in range(n):
+        wor = op.put(path)
+        assert wor.storage_size > size, wor
+    cpu, elapsed = time.process_time() - begin_cpu, time.perf_counter() - begin
+    gb = size * n / 1e9
+    print('%-28s cpu: %6.3f s/GB, wall: %6.3f s/GB' % (name, cpu / gb, elapsed / gb))
+
+
+def main(size_in_mb=256, n=4):
+    proc = subprocess.Popen([sys.executable, os.path.join(HERE, 'stub_server.py')], stdout=subprocess.PIPE, text=True)
+    try:
+        url_base = proc.stdout.readline().strip()
+        op = WeedOperation(master_url_base=url_base, session=WeedSession())
+        with tempfile.NamedTemporaryFile(suffix='.bin') as f:
+            for _ in range(size_in_mb):
+                f.write(os.urandom(1024 * 1024))
+            f.flush()
+
+            conf.set_upload_with_sendfile(False)
+            bench('put(): streamed multipart', op, f.name, n)
+            conf.set_upload_with_sendfile(True)
+            bench('put(): sendfile', op, f.name, n)
+    finally:
+        proc.kill()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
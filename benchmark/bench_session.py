@@ -0,0 +1,47 @@
+# ** -- coding: utf-8 -- **
+# !/usr/bin/env python
+
+"""
+ops/sec of per-call connections(module-level requests.get) vs the pooled WeedSession.
+
+run:
+    python benchmark/bench_session.py [n]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+
+from stub_server import start_stub_server  # noqa: E402
+from weed.operation import WeedOperation  # noqa: E402
+from weed.session import WeedSession  # noqa: E402
+
+
+def bench(name, n, fn):
+    begin = time.perf_counter()
+    for _ in range(n):
+        fn()
+    elapsed = time.perf_counter() - begin
+    print('%-40s %8d ops in %6.2fs  %10.1f ops/sec' % (name, n, elapsed, n / elapsed))
+
+
+def main(n=2000):
+    server, url_base = start_stub_server()
+    fid = '1,01'
+    fid_url = '%s/%s' % (url_base, fid)
+
+    bench('before: requests.get(new connection)', n, lambda: requests.get(fid_url).content)
+    session = WeedSession()
+    bench('after:  WeedSession.get(keep-alive)', n, lambda: session.get(fid_url).content)
+
+    op = WeedOperation(master_url_base=url_base, session=WeedSession())
+    bench('after:  WeedOperation.get(lookup+get)', n, lambda: op.get(fid))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,203 @@
+# ** -- coding: utf-8 -- **
+# !/usr/bin/env python
+
+"""
+a tiny in-process stand-in of a seaweedfs master + volume server, for benchmarks.
+
+It answers on one port:
+    GET  /dir/assign             -> {"fid": "1,<n>", "url": <self>, "publicUrl": <self>, "count": N}
+    GET  /dir/lookup?volumeId=1  -> {"locations": [{"url": <self>, "publicUrl": <self>}]}
+    POST /<fid>                  -> stores the file part(drained, not stored, if over STORE_LIMIT), {"name": "", "size": N, "eTag": ""}
+    POST /<fid>?cm=true          -> stores a chunk manifest
+    POST /delete(fid=...&fid=...) -> [{"fid": <fid>, "status": 202, "size": N}, ...]
+    GET  /<fid>                  -> the stored file(or PAYLOAD, 404 once deleted), honoring Range(single or multiple)
+                                    and If-None-Match.
+                                    chunks of a chunk manifest are joined("X-File-Store: chunked"), "?cm=false" returns the manifest
+    HEAD /<fid>
+    DELETE /<fid>                -> {"size": N}, with the chunks of a chunk manifest
+
+It speaks HTTP/1.1 so keep-alive connections are reused by clients that pool them.
+"""
+
+import gzip
+import hashlib
+import itertools
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+PAYLOAD = b'x' * 4096
+STORE_LIMIT = 16 * 1024 * 1024
+
+
+class StubWeedHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    counter = itertools.count(1)
+    store = {}
+    manifests = {}
+    deleted = set()
+    gzipped = set()  # fids stored gzipped, like needles uploaded with "Content-Encoding: gzip"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body, status=200, content_type='application/json', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _send_json(self, d, status=200):
+        self._send(json.dumps(d).encode(), status)
+
+    @property
+    def host(self):
+        return '%s:%d' % self.server.server_address[:2]
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _read_chunks(self):
+        """ yields the request body piece by piece, Content-Length or chunked """
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if not size:
+                    self.rfile.readline()
+                    return
+                yield self.rfile.read(size)
+                self.rfile.readline()
+        remaining = int(self.headers.get('Content-Length') or 0)
+        while remaining:
+            data = self.rfile.read(min(remaining, 1024 * 1024))
+            if not data:
+                return
+            remaining -= len(data)
+            yield data
+
+    def _drain_body(self):
+        """ returns (body or None if larger than STORE_LIMIT, size) """
+        pieces, size = [], 0
+        for data in self._read_chunks():
+            size += len(data)
+            if pieces is not None:
+                pieces.append(data)
+                if size > STORE_LIMIT:
+                    pieces = None
+        return (None if pieces is None else b''.join(pieces)), size
+
+    def _file_part(self, body):
+        """ (the file, whether it is gzipped) of a multipart/form-data body """
+        content_type = self.headers.get('Content-Type', '')
+        if 'boundary=' not in content_type:
+            return body, False
+        boundary = content_type.split('boundary=', 1)[1].strip('"').encode()
+        begin = body.index(b'\r\n\r\n') + 4
+        return body[begin:body.rindex(b'\r\n--' + boundary)], b'content-encoding: gzip' in body[:begin].lower()
+
+    def do_GET(self):
+        u = urlparse(self.path)
+        if u.path == '/dir/assign':
+            count = int(parse_qs(u.query).get('count', ['1'])[0])
+            self._send_json({'fid': '1,%x' % next(self.counter), 'url': self.host,
+                             'publicUrl': self.host, 'count': count})
+        elif u.path == '/dir/lookup':
+            self._send_json({'locations': [{'url': self.host, 'publicUrl': self.host}]})
+        else:
+            fid = u.path.lstrip('/')
+            if fid in self.manifests:
+                if parse_qs(u.query).get('cm') == ['false']:
+                    return self._send(json.dumps(self.manifests[fid]).encode())
+                chunks = sorted(self.manifests[fid]['chunks'], key=lambda c: c['offset'])
+                body = b''.join(self.store.get(c['fid'], b'') for c in chunks)
+                headers = {'X-File-Store': 'chunked'}
+            elif fid in self.deleted:
+                return self._send_json({'error': 'Not Found'}, status=404)
+            else:
+                body = self.store.get(fid, PAYLOAD)
+                headers = {}
+                if fid in self.gzipped:  # served as stored to clients accepting gzip, else decompressed
+                    if 'gzip' in self.headers.get('Accept-Encoding', '') and not self.headers.get('Range'):
+                        headers['Content-Encoding'] = 'gzip'
+                    else:
+                        body = gzip.decompress(body)
+            headers['ETag'] = '"%s"' % hashlib.md5(body).hexdigest()
+            if self.headers.get('If-None-Match') == headers['ETag']:
+                return self._send(b'', status=304, headers=headers)
+            if self.headers.get('Range'):
+                return self._send_ranges(body)
+            self._send(body, content_type='application/octet-stream', headers=headers)
+
+    def _send_ranges(self, body):
+        ranges = []
+        for spec in self.headers['Range'].split('=', 1)[1].split(','):
+            begin, end = spec.split('-')
+            begin, end = int(begin), min(int(end), len(body) - 1)
+            if begin < len(body):
+                ranges.append((begin, end))
+        if not ranges:
+            return self._send(b'', status=416)
+        if len(ranges) == 1:
+            begin, end = ranges[0]
+            return self._send(body[begin:end + 1], status=206, content_type='application/octet-stream',
+                              headers={'Content-Range': 'bytes %d-%d/%d' % (begin, end, len(body))})
+        parts = []
+        for begin, end in ranges:
+            parts.append(b'--STUB\r\nContent-Type: application/octet-stream\r\nContent-Range: bytes %d-%d/%d\r\n\r\n'
+                         % (begin, end, len(body)) + body[begin:end + 1] + b'\r\n')
+        self._send(b''.join(parts) + b'--STUB--\r\n', status=206, content_type='multipart/byteranges; boundary=STUB')
+
+    do_HEAD = do_GET
+
+    def do_POST(self):
+        body, size = self._drain_body()
+        if urlparse(self.path).path == '/delete':
+            fids = parse_qs(body.decode()).get('fid', [])
+            self.deleted.update(fids)
+            self._send_json([{'fid': fid, 'status': 202, 'size': len(self.store.pop(fid, PAYLOAD))} for fid in fids])
+            return
+        u = urlparse(self.path)
+        if body is not None:
+            body, is_gzipped = self._file_part(body)
+            size = len(body)
+            if parse_qs(u.query).get('cm') == ['true']:
+                self.manifests[u.path.lstrip('/')] = json.loads(body)
+            else:
+                self.store[u.path.lstrip('/')] = body
+                self.deleted.discard(u.path.lstrip('/'))
+                (self.gzipped.add if is_gzipped else self.gzipped.discard)(u.path.lstrip('/'))
+        self._send_json({'name': '', 'size': size, 'eTag': 'stub'})
+
+    def do_DELETE(self):
+        fid = urlparse(self.path).path.lstrip('/')
+        manifest = self.manifests.pop(fid, None)
+        if manifest:
+            for chunk in manifest['chunks']:
+                self.store.pop(chunk['fid'], None)
+            return self._send_json({'size': manifest['size']})
+        self.deleted.add(fid)
+        body = self.store.pop(fid, PAYLOAD)
+        self._send_json({'size': len(body)})
+
+
+def start_stub_server(host='127.0.0.1', port=0):
+    """ start a stub server in a daemon thread. returns (server, 'http://host:port') """
+    server = ThreadingHTTPServer((host, port), StubWeedHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://%s:%d' % server.server_address[:2]
+
+
+if __name__ == '__main__':
+    import sys
+
+    _server, _url_base = start_stub_server(port=int(sys.argv[1]) if len(sys.argv) > 1 else 0)
+    print(_url_base, flush=True)
+    threading.Event().wait()
@@ -45,8 +45,9 @@ setup(name=NAME,
       long_description_content_type="text/markdown",
       platforms=['any'],
       classifiers=CLASSIFIERS,
-      install_requires=['requests'],
-      requires=['requests'],
+      install_requires=['requests', 'urllib3>=2'],
+      requires=['requests', 'urllib3'],
+      extras_require={'async': ['httpx'], 'zstd': ['zstandard']},
       # cmdclass = {'test' : PyTest},
       setup_requires=['pytest-runner'],
       tests_require=['pytest'],  # https://pythonhosted.org/distutils-pytest/
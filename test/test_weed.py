@@ -70,6 +70,7 @@ note:
 
 import gzip
 import io
+import json
 from urllib import parse
 
 from env_test_env import *
@@ -98,6 +99,9 @@ from weed.master import *
 from weed.volume import *
 from weed.operation import *
 from weed.filer import WeedFiler
+from weed.cache import WeedContentCache
+from weed.compression import WeedCompression
+from weed.disk_cache import WeedDiskCache
 
 set_global_logger_level(logging.DEBUG)
 
@@ -161,6 +165,17 @@ def test_weed_master_2():
             assert l[i] == l[i + 1]
 
 
+def test_weed_master_lookup_many():
+    master = WeedMaster()
+    fids = [master.acquire_new_assign_key()['fid'] for _ in range(3)]
+    lookups = master.lookup_many(fids)
+    for fid in fids:
+        assert 'locations' in lookups[fid.split(',')[0]]
+
+    master = WeedMaster(prefetch_volume_ids=True)
+    assert master.volumes_cache.stats()['size'] > 0
+
+
 def test_weed_volume():
     volume = WeedVolume()
     assert volume.__repr__()
@@ -351,6 +366,204 @@ def test_file_operations():
     assert rsp.storage_size == 0
 
 
+def test_get_stream_and_get_to_file(tmp_path):
+    op = WeedOperation()
+    file_name = 'test_opensource_logo.jpg'
+    fpath = os.path.join(TEST_PATH, file_name)
+    with open(fpath, 'rb') as f:
+        original_content = f.read()
+    fid = op.put(fpath, file_name=file_name).fid
+
+    wor = op.get_stream(fid, chunk_size=1024)
+    assert wor
+    with wor.stream as stream:
+        chunks = list(stream)
+    assert max(len(chunk) for chunk in chunks) <= 1024
+    assert b''.join(chunks) == original_content
+
+    dst = str(tmp_path / file_name)
+    wor = op.get_to_file(fid, dst)
+    assert wor.storage_size == len(original_content)
+    with open(dst, 'rb') as f:
+        assert f.read() == original_content
+
+    fp = io.BytesIO()
+    assert op.get_to_file(fid, fp)
+    assert fp.getvalue() == original_content
+
+    buffer = bytearray(len(original_content) + 100)
+    wor = op.get_into(fid, buffer)
+    assert wor.storage_size == len(original_content)
+    assert buffer[:wor.storage_size] == original_content
+    assert not op.get_into(fid, bytearray(10))
+    assert op.delete(fid)
+
+
+def test_get_range():
+    op = WeedOperation()
+    file_name = 'test_opensource_logo.jpg'
+    fpath = os.path.join(TEST_PATH, file_name)
+    with open(fpath, 'rb') as f:
+        original_content = f.read()
+    fid = op.put(fpath, file_name=file_name).fid
+
+    assert op.get_range(fid, 10, 20).content == original_content[10:30]
+    ranges = [(0, 4), (100, 10), (len(original_content) - 5, 100)]
+    wors = op.get_ranges(fid, ranges)
+    assert [wor.content for wor in wors] == [original_content[o:o + n] for o, n in ranges]
+
+    with op.get_range_file(fid, buffer_size=512) as f:
+        f.seek(-16, io.SEEK_END)
+        assert f.read() == original_content[-16:]
+        f.seek(0)
+        assert f.read() == original_content
+    assert op.delete(fid)
+
+
+def test_put_many():
+    op = WeedOperation()
+    file_name = 'test_opensource_logo.jpg'
+    fpath = os.path.join(TEST_PATH, file_name)
+    with open(fpath, 'rb') as f:
+        original_content = f.read()
+
+    files = [(io.BytesIO(original_content), '%d.jpg' % i) for i in range(20)] + [fpath]
+    wors = list(op.put_many(files, block_size=8, max_workers=4))
+    assert len(wors) == 21
+    assert all(wor.ok() for wor in wors)
+    assert len({wor.fid for wor in wors}) == 21
+    assert file_name in [wor.name for wor in wors]
+    for wor in wors:
+        assert op.get_content(wor.fid) == original_content
+
+    fids = [wor.fid for wor in wors]
+    got = list(op.get_many(fids))
+    assert [wor.fid for wor in got] == fids
+    assert all(wor.content == original_content for wor in got)
+    got = list(op.get_many(fids, ordered=False, max_workers_per_host=2))
+    assert sorted(wor.fid for wor in got) == sorted(fids)
+
+    deleted = op.delete_many(fids, chunk_size=7)
+    assert [wor.fid for wor in deleted] == fids
+    assert all(wor.ok() and wor.storage_size > 0 for wor in deleted)
+    assert not any(wor.ok() for wor in op.iter_delete_many(fids))
+
+
+def test_put_large(tmp_path):
+    op = WeedOperation()
+    content = os.urandom(1024 * 1024 + 100)
+    wor = op.put_large(io.BytesIO(content), file_name='large.bin', chunk_size=256 * 1024, chunks_per_assign=2)
+    assert wor.ok()
+    assert wor.storage_size == len(content)
+    assert op.get_content(wor.fid) == content
+
+    manifest = op.get_chunk_manifest(wor.fid)
+    assert manifest.size == len(content)
+    assert len(manifest.chunks) == 5
+    path = str(tmp_path / 'large.bin')
+    assert op.get_large(wor.fid, path, max_workers=3).storage_size == len(content)
+    with open(path, 'rb') as f:
+        assert f.read() == content
+    fp = io.BytesIO()
+    assert op.get_large(wor.fid, fp).ok()
+    assert fp.getvalue() == content
+    assert op.delete(wor.fid).ok()
+
+    # not larger than one chunk: a plain file
+    wor = op.put_large(io.BytesIO(content[:100]), file_name='small.bin', chunk_size=256 * 1024)
+    assert wor.ok()
+    assert op.get_content(wor.fid) == content[:100]
+    assert op.get_chunk_manifest(wor.fid) is None
+    fp = io.BytesIO()
+    assert op.get_large(wor.fid, fp).ok()
+    assert fp.getvalue() == content[:100]
+    assert op.delete(wor.fid).ok()
+
+
+def test_cp():
+    op = WeedOperation()
+    content = os.urandom(300 * 1024)
+    src_fid = op.put(io.BytesIO(content), file_name='src.bin').fid
+    dst_fid = op.put(io.BytesIO(b'old'), file_name='dst.bin').fid
+
+    wor = op.cp(src_fid, dst_fid)
+    assert wor.ok() and wor.fid == dst_fid
+    assert op.get_content(dst_fid) == content
+
+    wors = list(op.cp_many([(src_fid, None), (src_fid, dst_fid)], ordered=True, max_bytes_in_flight=1024))
+    assert all(wor.ok() for wor in wors)
+    assert wors[1].fid == dst_fid
+    assert op.get_content(wors[0].fid) == content
+    for fid in [src_fid, dst_fid, wors[0].fid]:
+        assert op.delete(fid).ok()
+
+
+def test_get_with_content_cache():
+    cache = WeedContentCache(max_bytes=1024 * 1024, ttl=0)  # every get revalidates
+    op = WeedOperation(content_cache=cache)
+    file_name = 'test_opensource_logo.jpg'
+    fpath = os.path.join(TEST_PATH, file_name)
+    with open(fpath, 'rb') as f:
+        original_content = f.read()
+    fid = op.put(fpath, file_name=file_name).fid
+
+    wor = op.get(fid)
+    assert wor.content == original_content
+    assert wor.etag
+    assert op.get_content(fid) == original_content  # 304 Not Modified
+    assert cache.stats()['revalidations'] == 1
+
+    op.put(io.BytesIO(b'changed'), fid=fid)
+    assert op.get_content(fid) == b'changed'
+    assert op.delete(fid).ok()
+    assert fid not in cache
+
+
+def test_get_with_disk_cache(tmp_path):
+    op = WeedOperation(disk_cache=WeedDiskCache(str(tmp_path), ttl=60))
+    content = os.urandom(10 * 1024)
+    fid = op.put(io.BytesIO(content), file_name='a.bin').fid
+    assert op.get_content(fid) == content
+    assert fid in op.disk_cache
+
+    # another process, or this one after a restart
+    op = WeedOperation(disk_cache=WeedDiskCache(str(tmp_path), ttl=60))
+    assert op.get_content(fid) == content
+    assert op.disk_cache.stats()['hits'] == 1
+    assert op.delete(fid).ok()
+    assert fid not in op.disk_cache
+
+
+def test_exists_many():
+    op = WeedOperation(exists_cache_duration_in_seconds=5)
+    fids = [wor.fid for wor in op.put_many([(io.BytesIO(b'%d' % i), '%d.txt' % i) for i in range(10)])]
+    assert op.delete(fids[0]).ok()
+
+    result = op.exists_many(fids + ['wrong_fid', fids[1] + 'wrong_fid'], max_workers_per_host=3)
+    assert list(result) == fids + ['wrong_fid', fids[1] + 'wrong_fid']
+    assert [fid for fid, exists in result.items() if not exists] == [fids[0], 'wrong_fid', fids[1] + 'wrong_fid']
+    assert fids[1] in op.exists_cache
+
+    assert op.delete(fids[1]).ok()  # forgotten by exists_cache
+    assert not op.exists(fids[1])
+    assert all(op.delete(fid).ok() for fid in fids[2:])
+
+
+def test_put_with_compression():
+    op = WeedOperation(compression=WeedCompression(min_size=1024))
+    data = json.dumps([{'id': i, 'name': 'item %d' % i} for i in range(10000)]).encode()
+    wor = op.put(io.BytesIO(data), file_name='items.json')
+    assert wor.ok()
+
+    assert op.get(wor.fid).content == data
+    stream_wor = op.get_stream(wor.fid)
+    with stream_wor.stream as stream:
+        assert stream.response.headers.get('content-encoding') == 'gzip'  # stored gzipped
+        assert b''.join(stream) == data
+    assert op.get_range(wor.fid, 10, 20).content == data[10:30]
+    assert op.delete(wor.fid).ok()
+
+
 def test_weed_filer():
     wf = WeedFiler()
     assert wf.uri == 'localhost:27100'
@@ -392,6 +605,12 @@ def test_weed_filer():
 
     assert 'hello.txt' in file_names
 
+    # get a range of f1
+    assert wf.get_range(f1_path, 7, 3)['content'] == b'how'
+    with wf.get_range_file(f1_path) as f:
+        f.seek(-3, io.SEEK_END)
+        assert f.read() == b'you'
+
     # get f1
     wf_get = wf.get(f1_path)
     assert int(wf_get['content_length']) > 0
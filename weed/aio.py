@@ -0,0 +1,435 @@
+# ** -- coding: utf-8 -- **
+# !/usr/bin/env python
+#
+# Copyright (c) 2011 darkdarkfruit <darkdarkfruit@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+
+"""
+asyncio interface of weed-fs, built on httpx(pip install httpx).
+
+AsyncWeedMaster, AsyncWeedOperation and AsyncWeedFiler are the async counterparts of
+WeedMaster, WeedOperation and WeedFiler, and return the same shapes(WeedOperationResponse, ...).
+
+eg:
+    async with AsyncWeedOperation() as op:
+        wor = await op.put(open('1.jpg', 'rb'), file_name='1.jpg')
+        wors = await asyncio.gather(*[op.get(wor.fid) for _ in range(1000)])
+
+"""
+
+__all__ = ['AsyncWeedSession', 'AsyncWeedMaster', 'AsyncWeedOperation', 'AsyncWeedFiler']
+
+import asyncio
+import io
+import json
+import os
+import random
+from urllib.parse import urljoin
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+from weed import conf
+from weed.cache import WeedTTLCache
+from weed.conf import g_logger
+from weed.deadline import get_timeout
+from weed.util import (Status, WeedAssignKeyExtended, WeedOperationResponse, get_volume_id,
+                       parse_put_file_response)
+
+
+class AsyncWeedSession(object):
+    """ async http client with keep-alive connection pools, shared by async weed objects.
+
+    A session belongs to the event loop it is used in.
+    """
+
+    def __init__(self, max_connections=1000, max_keepalive_connections=None, transport=None):
+        """
+
+        Arguments:
+        - `max_connections`: max concurrent connections, requests above it wait for a free connection
+        - `max_keepalive_connections`: defaults to conf.g_http_pool_maxsize
+        - `transport`: a custom httpx transport(eg: httpx.MockTransport for testing)
+        """
+        if httpx is None:
+            raise ImportError('Async support of python-weed requires httpx. Install it with: pip install httpx')
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections or conf.g_http_pool_maxsize
+        limits = httpx.Limits(max_connections=self.max_connections,
+                              max_keepalive_connections=self.max_keepalive_connections)
+        self.client = httpx.AsyncClient(limits=limits, timeout=None, follow_redirects=True, transport=transport)
+
+    async def request(self, method, url, **kwargs) -> 'httpx.Response':
+        """ unless a "timeout" is given, the conf connect/read timeouts apply, capped by the current deadline
+        (see weed.deadline), the same as WeedSession """
+        if 'timeout' not in kwargs:
+            connect, read = get_timeout()
+            kwargs['timeout'] = httpx.Timeout(None, connect=connect, read=read)
+        return await self.client.request(method, url, **kwargs)
+
+    async def get(self, url, **kwargs) -> 'httpx.Response':
+        return await self.request('GET', url, **kwargs)
+
+    async def head(self, url, **kwargs) -> 'httpx.Response':
+        return await self.request('HEAD', url, **kwargs)
+
+    async def post(self, url, **kwargs) -> 'httpx.Response':
+        return await self.request('POST', url, **kwargs)
+
+    async def delete(self, url, **kwargs) -> 'httpx.Response':
+        return await self.request('DELETE', url, **kwargs)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
+
+    def __repr__(self):
+        return f'<AsyncWeedSession: max_connections={self.max_connections}>'
+
+
+class AsyncWeedMaster(object):
+    """
+    async counterpart of WeedMaster.
+
+    Concurrent lookups of the same volume_id share one request to the master.
+    """
+
+    def __init__(self, url_base='http://localhost:9333', session=None, volume_cache_size=10000):
+        self.url_base = url_base
+        self.url_assign = urljoin(self.url_base, '/dir/assign')
+        self.url_lookup = urljoin(self.url_base, '/dir/lookup')
+        self.url_status = urljoin(self.url_base, '/dir/status')
+        self._owns_session = session is None
+        self.session = session or AsyncWeedSession()
+
+        # volume_id -> lookup_result, shared by everyone using this master
+        self.volumes_cache = WeedTTLCache(max_size=volume_cache_size)
+        self._pending_lookups = {}
+
+    async def acquire_new_assign_key(self, count=1) -> None or WeedAssignKeyExtended:
+        """ async version of WeedMaster.acquire_new_assign_key """
+        assign_key_url = urljoin(self.url_assign, '?count=' + str(count))
+        wak = WeedAssignKeyExtended()
+        try:
+            r = await self.session.get(assign_key_url)
+            wak.update(json.loads(r.content))
+            wak.update_full_urls()
+            g_logger.info('Successfuly got weed_assign_key(wak): %s' % wak)
+        except Exception as e:
+            g_logger.error('Could not get new assign key from the assign url_base: %s. Exception is: %s'
+                           % (assign_key_url, e))
+            return None
+        return wak
+
+    async def lookup(self, volume_id_or_fid, cache_duration_in_seconds=None) -> None or {}:
+        """ async version of WeedMaster.lookup """
+        _volume_id = get_volume_id(volume_id_or_fid)
+        cached = self.volumes_cache.get(_volume_id, max_age=cache_duration_in_seconds)
+        if cached is not None:
+            return cached
+
+        pending = self._pending_lookups.get(_volume_id)
+        if pending is None:
+            pending = asyncio.ensure_future(self._lookup(_volume_id))
+            self._pending_lookups[_volume_id] = pending
+            pending.add_done_callback(lambda _: self._pending_lookups.pop(_volume_id, None))
+        return await asyncio.shield(pending)
+
+    async def _lookup(self, volume_id) -> None or {}:
+        try:
+            r = await self.session.get(self.url_lookup + '?volumeId=%s' % volume_id)
+            if r.is_error:  # not HTTP-200, like HTTP-404, ...
+                return None
+            result = json.loads(r.content)
+            self.volumes_cache.set(volume_id, result)
+        except Exception as e:
+            g_logger.error("Could not lookup volume: %s. Exception is: %s" % (volume_id, e))
+            result = None
+        return result
+
+    async def get_status(self) -> None or {}:
+        try:
+            r = await self.session.get(self.url_status)
+            result = json.loads(r.content)
+        except Exception as e:
+            g_logger.error('Could not get status of this volume: %s. Exception is: %s' % (self.url_status, e))
+            result = None
+        return result
+
+    async def aclose(self):
+        """ close the session, if it was created here """
+        if self._owns_session:
+            await self.session.aclose()
+
+    def __repr__(self):
+        return f'<AsyncWeedMaster: {self.url_base}>'
+
+
+class AsyncWeedOperation(object):
+    """ async counterpart of WeedOperation.
+
+    Pass the same @master to several AsyncWeedOperations to share its lookup cache.
+    """
+
+    def __init__(self, master_url_base='http://localhost:9333', session=None, master=None):
+        self.master_url_base = master_url_base
+        # sessions given(or borrowed from @master) are left open for their owner
+        self._owns_session = session is None and master is None
+        if master is not None:
+            self.master = master
+            self.session = session or master.session
+        else:
+            self.session = session or AsyncWeedSession()
+            self.master = AsyncWeedMaster(url_base=master_url_base, session=self.session)
+
+    async def get_fid_full_url(self, fid, use_public_url=False) -> None or str:
+        """ async version of WeedOperation.get_fid_full_url """
+        full_url = None
+        try:
+            r = await self.master.lookup(get_volume_id(fid))
+            locations = r['locations']
+            location = locations[random.randint(0, len(locations) - 1)]
+            if not use_public_url:
+                full_url = 'http://%s/%s' % (location['url'], fid)
+            else:
+                full_url = 'http://%s/%s' % (location['publicUrl'], fid)
+        except Exception as e:
+            g_logger.error('Could not get volume location of this fid: %s. Exception is: %s' % (fid, e))
+        return full_url
+
+    async def get(self, fid, file_name='') -> WeedOperationResponse:
+        """ async version of WeedOperation.get """
+        fid_full_url = 'wrong_url'
+        wor = WeedOperationResponse()
+        try:
+            fid_full_url = await self.get_fid_full_url(fid)
+            rsp = await self.session.get(fid_full_url)
+            wor.status = Status.SUCCESS
+            wor.fid = fid
+            wor.url = fid_full_url
+            wor.name = file_name
+            wor.content = rsp.content
+            wor.content_type = rsp.headers.get('content-type')
+        except Exception as e:
+            err_msg = 'Could not read file fid: %s, file_name: %s, fid_full_url: %s, e: %s' % (
+                fid, file_name, fid_full_url, e)
+            g_logger.error(err_msg)
+            wor.status = Status.FAILED
+            wor.message = err_msg
+        return wor
+
+    async def get_content(self, fid, file_name='') -> bytes:
+        return (await self.get(fid, file_name)).content
+
+    async def put(self, fp, fid=None, file_name='') -> None or WeedOperationResponse:
+        """ async version of WeedOperation.put """
+        fid_full_url = 'wrong_url'
+        _fid = fid
+        try:
+            if not fid:
+                wak = await self.master.acquire_new_assign_key()
+                _fid = wak.fid
+                fid_full_url = wak.fid_full_url
+            else:
+                fid_full_url = await self.get_fid_full_url(fid)
+        except Exception as e:
+            g_logger.error('Could not put file. fp: "%s", file_name: "%s", fid_full_url: "%s", e: %s' % (
+                fp, file_name, fid_full_url, e))
+            return None
+
+        wor = WeedOperationResponse()
+        is_our_responsibility_to_close_file = False
+        if isinstance(fp, str):
+            _fp = open(fp, 'rb')
+            is_our_responsibility_to_close_file = True
+        else:
+            _fp = fp
+
+        try:
+            rsp = await self.session.post(fid_full_url, files={file_name or 'a.unknown': _fp})
+            wor = parse_put_file_response(rsp.json(), fid_full_url)
+            wor.fid = _fid
+        except Exception as e:
+            err_msg = 'Could not put file. fp: "%s", file_name: "%s", fid_full_url: "%s", e: %s' % (
+                fp, file_name, fid_full_url, e)
+            g_logger.error(err_msg)
+            wor.status = Status.FAILED
+            wor.message = err_msg
+
+        if is_our_responsibility_to_close_file:
+            _fp.close()
+        return wor
+
+    async def delete(self, fid, file_name='') -> WeedOperationResponse:
+        """ async version of WeedOperation.delete """
+        wor = WeedOperationResponse()
+        fid_full_url = 'wrong_url'
+        try:
+            fid_full_url = await self.get_fid_full_url(fid)
+            r = await self.session.delete(fid_full_url)
+            rsp_json = r.json()
+
+            wor.status = Status.SUCCESS
+            wor.fid = fid
+            wor.url = fid_full_url
+            wor.name = file_name
+            if 'size' in rsp_json:
+                wor.storage_size = rsp_json['size']
+                if wor.storage_size == 0:
+                    err_msg = ('Error: fid@%s is not exist.' % fid)
+                    wor.status = Status.FAILED
+                    wor.message = err_msg
+                    g_logger.error(err_msg)
+        except Exception as e:
+            err_msg = 'Deleting file: fid: %s, file_name: %s, fid_full_url: %s, e: %s' % (
+                fid, file_name, fid_full_url, e)
+            g_logger.error(err_msg)
+            wor.status = Status.FAILED
+            wor.message = err_msg
+        return wor
+
+    async def exists(self, fid) -> bool:
+        """ async version of WeedOperation.exists """
+        if ',' not in fid:  # fid should have a volume_id
+            return False
+        fid_full_url = await self.get_fid_full_url(fid)
+        if not fid_full_url:
+            return False
+        try:
+            rsp = await self.session.head(fid_full_url)
+            return not rsp.is_error
+        except Exception as e:
+            g_logger.error('Error occurs while HEAD %s. e: %s' % (fid_full_url, e))
+            return False
+
+    async def aclose(self):
+        """ close the session, if it was created here """
+        if self._owns_session:
+            await self.session.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
+
+    def __repr__(self):
+        return f'<AsyncWeedOperation: @master({self.master_url_base}>'
+
+
+class AsyncWeedFiler(object):
+    """ async counterpart of WeedFiler.
+    """
+
+    def __init__(self, url_base='http://localhost:27100', session=None):
+        self.url_base = url_base
+        self.uri = self.url_base.split('//')[-1]
+        self._owns_session = session is None
+        self.session = session or AsyncWeedSession()
+
+    async def get(self, remote_path) -> None or {}:
+        """ async version of WeedFiler.get """
+        url = urljoin(self.url_base, remote_path)
+        try:
+            rsp = await self.session.get(url)
+            if not rsp.is_error:
+                return {'content_length': rsp.headers.get('content-length'),
+                        'content_type': rsp.headers.get('content-type'),
+                        'content': rsp.content}
+            g_logger.error('%d GET %s' % (rsp.status_code, url))
+        except Exception as e:
+            g_logger.error('Error GETing %s. e:%s' % (url, e))
+        return None
+
+    async def put(self, fp, remote_path) -> None or str:
+        """ async version of WeedFiler.put """
+        url = urljoin(self.url_base, remote_path)
+        is_our_responsibility_to_close_file = False
+        if isinstance(fp, str):
+            _fp = open(fp, 'rb')
+            is_our_responsibility_to_close_file = True
+        else:
+            _fp = fp
+        result = None
+        try:
+            rsp = await self.session.post(url, files={'file': _fp})
+            if not rsp.is_error:
+                result = remote_path
+            else:
+                g_logger.error('%d POST %s' % (rsp.status_code, url))
+        except Exception as e:
+            g_logger.error('Error POSTing %s. e:%s' % (url, e))
+
+        if is_our_responsibility_to_close_file:
+            _fp.close()
+        return result
+
+    async def delete(self, remote_path) -> bool:
+        """ async version of WeedFiler.delete """
+        url = urljoin(self.url_base, remote_path)
+        try:
+            rsp = await self.session.delete(url)
+            if rsp.is_error:
+                g_logger.error('Error deleting file: %s. ' % remote_path)
+            return not rsp.is_error
+        except Exception as e:
+            g_logger.error('Error deleting file: %s. e: %s' % (remote_path, e))
+            return False
+
+    async def list(self, directory) -> None or {}:
+        """ async version of WeedFiler.list """
+        d = directory if directory.endswith('/') else (directory + '/')
+        url = urljoin(self.url_base, d)
+        try:
+            rsp = await self.session.get(url, headers={'Accept': 'application/json'})
+            if rsp.is_error:
+                g_logger.error('Error listing "%s". [HTTP %d]' % (url, rsp.status_code))
+                return None
+            return rsp.json()
+        except Exception as e:
+            g_logger.error('Error listing "%s". e: %s' % (url, e))
+        return None
+
+    async def mkdir(self, directory) -> None or str:
+        """ async version of WeedFiler.mkdir """
+        return await self.put(io.BytesIO(b'.info'), os.path.join(directory, '.info'))
+
+    async def aclose(self):
+        """ close the session, if it was created here """
+        if self._owns_session:
+            await self.session.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
+
+    def __repr__(self):
+        return f'<AsyncWeedFiler: {self.url_base}>'
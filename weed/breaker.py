@@ -0,0 +1,231 @@
+# ** -- coding: utf-8 -- **
+# !/usr/bin/env python
+#
+# Copyright (c) 2011 darkdarkfruit <darkdarkfruit@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+
+
+"""
+fault tolerance of python-weed sessions: per-host circuit breakers and a retry budget.
+
+When a volume server dies, requests to it would each wait for a tcp timeout and fill up worker pools.
+WeedCircuitBreaker counts consecutive failures per host. After conf.g_circuit_breaker_failure_threshold
+of them the circuit "opens" and requests to that host raise WeedCircuitOpenError at once. After
+conf.g_circuit_breaker_reset_timeout_in_seconds the circuit is "half open": one probe request goes through.
+Its success closes the circuit, its failure opens it again.
+
+WeedRetryBudget caps retries at a ratio of all requests, so retries can not multiply the load of a
+struggling cluster.
+
+eg:
+    session = WeedSession(breaker=WeedCircuitBreaker(failure_threshold=3), retry_budget=WeedRetryBudget(0.2))
+"""
+
+__all__ = ['WeedCircuitBreaker', 'WeedCircuitOpenError', 'WeedRetryBudget', 'CLOSED', 'OPEN', 'HALF_OPEN']
+
+import threading
+import time
+import types
+import urllib.parse
+import weakref
+
+import requests
+
+from weed import conf
+from weed.conf import g_logger
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class WeedCircuitOpenError(requests.exceptions.ConnectionError):
+    """ raised instead of sending a request to a host whose circuit is open """
+
+
+class _Circuit(object):
+    __slots__ = ('state', 'failures', 'opened_at', 'probing')
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0  # consecutive
+        self.opened_at = 0.0
+        self.probing = False
+
+
+class WeedCircuitBreaker(object):
+    """ circuit breakers of all hosts a session talks to. thread-safe. """
+
+    def __init__(self, failure_threshold=None, reset_timeout_in_seconds=None):
+        """
+
+        Arguments:
+        - `failure_threshold`: consecutive failures opening a circuit. defaults to
+            conf.g_circuit_breaker_failure_threshold. 0 disables the breaker
+        - `reset_timeout_in_seconds`: an open circuit lets a probe through after this long. defaults to
+            conf.g_circuit_breaker_reset_timeout_in_seconds
+        """
+        self.failure_threshold = conf.g_circuit_breaker_failure_threshold \
+            if failure_threshold is None else failure_threshold
+        self.reset_timeout_in_seconds = conf.g_circuit_breaker_reset_timeout_in_seconds \
+            if reset_timeout_in_seconds is None else reset_timeout_in_seconds
+        self._lock = threading.Lock()
+        self._circuits = {}
+        self._listeners = []
+
+    @staticmethod
+    def _host(url) -> str:
+        return urllib.parse.urlsplit(url if '//' in url else '//' + url).netloc
+
+    def add_listener(self, callback):
+        """ call callback(host) whenever the circuit of a host opens. bound methods are weakly referenced,
+        so listening does not keep their objects alive """
+        ref = weakref.WeakMethod(callback) if isinstance(callback, types.MethodType) else (lambda: callback)
+        with self._lock:
+            self._prune_listeners()
+            self._listeners.append(ref)
+
+    def _prune_listeners(self):
+        """ forget listeners whose objects are gone. call it with self._lock held """
+        self._listeners = [ref for ref in self._listeners if ref() is not None]
+
+    def before_request(self, url):
+        """ raise WeedCircuitOpenError if a request to @url must not be sent now """
+        if not self.failure_threshold:
+            return
+        host = self._host(url)
+        with self._lock:
+            circuit = self._circuits.get(host)
+            if circuit is None or circuit.state == CLOSED:
+                return
+            if circuit.state == OPEN and time.time() - circuit.opened_at >= self.reset_timeout_in_seconds:
+                circuit.state = HALF_OPEN
+            if circuit.state == HALF_OPEN and not circuit.probing:
+                circuit.probing = True  # this request is the probe
+                return
+        raise WeedCircuitOpenError('circuit of %s is open after %d failures' % (host, circuit.failures))
+
+    def record(self, url, ok):
+        """ record the outcome of a request to @url let through by before_request.
+
+        @ok: True for success, False for a failure of the host, None if the request said nothing about the host
+        """
+        if not self.failure_threshold:
+            return
+        host = self._host(url)
+        tripped = False
+        with self._lock:
+            circuit = self._circuits.get(host)
+            if circuit is None:
+                if ok is not False:
+                    return
+                circuit = self._circuits[host] = _Circuit()
+            was_probe = circuit.state == HALF_OPEN and circuit.probing
+            if was_probe:
+                circuit.probing = False
+            if ok:
+                circuit.state = CLOSED
+                circuit.failures = 0
+            elif ok is False:
+                circuit.failures += 1
+                if circuit.state == HALF_OPEN or (circuit.state == CLOSED and
+                                                   circuit.failures >= self.failure_threshold):
+                    tripped = circuit.state == CLOSED
+                    circuit.state = OPEN
+                    circuit.opened_at = time.time()
+            if circuit.state == CLOSED and not circuit.failures:
+                del self._circuits[host]  # keep only troubled hosts
+            if tripped:
+                self._prune_listeners()
+            listeners = list(self._listeners) if tripped else []
+        if tripped:
+            g_logger.warning('circuit of %s is open after %d failures' % (host, self.failure_threshold))
+        for ref in listeners:
+            callback = ref()
+            if callback is not None:
+                try:
+                    callback(host)
+                except Exception as e:
+                    g_logger.error('circuit breaker listener failed on %s. e: %s' % (host, e))
+
+    def state(self, url) -> str:
+        """ return CLOSED, OPEN or HALF_OPEN for the host of @url """
+        with self._lock:
+            circuit = self._circuits.get(self._host(url))
+            if circuit is None:
+                return CLOSED
+            if circuit.state == OPEN and time.time() - circuit.opened_at >= self.reset_timeout_in_seconds:
+                return HALF_OPEN
+            return circuit.state
+
+    def is_open(self, url) -> bool:
+        return self.state(url) == OPEN
+
+    def stats(self) -> {}:
+        """ return {host: {'state', 'failures'}} of hosts which failed lately """
+        with self._lock:
+            return {host: {'state': c.state, 'failures': c.failures} for host, c in self._circuits.items()}
+
+    def __repr__(self):
+        return f'<WeedCircuitBreaker: failure_threshold={self.failure_threshold}, ' \
+               f'reset_timeout_in_seconds={self.reset_timeout_in_seconds}>'
+
+
+class WeedRetryBudget(object):
+    """ a token bucket allowing retries of up to @ratio of requests. thread-safe. """
+
+    def __init__(self, ratio=None, burst=10):
+        """
+
+        Arguments:
+        - `ratio`: retries allowed per request, in the long run. defaults to conf.g_retry_budget_ratio
+        - `burst`: at most this many retries in a row after a quiet period
+        """
+        self.ratio = conf.g_retry_budget_ratio if ratio is None else ratio
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._stats = {'requests': 0, 'retries': 0, 'denied': 0}
+
+    def on_request(self):
+        """ call it once per request, not per retry """
+        with self._lock:
+            self._stats['requests'] += 1
+            self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def try_retry(self) -> bool:
+        """ take a retry out of the budget. returns False if the budget is used up """
+        with self._lock:
+            if self._tokens < 1:
+                self._stats['denied'] += 1
+                return False
+            self._tokens -= 1
+            self._stats['retries'] += 1
+            return True
+
+    def stats(self) -> {}:
+        """ return {'requests', 'retries', 'denied'} """
+        with self._lock:
+            return dict(self._stats)
+
+    def __repr__(self):
+        return f'<WeedRetryBudget: ratio={self.ratio}>'
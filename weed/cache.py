@@ -0,0 +1,336 @@
+# ** -- coding: utf-8 -- **
+# !/usr/bin/env python
+#
+# Copyright (c) 2011 darkdarkfruit <darkdarkfruit@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+
+"""
+caches of python-weed.
+
+WeedTTLCache is a bounded, thread-safe LRU cache whose entries expire after a ttl.
+WeedMaster uses one to cache volume locations.
+
+WeedContentCache is a thread-safe LRU cache of file contents bounded by total bytes.
+WeedOperation uses one(if given) to serve hot files, revalidating expired ones by etag.
+"""
+
+__all__ = ['WeedTTLCache', 'WeedContentCache']
+
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from weed import conf
+from weed.deadline import WeedDeadlineExceeded, current_deadline
+
+
+class _Flight(object):
+    """ a load in progress, shared by all threads missing the same key """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class WeedTTLCache(object):
+    """ a bounded, thread-safe LRU cache with ttl(plus jitter) and single-flight loading.
+
+    eg:
+        cache = WeedTTLCache(max_size=10000, ttl=60, negative_ttl=5, stale_ttl=30)
+        locations = cache.get_or_load('3', master_lookup)
+
+    Concurrent get_or_load calls missing the same key share one call of the loader.
+    """
+
+    def __init__(self, max_size=10000, ttl=None, jitter=0.1, negative_ttl=0, stale_ttl=0):
+        """
+
+        Arguments:
+        - `max_size`: least recently used entries are evicted above this size
+        - `ttl`: seconds an entry lives. defaults to conf.g_volume_cache_duration_in_seconds(read on every set)
+        - `jitter`: an entry expires randomly in [ttl * (1 - jitter), ttl], so entries set together
+            do not expire together
+        - `negative_ttl`: seconds a None result of get_or_load's loader is cached. 0 disables it
+        - `stale_ttl`: seconds an expired entry is still returned by get_or_load, while one
+            background call of the loader refreshes it(stale-while-revalidate). 0 disables it
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.jitter = jitter
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, stored_at, expires_at, stale_until)
+        self._flights = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.negative_hits = 0
+        self.stale_hits = 0
+
+    def _expires_at(self, now, ttl=None):
+        if ttl is None:
+            ttl = conf.g_volume_cache_duration_in_seconds if self.ttl is None else self.ttl
+        return now + ttl * (1 - random.random() * self.jitter)
+
+    def _lookup(self, key, now, max_age=None, allow_stale=False):
+        """ return (hit, stale, value). call it with self._lock held """
+        entry = self._entries.get(key)
+        if entry is not None and (max_age is None or now - entry[1] <= max_age):
+            value, stored_at, expires_at, stale_until = entry
+            if now < expires_at:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                if value is None:
+                    self.negative_hits += 1
+                return True, False, value
+            if allow_stale and now < stale_until:
+                self._entries.move_to_end(key)
+                self.stale_hits += 1
+                return True, True, value
+        self.misses += 1
+        return False, False, None
+
+    def get(self, key, default=None, max_age=None):
+        """ return the cached value of @key, or @default if missing or expired.
+
+        @max_age: if given, also treat entries stored more than @max_age seconds ago as expired
+        """
+        with self._lock:
+            _, _, value = self._lookup(key, time.time(), max_age)
+        return default if value is None else value
+
+    def peek(self, key) -> (bool, object):
+        """ return (found, value) of a fresh entry(negative entries included) without touching counters or lru order """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() < entry[2]:
+                return True, entry[0]
+        return False, None
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        if value is None:  # a negative entry
+            expires_at = stale_until = now + self.negative_ttl
+        else:
+            expires_at = self._expires_at(now, ttl)
+            stale_until = expires_at + self.stale_ttl
+        with self._lock:
+            self._entries[key] = (value, now, expires_at, stale_until)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader, ttl=None, max_age=None):
+        """ return the cached value of @key, or call loader(key) on a miss and cache its result.
+
+        Only one loader(key) runs at a time, other threads missing @key wait for its result(at most until
+        the current deadline, then WeedDeadlineExceeded is raised).
+        None results are cached for self.negative_ttl seconds.
+        Expired entries within self.stale_ttl are returned at once and refreshed in background.
+        If loader raises, the exception is raised to every waiting caller and nothing is cached.
+        """
+        with self._lock:
+            hit, stale, value = self._lookup(key, time.time(), max_age, allow_stale=True)
+            if hit and not stale:
+                return value
+            flight = self._flights.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = self._flights[key] = _Flight()
+
+        if stale:
+            if is_leader:
+                threading.Thread(target=self._load, args=(key, loader, ttl, flight),
+                                 name='weed-cache-refresh', daemon=True).start()
+            return value
+
+        if not is_leader:
+            current = current_deadline()
+            if not flight.event.wait(None if current is None else current.remaining()):
+                raise WeedDeadlineExceeded('deadline exceeded waiting for %r to be loaded' % (key,))
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        self._load(key, loader, ttl, flight)
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def _load(self, key, loader, ttl, flight):
+        try:
+            flight.value = loader(key)
+            if flight.value is not None or self.negative_ttl > 0:
+                self.set(key, flight.value, ttl)
+        except Exception as e:
+            # keep the stale entry, if any, until its stale_ttl ends
+            flight.error = e
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.event.set()
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_if(self, predicate) -> int:
+        """ remove the entries for which predicate(key, value) is true. returns how many are removed """
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if predicate(key, entry[0])]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> {}:
+        """ return counters: hits(negative_hits included), negative_hits, stale_hits, misses, evictions and size """
+        with self._lock:
+            return {'hits': self.hits, 'negative_hits': self.negative_hits, 'stale_hits': self.stale_hits,
+                    'misses': self.misses, 'evictions': self.evictions, 'size': len(self._entries)}
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[0] is not None and time.time() < entry[2]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f'<WeedTTLCache: size={len(self._entries)}, max_size={self.max_size}>'
+
+
+class WeedContentCache(object):
+    """ a thread-safe LRU cache of file contents, bounded by the total bytes of the contents.
+
+    eg:
+        cache = WeedContentCache(max_bytes=256 * 1024 * 1024, max_object_size=1024 * 1024, ttl=60)
+        op = WeedOperation(content_cache=cache)
+
+    An expired entry is kept(until evicted) with its etag, so the owner can revalidate it with
+    "If-None-Match" and call refresh on a "304 Not Modified" instead of downloading it again.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_object_size=1024 * 1024, ttl=None):
+        """
+
+        Arguments:
+        - `max_bytes`: least recently used entries are evicted while the contents take more than this
+        - `max_object_size`: larger contents are not cached
+        - `ttl`: seconds an entry is fresh. defaults to conf.g_content_cache_duration_in_seconds(read on every set)
+        """
+        self.max_bytes = max_bytes
+        self.max_object_size = max_object_size
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, size, etag, expires_at)
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    def _expires_at(self, ttl=None):
+        if ttl is None:
+            ttl = conf.g_content_cache_duration_in_seconds if self.ttl is None else self.ttl
+        return time.time() + ttl
+
+    def get(self, key) -> (object, str, bool):
+        """ return (value, etag, fresh) of @key, (None, '', False) if missing.
+
+        an expired entry is returned with fresh=False, to be revalidated with its etag.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, '', False
+            self._entries.move_to_end(key)
+            value, _, etag, expires_at = entry
+            fresh = time.time() < expires_at
+            if fresh:
+                self.hits += 1
+            return value, etag, fresh
+
+    def set(self, key, value, size, etag='', ttl=None):
+        """ cache @value of @size bytes. nothing is cached if @size > max_object_size """
+        with self._lock:
+            self._pop(key)
+            if size > self.max_object_size or size > self.max_bytes:
+                return
+            self._entries[key] = (value, size, etag, self._expires_at(ttl))
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size, _, _) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def refresh(self, key, ttl=None):
+        """ make the entry of @key fresh again, eg: after a "304 Not Modified" """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = entry[:3] + (self._expires_at(ttl),)
+                self.revalidations += 1
+
+    def _pop(self, key):
+        """ remove @key. call it with self._lock held """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def invalidate(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> {}:
+        """ return counters: hits(fresh ones), misses, revalidations(304s), evictions, size and bytes """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'revalidations': self.revalidations,
+                    'evictions': self.evictions, 'size': len(self._entries), 'bytes': self.bytes}
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f'<WeedContentCache: size={len(self._entries)}, bytes={self.bytes}, max_bytes={self.max_bytes}>'
@@ -0,0 +1,166 @@
+# ** -- coding: utf-8 -- **
+# !/usr/bin/env python
+#
+# Copyright (c) 2011 darkdarkfruit <darkdarkfruit@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+
+
+"""
+compression of uploads.
+
+WeedCompression picks, by content type and size, the files worth compressing(eg: json, text) and the
+encoding(gzip, or zstd with pip install zstandard). The file is compressed chunk by chunk while being sent,
+and its multipart part is marked with "Content-Encoding", so seaweedfs stores it compressed and serves it
+compressed to clients accepting that encoding. Downloads are decompressed while streaming by requests.
+
+eg:
+    op = WeedOperation(compression=WeedCompression(min_size=1024))
+    op.put('data.json')
+"""
+
+__all__ = ['WeedCompression', 'WeedCompressingReader', 'GZIP', 'ZSTD']
+
+import io
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from weed import conf
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+
+# content types compressing well. types ending with "+json" or "+xml" are included too
+COMPRESSIBLE_CONTENT_TYPES = frozenset([
+    'application/json', 'application/javascript', 'application/x-javascript', 'application/xml',
+    'application/x-ndjson', 'application/csv', 'application/x-yaml', 'application/yaml',
+    'application/wasm', 'image/svg+xml', 'image/bmp', 'application/x-tar',
+])
+
+
+class WeedCompression(object):
+    """ which uploads to compress, and how """
+
+    def __init__(self, encoding=GZIP, min_size=1024, content_types=None, level=None):
+        """
+
+        Arguments:
+        - `encoding`: GZIP or ZSTD(requires zstandard: pip install zstandard)
+        - `min_size`: files smaller than this are sent as they are, compressing them saves too little.
+            files of unknown size(eg: streams) are compressed
+        - `content_types`: content types to compress, defaults to text/* and COMPRESSIBLE_CONTENT_TYPES
+        - `level`: compression level, defaults to 6 for gzip and 3 for zstd
+        """
+        if encoding not in (GZIP, ZSTD):
+            raise ValueError('unsupported encoding: %s' % encoding)
+        if encoding == ZSTD and zstandard is None:
+            raise ImportError('zstd compression of python-weed requires zstandard. '
+                              'Install it with: pip install zstandard')
+        self.encoding = encoding
+        self.min_size = min_size
+        self.content_types = None if content_types is None else frozenset(content_types)
+        self.level = level
+
+    def is_compressible(self, content_type) -> bool:
+        content_type = (content_type or '').split(';')[0].strip().lower()
+        if self.content_types is not None:
+            return content_type in self.content_types
+        return content_type.startswith('text/') or content_type in COMPRESSIBLE_CONTENT_TYPES or \
+            content_type.endswith(('+json', '+xml'))
+
+    def choose(self, content_type, size) -> None or str:
+        """ return the encoding to compress a file of @content_type and @size(None if unknown) with,
+        None to send it as it is """
+        if not self.is_compressible(content_type):
+            return None
+        if size is not None and size < self.min_size:
+            return None
+        return self.encoding
+
+    def __repr__(self):
+        return f'<WeedCompression: {self.encoding}, min_size={self.min_size}>'
+
+
+class WeedCompressingReader(io.RawIOBase):
+    """ a readonly file-like object returning the contents of @fp compressed, chunk by chunk """
+
+    def __init__(self, fp, encoding=GZIP, level=None, chunk_size=None):
+        """
+
+        Arguments:
+        - `fp`: the file-object to read from its current position. text file-objects are utf-8 encoded
+        - `encoding`: GZIP or ZSTD
+        - `level`: compression level, defaults to 6 for gzip and 3 for zstd
+        - `chunk_size`: bytes read from @fp at a time, defaults to conf.g_stream_chunk_size_in_bytes
+        """
+        super(WeedCompressingReader, self).__init__()
+        self.fp = fp
+        self.encoding = encoding
+        self.chunk_size = chunk_size or conf.g_stream_chunk_size_in_bytes
+        if encoding == GZIP:
+            # wbits=31: the gzip container, which is what "Content-Encoding: gzip" means
+            self._compressor = zlib.compressobj(6 if level is None else level, zlib.DEFLATED, 31)
+        elif encoding == ZSTD:
+            if zstandard is None:
+                raise ImportError('zstd compression of python-weed requires zstandard. '
+                                  'Install it with: pip install zstandard')
+            self._compressor = zstandard.ZstdCompressor(level=3 if level is None else level).compressobj()
+        else:
+            raise ValueError('unsupported encoding: %s' % encoding)
+        self._buffer = b''
+        self._eof = False
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        # compressors buffer input, so keep feeding them until they give something out
+        while not self._buffer and not self._eof:
+            data = self.fp.read(self.chunk_size)
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            if data:
+                self.bytes_in += len(data)
+                self._buffer = self._compressor.compress(data)
+            else:
+                self._buffer = self._compressor.flush()
+                self._eof = True
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        self.bytes_out += n
+        return n
+
+    def read(self, size=-1) -> bytes:
+        if size is None or size < 0:
+            return self.readall()
+        b = bytearray(size)
+        n = self.readinto(b)
+        return bytes(b[:n])
+
+    def __repr__(self):
+        return f'<WeedCompressingReader: {self.encoding}, {self.bytes_in} -> {self.bytes_out} bytes>'
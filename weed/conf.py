@@ -74,3 +74,128 @@ g_volume_cache_duration_in_seconds = 60
 def set_volume_cache_duration_in_seconds(seconds):
     global g_volume_cache_duration_in_seconds
     g_volume_cache_duration_in_seconds = seconds
+
+
+# timeouts of every http request to master, volume and filer servers(see weed.deadline).
+#  connect_timeout: seconds to wait for a tcp connection
+#  read_timeout: seconds to wait for the server between bytes of its answer, not for the whole answer
+#  deadline: default seconds a whole operation(eg: WeedOperation.get: lookup + download) may take.
+#    None means no deadline, each request is still bounded by the timeouts above
+g_connect_timeout_in_seconds = 5
+g_read_timeout_in_seconds = 60
+g_deadline_in_seconds = None
+
+
+def set_timeouts(connect_timeout_in_seconds=None, read_timeout_in_seconds=None):
+    """ set default connect/read timeouts. takes effect on the next request """
+    global g_connect_timeout_in_seconds, g_read_timeout_in_seconds
+    if connect_timeout_in_seconds is not None:
+        g_connect_timeout_in_seconds = connect_timeout_in_seconds
+    if read_timeout_in_seconds is not None:
+        g_read_timeout_in_seconds = read_timeout_in_seconds
+
+
+def set_deadline_in_seconds(seconds):
+    global g_deadline_in_seconds
+    g_deadline_in_seconds = seconds
+
+
+# caches "volume not found" answers of lookup for a short time, so a bad volume_id does not hammer master.
+#  default is 5 seconds, 0 disables it
+g_volume_negative_cache_duration_in_seconds = 5
+
+# an expired volume location is still served for this long while one background lookup refreshes it.
+#  default is 30 seconds, 0 disables it
+g_volume_cache_stale_duration_in_seconds = 30
+
+
+# seconds a file content cached by a WeedContentCache(see weed.cache) is served without asking
+#  its volume server. after that it is revalidated with its etag. default is 60 seconds
+g_content_cache_duration_in_seconds = 60
+
+
+def set_content_cache_duration_in_seconds(seconds):
+    global g_content_cache_duration_in_seconds
+    g_content_cache_duration_in_seconds = seconds
+
+
+# chunk size used when streaming file contents from/to weed-fs, default is 64KB
+g_stream_chunk_size_in_bytes = 64 * 1024
+
+
+def set_stream_chunk_size_in_bytes(size):
+    global g_stream_chunk_size_in_bytes
+    g_stream_chunk_size_in_bytes = size
+
+
+# chunk size used by WeedOperation.put_large to split a large file into chunks, default is 8MB
+g_chunk_size_in_bytes = 8 * 1024 * 1024
+
+
+def set_chunk_size_in_bytes(size):
+    global g_chunk_size_in_bytes
+    g_chunk_size_in_bytes = size
+
+
+# uploads real files over plain http with the kernel's sendfile, so file contents are not copied
+#  through python(see weed.session.can_sendfile). default is True
+g_upload_with_sendfile = True
+
+
+def set_upload_with_sendfile(enabled):
+    global g_upload_with_sendfile
+    g_upload_with_sendfile = enabled
+
+
+# -----------------------------------------------------------
+# fault tolerance settings of sessions(see weed.breaker).
+#  circuit_breaker_failure_threshold: consecutive failures(connection errors, timeouts, http 502/503/504) which
+#    open the circuit of a host, so requests to it fail at once. 0 disables circuit breakers
+#  circuit_breaker_reset_timeout_in_seconds: an open circuit lets one probe request through after this long
+g_circuit_breaker_failure_threshold = 5
+g_circuit_breaker_reset_timeout_in_seconds = 5
+
+
+def set_circuit_breaker(failure_threshold=None, reset_timeout_in_seconds=None):
+    """ set default circuit breaker settings. takes effect on sessions created afterwards """
+    global g_circuit_breaker_failure_threshold, g_circuit_breaker_reset_timeout_in_seconds
+    if failure_threshold is not None:
+        g_circuit_breaker_failure_threshold = failure_threshold
+    if reset_timeout_in_seconds is not None:
+        g_circuit_breaker_reset_timeout_in_seconds = reset_timeout_in_seconds
+
+
+#  max_retries: retries of a failed idempotent request(GET, HEAD), after a jittered exponential backoff
+#    starting at retry_backoff_in_seconds. 0 disables retries
+#  retry_budget_ratio: all retries of a session stay under this ratio of its requests
+g_max_retries = 2
+g_retry_backoff_in_seconds = 0.05
+g_retry_budget_ratio = 0.1
+
+
+def set_retry(max_retries=None, backoff_in_seconds=None, budget_ratio=None):
+    """ set default retry settings. takes effect on sessions created afterwards """
+    global g_max_retries, g_retry_backoff_in_seconds, g_retry_budget_ratio
+    if max_retries is not None:
+        g_max_retries = max_retries
+    if backoff_in_seconds is not None:
+        g_retry_backoff_in_seconds = backoff_in_seconds
+    if budget_ratio is not None:
+        g_retry_budget_ratio = budget_ratio
+
+
+# -----------------------------------------------------------
+# http connection pool settings of the shared session(see weed.session).
+#  pool_connections: how many per-host pools are kept
+#  pool_maxsize: how many keep-alive connections are kept in each per-host pool
+g_http_pool_connections = 16
+g_http_pool_maxsize = 32
+
+
+def set_http_pool_size(pool_connections=None, pool_maxsize=None):
+    """ set default pool sizes. takes effect on sessions created afterwards """
+    global g_http_pool_connections, g_http_pool_maxsize
+    if pool_connections:
+        g_http_pool_connections = pool_connections
+    if pool_maxsize:
+        g_http_pool_maxsize = pool_maxsize
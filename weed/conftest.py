@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+
+@pytest.fixture
+def http_server():
+    """ start_server(handler_class, **attributes) -> (server, 'http://127.0.0.1:port')
+
+    serves @handler_class(a BaseHTTPRequestHandler, its log messages silenced) on a free port of localhost
+    in a daemon thread, until the test ends. @attributes are set on the server, handlers read them as
+    self.server.<name>.
+    """
+    servers = []
+
+    def start_server(handler_class, **attributes):
+        quiet_handler_class = type(handler_class.__name__, (handler_class,), {'log_message': lambda *args: None})
+        server = ThreadingHTTPServer(('127.0.0.1', 0), quiet_handler_class)
+        for name, value in attributes.items():
+            setattr(server, name, value)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server, 'http://127.0.0.1:%d' % server.server_address[1]
+
+    yield start_server
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,131 @@
+# ** -- coding: utf-8 -- **
+# !/usr/bin/env python
+#
+# Copyright (c) 2011 darkdarkfruit <darkdarkfruit@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+
+
+"""
+deadlines of python-weed operations.
+
+A deadline bounds a whole operation, eg: WeedOperation.get is a master lookup then a download. Within
+"with deadline(seconds)", every request of WeedSession waits at most the time left(besides
+conf.g_connect_timeout_in_seconds and conf.g_read_timeout_in_seconds), and raises WeedDeadlineExceeded
+once no time is left. Deadlines follow the context(contextvars), so they reach worker threads started
+by python-weed and nest: an inner deadline can only shorten an outer one.
+
+eg:
+    with deadline(2.5):
+        wor = op.get(fid)
+    # or
+    wor = op.get(fid, deadline_in_seconds=2.5)
+"""
+
+__all__ = ['WeedDeadline', 'WeedDeadlineExceeded', 'deadline', 'current_deadline', 'deadline_passed', 'check_deadline',
+           'get_timeout']
+
+import contextvars
+import time
+from contextlib import contextmanager
+
+import requests
+
+from weed import conf
+
+
+class WeedDeadlineExceeded(requests.exceptions.Timeout):
+    """ raised when the deadline of an operation has passed """
+
+
+class WeedDeadline(object):
+    """ a point in time(time.monotonic) an operation has to be done by """
+    __slots__ = ('expires_at',)
+
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        """ seconds left, 0 if expired """
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def __repr__(self):
+        return f'<WeedDeadline: {self.remaining():.3f}s left>'
+
+
+_current = contextvars.ContextVar('weed_deadline', default=None)
+
+
+def current_deadline() -> None or WeedDeadline:
+    """ return the deadline of the running operation, None if there is none """
+    return _current.get()
+
+
+@contextmanager
+def deadline(seconds=None):
+    """ run the "with" block within @seconds. defaults to conf.g_deadline_in_seconds, no deadline if both are None.
+
+    yields the WeedDeadline in effect(the earlier one, if already within a deadline), or None
+    """
+    if seconds is None:
+        seconds = conf.g_deadline_in_seconds
+    outer = _current.get()
+    if seconds is None or (outer is not None and outer.remaining() <= seconds):
+        yield outer
+        return
+    token = _current.set(WeedDeadline(seconds))
+    try:
+        yield _current.get()
+    finally:
+        _current.reset(token)
+
+
+def deadline_passed() -> bool:
+    """ True if the current deadline has passed. after a failed request, it tells the deadline was too short,
+    rather than the server being down """
+    current = _current.get()
+    return current is not None and current.expired()
+
+
+def check_deadline(current=None):
+    """ raise WeedDeadlineExceeded if @current(defaults to the current deadline) has passed. call it between
+    chunks of a long read, which socket timeouts alone do not bound """
+    if current is None:
+        current = _current.get()
+    if current is not None and current.expired():
+        raise WeedDeadlineExceeded('deadline exceeded')
+
+
+def get_timeout() -> (float, float):
+    """ return (connect_timeout, read_timeout) for the next request: the conf defaults, capped by the time
+    left of the current deadline. raises WeedDeadlineExceeded if the deadline has passed.
+    """
+    connect, read = conf.g_connect_timeout_in_seconds, conf.g_read_timeout_in_seconds
+    current = _current.get()
+    if current is None:
+        return connect, read
+    remaining = current.remaining()
+    if remaining <= 0:
+        raise WeedDeadlineExceeded('deadline exceeded')
+    return min(connect or remaining, remaining), min(read or remaining, remaining)
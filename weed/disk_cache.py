@@ -0,0 +1,342 @@
+# ** -- coding: utf-8 -- **
+# !/usr/bin/env python
+#
+# Copyright (c) 2011 darkdarkfruit <darkdarkfruit@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+
+
+"""
+a persistent on-disk cache of file contents, eg: for edge nodes whose working set should survive restarts.
+
+Contents are stored content-addressed(by sha256) under @directory, so a file cached under many fids takes
+the disk once. A sqlite index(in WAL mode) maps keys to contents, so several processes on one host can
+share one directory.
+
+eg:
+    disk_cache = WeedDiskCache('/var/cache/weed', max_bytes=10 * 1024 ** 3)
+    op = WeedOperation(disk_cache=disk_cache)
+
+    # or serve a hit straight from the file, eg: with sendfile
+    entry, etag, fresh = disk_cache.get(fid)
+    if fresh:
+        with entry.open() as f:
+            sock.sendfile(f)
+"""
+
+__all__ = ['WeedDiskCache', 'WeedDiskCacheEntry']
+
+import hashlib
+import mmap
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from weed import conf
+from weed.conf import g_logger
+
+
+@dataclass
+class WeedDiskCacheEntry(object):
+    """ a cached content: @size bytes in the file at @path """
+    key: str = ''
+    path: str = ''
+    size: int = 0
+    etag: str = ''
+    content_type: str = ''
+    expires_at: float = 0
+
+    def open(self):
+        """ the content file opened in binary mode, a real file to sendfile or stream from """
+        return open(self.path, 'rb')
+
+    def mmap(self) -> mmap.mmap:
+        """ a read-only memory map of the content. an empty content can not be mapped """
+        with self.open() as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read(self) -> bytes:
+        with self.open() as f:
+            return f.read()
+
+
+class WeedDiskCache(object):
+    """ a disk cache of file contents bounded by total bytes, shared by threads and processes.
+
+    Like WeedContentCache, an expired entry is kept(until evicted) with its etag, so the owner can
+    revalidate it with "If-None-Match" and call refresh on a "304 Not Modified".
+    """
+
+    POLICIES = ('lru', 'lfu')
+
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024, max_object_size=64 * 1024 * 1024, ttl=None,
+                 policy='lru', pool_size=4, access_flush_interval_in_seconds=5):
+        """
+
+        Arguments:
+        - `directory`: where the index and the contents are kept, created if missing
+        - `max_bytes`: entries are evicted while the contents take more than this
+        - `max_object_size`: larger contents are not cached
+        - `ttl`: seconds an entry is fresh. defaults to conf.g_content_cache_duration_in_seconds(read on every set)
+        - `policy`: which entries are evicted first, 'lru': least recently used, 'lfu': least frequently used
+        - `pool_size`: at most this many idle sqlite connections are kept for reuse, extra ones are closed
+        - `access_flush_interval_in_seconds`: hits update access times and counts in memory, they are written
+            to the index at most this often(and before evicting), so reads do not take the write lock
+        """
+        if policy not in self.POLICIES:
+            raise ValueError('policy should be one of %s, not "%s"' % (self.POLICIES, policy))
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_object_size = max_object_size
+        self.ttl = ttl
+        self.policy = policy
+
+        self._objects_dir = os.path.join(directory, 'objects')
+        self._tmp_dir = os.path.join(directory, 'tmp')
+        os.makedirs(self._objects_dir, exist_ok=True)
+        os.makedirs(self._tmp_dir, exist_ok=True)
+        self._index_path = os.path.join(directory, 'index.sqlite')
+
+        self.pool_size = pool_size
+        self.access_flush_interval_in_seconds = access_flush_interval_in_seconds
+        self._idle = []  # idle sqlite connections, at most pool_size
+        self._lock = threading.Lock()
+        self._accesses = {}  # key -> [last accessed_at, hits] not written to the index yet
+        self._accesses_flushed_at = time.time()
+
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+        with self._transaction() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, digest TEXT NOT NULL, '
+                       'size INTEGER NOT NULL, etag TEXT, content_type TEXT, expires_at REAL, '
+                       'accessed_at REAL, hits INTEGER NOT NULL DEFAULT 0)')
+            db.execute('CREATE INDEX IF NOT EXISTS entries_digest ON entries(digest)')
+            db.execute('CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries(accessed_at)')
+
+    @contextmanager
+    def _db(self):
+        """ a sqlite connection from the pool, given back(or closed, if the pool is full) afterwards """
+        with self._lock:
+            db = self._idle.pop() if self._idle else None
+        if db is None:
+            # autocommit, writes take the lock with "BEGIN IMMEDIATE" in _transaction
+            db = sqlite3.connect(self._index_path, timeout=30, isolation_level=None, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+        try:
+            yield db
+        finally:
+            with self._lock:
+                if len(self._idle) < self.pool_size:
+                    self._idle.append(db)
+                    db = None
+            if db is not None:
+                db.close()
+
+    @contextmanager
+    def _transaction(self):
+        """ a write transaction, which excludes the writers of other threads and processes """
+        with self._db() as db:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                yield db
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+            db.execute('COMMIT')
+
+    def _record_access(self, key, now):
+        """ remember a hit of @key in memory, and write the remembered ones if they are due """
+        with self._lock:
+            access = self._accesses.get(key)
+            if access is None:
+                self._accesses[key] = [now, 1]
+            else:
+                access[0] = now
+                access[1] += 1
+            due = now - self._accesses_flushed_at >= self.access_flush_interval_in_seconds
+        if due:
+            with self._transaction() as db:
+                self._flush_accesses(db)
+
+    def _flush_accesses(self, db):
+        """ write access times and hit counts remembered by _record_access. call it inside _transaction """
+        with self._lock:
+            accesses, self._accesses = self._accesses, {}
+            self._accesses_flushed_at = time.time()
+        if accesses:
+            db.executemany('UPDATE entries SET accessed_at = MAX(COALESCE(accessed_at, 0), ?), hits = hits + ? '
+                           'WHERE key = ?', [(at, hits, key) for key, (at, hits) in accesses.items()])
+
+    def _path(self, digest) -> str:
+        return os.path.join(self._objects_dir, digest[:2], digest)
+
+    def _expires_at(self, ttl=None):
+        if ttl is None:
+            ttl = conf.g_content_cache_duration_in_seconds if self.ttl is None else self.ttl
+        return time.time() + ttl
+
+    def get(self, key) -> (WeedDiskCacheEntry, str, bool):
+        """ return (entry, etag, fresh) of @key, (None, '', False) if missing.
+
+        an expired entry is returned with fresh=False, to be revalidated with its etag.
+        """
+        with self._db() as db:
+            row = db.execute('SELECT digest, size, etag, content_type, expires_at FROM entries WHERE key = ?',
+                             (key,)).fetchone()
+        if row is None or not os.path.exists(self._path(row[0])):
+            if row is not None:  # its file was removed behind our back
+                self.invalidate(key)
+            with self._lock:
+                self.misses += 1
+            return None, '', False
+        digest, size, etag, content_type, expires_at = row
+        now = time.time()
+        self._record_access(key, now)
+        fresh = now < expires_at
+        if fresh:
+            with self._lock:
+                self.hits += 1
+        entry = WeedDiskCacheEntry(key, self._path(digest), size, etag or '', content_type or '', expires_at)
+        return entry, entry.etag, fresh
+
+    def set(self, key, content, etag='', content_type='', ttl=None):
+        """ cache @content(bytes) of @key. nothing is cached if it is larger than max_object_size """
+        size = len(content)
+        if size > self.max_object_size or size > self.max_bytes:
+            self.invalidate(key)
+            return
+        digest = hashlib.sha256(content).hexdigest()
+        # write outside of the index lock, then move it in place under the lock
+        with tempfile.NamedTemporaryFile(dir=self._tmp_dir, delete=False) as f:
+            f.write(content)
+        try:
+            with self._transaction() as db:
+                row = db.execute('SELECT digest FROM entries WHERE key = ?', (key,)).fetchone()
+                path = self._path(digest)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(f.name, path)
+                now = time.time()
+                with self._lock:  # a new content starts counting its hits anew
+                    self._accesses.pop(key, None)
+                db.execute('INSERT OR REPLACE INTO entries(key, digest, size, etag, content_type, expires_at, '
+                           'accessed_at, hits) VALUES (?, ?, ?, ?, ?, ?, ?, 0)',
+                           (key, digest, size, etag, content_type, self._expires_at(ttl), now))
+                if row is not None and row[0] != digest:
+                    self._remove_if_unused(db, row[0])
+                self._flush_accesses(db)  # evict by up to date access times
+                self._evict(db, keep=key)
+        finally:
+            if os.path.exists(f.name):
+                os.remove(f.name)
+
+    def _remove_if_unused(self, db, digest):
+        """ remove the file of @digest if no entry refers to it. call it inside _transaction """
+        if db.execute('SELECT 1 FROM entries WHERE digest = ? LIMIT 1', (digest,)).fetchone() is None:
+            try:
+                os.remove(self._path(digest))
+            except FileNotFoundError:
+                pass
+
+    def _evict(self, db, keep=None):
+        """ evict entries until the contents fit in max_bytes. call it inside _transaction
+
+        @keep: the key just set, never evicted. with 'lfu' it has no hits yet, so it would go first
+        """
+        total = db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        order = 'accessed_at' if self.policy == 'lru' else 'hits, accessed_at'
+        while total > self.max_bytes:
+            rows = db.execute('SELECT key, digest, size FROM entries WHERE key IS NOT ? ORDER BY %s LIMIT 16' % order,
+                              (keep,)).fetchall()
+            if not rows:
+                break
+            for key, digest, size in rows:
+                db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                self._remove_if_unused(db, digest)
+                with self._lock:
+                    self.evictions += 1
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+    def refresh(self, key, ttl=None):
+        """ make the entry of @key fresh again, eg: after a "304 Not Modified" """
+        with self._db() as db:
+            db.execute('UPDATE entries SET expires_at = ? WHERE key = ?', (self._expires_at(ttl), key))
+        with self._lock:
+            self.revalidations += 1
+
+    def invalidate(self, key):
+        with self._transaction() as db:
+            row = db.execute('SELECT digest FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                self._remove_if_unused(db, row[0])
+
+    def clear(self):
+        with self._transaction() as db:
+            db.execute('DELETE FROM entries')
+            with self._lock:
+                self._accesses.clear()
+            shutil.rmtree(self._objects_dir, ignore_errors=True)
+            os.makedirs(self._objects_dir, exist_ok=True)
+
+    def stats(self) -> {}:
+        """ return counters of this instance: hits(fresh ones), misses, revalidations(304s) and evictions,
+        with size and bytes of the whole cache """
+        with self._db() as db:
+            size, total = db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'revalidations': self.revalidations,
+                'evictions': self.evictions, 'size': size, 'bytes': total}
+
+    def close(self):
+        """ write remembered accesses and close the idle sqlite connections """
+        try:
+            with self._transaction() as db:
+                self._flush_accesses(db)
+        except sqlite3.Error as e:
+            g_logger.warning('Could not write accesses to disk cache index: %s. e: %s' % (self._index_path, e))
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for db in idle:
+            try:
+                db.close()
+            except Exception as e:
+                g_logger.warning('Could not close disk cache index: %s. e: %s' % (self._index_path, e))
+
+    def __contains__(self, key):
+        with self._db() as db:
+            return db.execute('SELECT 1 FROM entries WHERE key = ?', (key,)).fetchone() is not None
+
+    def __len__(self):
+        with self._db() as db:
+            return db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def __repr__(self):
+        return f'<WeedDiskCache: {self.directory}, max_bytes={self.max_bytes}, policy={self.policy}>'
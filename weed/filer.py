@@ -35,6 +35,10 @@ import io
 import os
 from urllib import parse
 
+from weed.session import get_default_session
+from weed import conf
+from weed.deadline import deadline
+from weed.stream import WeedMultipartEncoder, WeedRangeFile, WeedRangeReader, get_ranges
 from weed.util import *
 
 
@@ -42,19 +46,23 @@ class WeedFiler(object):
     """ weed filer service.
     """
 
-    def __init__(self, url_base='http://localhost:27100'):
+    def __init__(self, url_base='http://localhost:27100', session=None, compression=None):
         """ construct WeedFiler
 
         Arguments:
         - `host`: defaults to '127.0.0.1'
         - `port`: defaults to 27100
+        - `session`: the WeedSession to send requests through, defaults to the shared one
+        - `compression`: a WeedCompression. "put" compresses the files it picks while uploading them
         :param url_base:
         """
 
         self.url_base = url_base
+        self.session = session or get_default_session()
+        self.compression = compression
         self.uri = self.url_base.split('//')[-1]
 
-    def get(self, remote_path) -> None or {}:
+    def get(self, remote_path, deadline_in_seconds=None) -> None or {}:
         """ put a file @fp to @remote_path on seaweedfs
 
         returns @remote_path if succeeds else None
@@ -62,90 +70,148 @@ class WeedFiler(object):
         - `self`:
         - `remote_path`:
         - `echo`: if True, print response
+        - `deadline_in_seconds`: the call gives up after it. defaults to conf.g_deadline_in_seconds
+        """
+        with deadline(deadline_in_seconds):
+            url = parse.urljoin(self.url_base, remote_path)
+            try:
+                rsp = self.session.get(url)
+                if rsp.ok:
+                    result = {'content_length': rsp.headers.get('content-length'),
+                              'content_type': rsp.headers.get('content-type'),
+                              'content': rsp.content}
+                    return result
+                else:
+                    g_logger.error('%d GET %s' % (rsp.status_code, url))
+                    return None
+            except Exception as e:
+                g_logger.error('Error POSTing %s. e:%s' % (url, e))
+                return None
+
+    def get_range(self, remote_path, offset, length, deadline_in_seconds=None) -> None or {}:
+        """ read @length bytes from @offset of @remote_path with a http Range request.
+
+        returns a dict like "get" whose "content" holds only those bytes, else None
+        """
+        result = self.get_ranges(remote_path, [(offset, length)], deadline_in_seconds)
+        return result[0] if result else None
+
+    def get_ranges(self, remote_path, ranges, deadline_in_seconds=None) -> None or [{}]:
+        """ read byte @ranges([(offset, length), ...]) of @remote_path with one multi-range http request.
+
+        returns a list of dicts like "get", one for each range, else None
+
+        @deadline_in_seconds: the call gives up after it. defaults to conf.g_deadline_in_seconds
+        """
+        with deadline(deadline_in_seconds):
+            url = parse.urljoin(self.url_base, remote_path)
+            try:
+                rsp, contents = get_ranges(self.session, url, ranges)
+                content_type = rsp.headers.get('content-type') if rsp is not None else ''
+                return [{'content_length': len(content), 'content_type': content_type, 'content': content}
+                        for content in contents]
+            except Exception as e:
+                g_logger.error('Error GETing ranges %s of %s. e:%s' % (ranges, url, e))
+                return None
+
+    def get_range_file(self, remote_path, buffer_size=None) -> None or io.BufferedReader:
+        """ return a readonly, seekable file-object of @remote_path which downloads lazily
+        with http Range requests, at least @buffer_size bytes a time. else None
         """
         url = parse.urljoin(self.url_base, remote_path)
         try:
-            rsp = requests.get(url)
-            if rsp.ok:
-                result = {'content_length': rsp.headers.get('content-length'),
-                          'content_type': rsp.headers.get('content-type'),
-                          'content': rsp.content}
-                return result
-            else:
-                g_logger.error('%d GET %s' % (rsp.status_code, url))
+            rsp = self.session.head(url, headers={'Accept-Encoding': 'identity'})
+            if not rsp.ok:
+                g_logger.error('%d HEAD %s' % (rsp.status_code, url))
                 return None
+            size = int(rsp.headers['content-length'])
         except Exception as e:
-            g_logger.error('Error POSTing %s. e:%s' % (url, e))
+            g_logger.error('Error HEADing %s. e:%s' % (url, e))
             return None
 
-    def put(self, fp, remote_path) -> None or str:
+        return io.BufferedReader(WeedRangeFile(WeedRangeReader(self.session, url), size, remote_path),
+                                 buffer_size or conf.g_stream_chunk_size_in_bytes)
+
+    def put(self, fp, remote_path, deadline_in_seconds=None) -> None or str:
         """ put a file @fp to @remote_path on seaweedfs
 
         returns @remote_path if succeeds else None
         :arg
         - `fp`: either a file-handler by method open(with binary mode) or a str to the file-path.
         - `remote_path`:
+        - `deadline_in_seconds`: the call gives up after it. defaults to conf.g_deadline_in_seconds
         :returns
         None or str-of-remote-path
 
         """
-        url = parse.urljoin(self.url_base, remote_path)
-        is_our_responsibility_to_close_file = False
-        if isinstance(fp, str):
-            _fp = open(fp, 'rb')
-            is_our_responsibility_to_close_file = True
-        else:
-            _fp = fp
-        result = None
-        try:
-            rsp = requests.post(url, files={'file': _fp})
-            if rsp.ok:
-                result = remote_path
+        with deadline(deadline_in_seconds):
+            url = parse.urljoin(self.url_base, remote_path)
+            is_our_responsibility_to_close_file = False
+            if isinstance(fp, str):
+                _fp = open(fp, 'rb')
+                is_our_responsibility_to_close_file = True
             else:
-                g_logger.error('%d POST %s' % (rsp.status_code, url))
-        except Exception as e:
-            g_logger.error('Error POSTing %s. e:%s' % (url, e))
-
-        # close fp if parameter fp is a str
-        if is_our_responsibility_to_close_file:
+                _fp = fp
+            result = None
             try:
-                _fp.close()
+                # stream the body from _fp chunk by chunk instead of building it in memory
+                content_encoding = choose_content_encoding(self.compression, _fp, os.path.basename(remote_path))
+                encoder = WeedMultipartEncoder(_fp, os.path.basename(remote_path), field_name='file',
+                                               content_encoding=content_encoding,
+                                               compression_level=self.compression.level if content_encoding else None)
+                rsp = post_multipart(url, encoder, session=self.session)
+                if rsp.ok:
+                    result = remote_path
+                else:
+                    g_logger.error('%d POST %s' % (rsp.status_code, url))
             except Exception as e:
-                g_logger.warning('Could not close fp: %s. e: %s' % (_fp, e))
-
-        return result
-
-    def delete(self, remote_path) -> bool:
-        """ remove a @remote_path by http DELETE """
-        url = parse.urljoin(self.url_base, remote_path)
-        try:
-            rsp = requests.delete(url)
-            if not rsp.ok:
-                g_logger.error('Error deleting file: %s. ' % remote_path)
-            return rsp.ok
-        except Exception as e:
-            g_logger.error('Error deleting file: %s. e: %s' % (remote_path, e))
-            return False
+                g_logger.error('Error POSTing %s. e:%s' % (url, e))
+
+            # close fp if parameter fp is a str
+            if is_our_responsibility_to_close_file:
+                try:
+                    _fp.close()
+                except Exception as e:
+                    g_logger.warning('Could not close fp: %s. e: %s' % (_fp, e))
+
+            return result
+
+    def delete(self, remote_path, deadline_in_seconds=None) -> bool:
+        """ remove a @remote_path by http DELETE, giving up after @deadline_in_seconds(defaults to
+        conf.g_deadline_in_seconds) """
+        with deadline(deadline_in_seconds):
+            url = parse.urljoin(self.url_base, remote_path)
+            try:
+                rsp = self.session.delete(url)
+                if not rsp.ok:
+                    g_logger.error('Error deleting file: %s. ' % remote_path)
+                return rsp.ok
+            except Exception as e:
+                g_logger.error('Error deleting file: %s. e: %s' % (remote_path, e))
+                return False
 
-    def list(self, directory) -> None or {}:
+    def list(self, directory, deadline_in_seconds=None) -> None or {}:
         """ list sub folders and files of @dir. show a better look if you turn on @pretty
 
         returns a dict of "sub-folders and files'
+
+        @deadline_in_seconds: the call gives up after it. defaults to conf.g_deadline_in_seconds
         """
-        d = directory if directory.endswith('/') else (directory + '/')
-        url = parse.urljoin(self.url_base, d)
-        headers = {'Accept': 'application/json'}
-        try:
-            rsp = requests.get(url, headers=headers)
-            if not rsp.ok:
-                g_logger.error('Error listing "%s". [HTTP %d]' % (url, rsp.status_code))
-                return None
-            return rsp.json()
-        except Exception as e:
-            g_logger.error('Error listing "%s". e: %s' % (url, e))
-        return None
+        with deadline(deadline_in_seconds):
+            d = directory if directory.endswith('/') else (directory + '/')
+            url = parse.urljoin(self.url_base, d)
+            headers = {'Accept': 'application/json'}
+            try:
+                rsp = self.session.get(url, headers=headers)
+                if not rsp.ok:
+                    g_logger.error('Error listing "%s". [HTTP %d]' % (url, rsp.status_code))
+                    return None
+                return rsp.json()
+            except Exception as e:
+                g_logger.error('Error listing "%s". e: %s' % (url, e))
+            return None
 
-    def mkdir(self, directory) -> None or str:
+    def mkdir(self, directory, deadline_in_seconds=None) -> None or str:
         """ make dir on filer.
 
         eg:
@@ -154,4 +220,4 @@ class WeedFiler(object):
 
         We will post a file named '.info' to @_dir.
         """
-        return self.put(io.StringIO('.info'), os.path.join(directory, '.info'))
+        return self.put(io.StringIO('.info'), os.path.join(directory, '.info'), deadline_in_seconds)
@@ -0,0 +1,190 @@
+# ** -- coding: utf-8 -- **
+# !/usr/bin/env python
+#
+# Copyright (c) 2011 darkdarkfruit <darkdarkfruit@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+
+
+"""
+hedged reads: if a replica has not answered in time, ask another one too and take the first answer.
+
+WeedHedgePolicy decides when to hedge: after a fixed delay, or after a percentile of the latencies
+seen so far(eg: p95, so about 5% of reads are hedged). A token bucket caps hedges at a ratio of all
+reads, so a slow cluster is not flooded with duplicated requests.
+
+eg:
+    op = WeedOperation(hedge=WeedHedgePolicy(percentile=95, max_hedge_ratio=0.05))
+"""
+
+__all__ = ['WeedHedgePolicy', 'WeedCancelToken', 'cancellable', 'current_cancel_token']
+
+import collections
+import contextvars
+import socket
+import threading
+from contextlib import contextmanager
+
+
+class WeedHedgePolicy(object):
+    """ when to send a hedged read, and how many of them. thread-safe. """
+
+    def __init__(self, delay_in_seconds=None, percentile=95, min_samples=20, window=1000,
+                 max_hedge_ratio=0.05, burst=10):
+        """
+
+        Arguments:
+        - `delay_in_seconds`: hedge after this delay. if None, after @percentile of recent latencies
+        - `percentile`: percentile of the last @window latencies to hedge after, when no fixed delay is given
+        - `min_samples`: do not hedge on a learned delay until this many latencies are recorded
+        - `window`: number of recent latencies to learn from
+        - `max_hedge_ratio`: at most this ratio of reads is hedged, in the long run
+        - `burst`: at most this many hedges in a row when reads have been fast for a while
+        """
+        self.delay_in_seconds = delay_in_seconds
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.max_hedge_ratio = max_hedge_ratio
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=window)
+        self._learned_delay = None
+        self._new_samples = 0
+        self._tokens = float(burst)
+        self._stats = {'reads': 0, 'hedges': 0, 'hedge_wins': 0, 'denied': 0}
+
+    def next_delay(self) -> None or float:
+        """ call it once per read. returns seconds to wait before hedging it, None not to hedge """
+        with self._lock:
+            self._stats['reads'] += 1
+            self._tokens = min(self.burst, self._tokens + self.max_hedge_ratio)
+            if self.delay_in_seconds is not None:
+                return self.delay_in_seconds
+            if len(self._latencies) < self.min_samples:
+                return None
+            # sorting the window for each read is too slow, recompute every 1/10 of it
+            if self._learned_delay is None or self._new_samples >= self._latencies.maxlen // 10:
+                latencies = sorted(self._latencies)
+                self._learned_delay = latencies[min(len(latencies) - 1, len(latencies) * self.percentile // 100)]
+                self._new_samples = 0
+            return self._learned_delay
+
+    def try_hedge(self) -> bool:
+        """ take a hedge out of the budget. returns False if the budget is used up """
+        with self._lock:
+            if self._tokens < 1:
+                self._stats['denied'] += 1
+                return False
+            self._tokens -= 1
+            self._stats['hedges'] += 1
+            return True
+
+    def record(self, latency, hedge_won=False):
+        """ record the @latency in seconds of a successful request, and whether a hedge answered first.
+        for a request cancelled as another one answered first, record the time it had taken so far """
+        with self._lock:
+            self._latencies.append(latency)
+            self._new_samples += 1
+            if hedge_won:
+                self._stats['hedge_wins'] += 1
+
+    def stats(self) -> {}:
+        """ return {'reads', 'hedges', 'hedge_wins', 'denied', 'delay'} """
+        with self._lock:
+            return dict(self._stats, delay=self.delay_in_seconds or self._learned_delay)
+
+    def __repr__(self):
+        return f'<WeedHedgePolicy: delay={self.delay_in_seconds}, percentile={self.percentile}>'
+
+
+class WeedCancelToken(object):
+    """ cancels a request which lost a hedged read: while it waits for the response headers, by shutting
+    down the socket of its connection(see cancellable), then by closing its streamed response """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.cancelled = False
+        self._response = None
+        self._connections = set()
+
+    def register_connection(self, conn):
+        """ shut down the socket of @conn(a http.client.HTTPConnection waiting for a response) on cancel(),
+        or at once if already cancelled. WeedSession calls it within "with cancellable(token)" """
+        with self._lock:
+            if not self.cancelled:
+                self._connections.add(conn)
+                return
+        self._shutdown(conn)
+
+    def forget_connection(self, conn):
+        """ @conn got its response(or failed), it may go back to the pool and serve other requests """
+        with self._lock:
+            self._connections.discard(conn)
+
+    @staticmethod
+    def _shutdown(conn):
+        # shutdown, unlike close, wakes up the thread blocked reading the socket
+        sock = getattr(conn, 'sock', None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def register(self, response):
+        """ close the streamed @response on cancel(), or at once if already cancelled """
+        with self._lock:
+            self._response = response
+            if not self.cancelled:
+                return
+        response.close()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True  # set before closing, so a body cut short is known to be cancelled
+            response, self._response = self._response, None
+            connections, self._connections = self._connections, set()
+        for conn in connections:
+            self._shutdown(conn)
+        if response is not None:
+            response.close()
+
+
+_current_token = contextvars.ContextVar('weed_cancel_token', default=None)
+
+
+def current_cancel_token() -> None or WeedCancelToken:
+    """ return the WeedCancelToken of the running request, None if it can not be cancelled """
+    return _current_token.get()
+
+
+@contextmanager
+def cancellable(token):
+    """ let @token(a WeedCancelToken, or None) cancel the requests of WeedSession in the "with" block,
+    even before their response headers arrive """
+    if token is None:
+        yield
+        return
+    reset = _current_token.set(token)
+    try:
+        yield
+    finally:
+        _current_token.reset(reset)
@@ -36,14 +36,16 @@ note:
 
 """
 
-from urllib.parse import urljoin
+from urllib.parse import urlencode, urljoin
 
 __all__ = ['WeedMaster']
 
-import time
+from weed import conf
 from weed.conf import *
 from weed.util import *
 
+from weed.cache import WeedTTLCache
+from weed.session import get_default_session
 from weed.volume import WeedVolume
 
 
@@ -52,27 +54,36 @@ class WeedMaster(object):
     Weed-FS's master server (relative to volume-server)
     """
 
-    def __init__(self, url_base='http://localhost:9333', prefetch_volume_ids=False):
+    def __init__(self, url_base='http://localhost:9333', prefetch_volume_ids=False, session=None,
+                 volume_cache_size=10000):
         """
 
         Arguments:
         - `url_base`: default: 'http://localhost:9333'
-        - `prefetch_volume_ids`: if True, prefech volumeIds to cache: self.volumes_cache
+        - `prefetch_volume_ids`: if True, prefech locations of all volumes in topology to cache: self.volumes_cache
+        - `session`: the WeedSession to send requests through, defaults to the shared one
+        - `volume_cache_size`: max number of volume locations kept in self.volumes_cache
         :param url_base:
         """
         self.url_base = url_base
+        self.session = session or get_default_session()
         self.url_assign = urljoin(self.url_base, '/dir/assign')
         self.url_lookup = urljoin(self.url_base, '/dir/lookup')
         self.url_vacuum = urljoin(self.url_base, '/vol/vacuum')
         self.url_status = urljoin(self.url_base, '/dir/status')
 
-        # volumes usually do not move, so we cache it here for 1 minute.
-        self.volumes_cache = {}
+        # volumes usually do not move, so we cache it here for conf.g_volume_cache_duration_in_seconds.
+        self.volumes_cache = WeedTTLCache(max_size=volume_cache_size,
+                                          negative_ttl=conf.g_volume_negative_cache_duration_in_seconds,
+                                          stale_ttl=conf.g_volume_cache_stale_duration_in_seconds)
+        # locations on a host found down are looked up again, in case its volumes moved
+        breaker = getattr(self.session, 'breaker', None)
+        if breaker is not None:
+            breaker.add_listener(self._on_host_down)
 
         if prefetch_volume_ids:
-            g_logger.info("prefetching volumeIds(['1' : '10'] into cache")
-            for i in range(10):
-                self.lookup(str(i + 1))
+            g_logger.info("prefetching locations of all volumes into cache")
+            self.warm_up_volume_cache()
 
     def acquire_assign_info(self) -> None or {}:
         """
@@ -86,7 +97,7 @@ class WeedMaster(object):
         - `self`:
         """
         try:
-            r = requests.get(self.url_assign)
+            r = self.session.get(self.url_assign)
             result = json.loads(r.content)
         except Exception as e:
             g_logger.error('Could not get status of this volume: %s. Exception is: %s'
@@ -98,11 +109,14 @@ class WeedMaster(object):
         """ deprecated. Please use acquie_new_assign_key function instead """
         return self.acquire_assign_info()
 
-    def acquire_new_assign_key(self, count=1) -> None or WeedAssignKeyExtended:
+    def acquire_new_assign_key(self, count=1, collection=None, replication=None,
+                               ttl=None) -> None or WeedAssignKeyExtended:
         """
         get a new avalable new volume-file-location from from weed-master by getting a new-assign-key
         Arguments:
         - `self`:
+        - `count`: reserve @count fids: fid, fid_1, fid_2, ... fid_{count-1}
+        - `collection`, `replication`, `ttl`: passed to master as is if provided. eg: 'pics', '001', '3d'
 
         assign_key is in json format like below:
         -----------
@@ -116,12 +130,16 @@ class WeedMaster(object):
         ----------
 
         """
-        assign_key_url = urljoin(self.url_assign, '?count=' + str(count))
+        params = {'count': count}
+        for k, v in (('collection', collection), ('replication', replication), ('ttl', ttl)):
+            if v:
+                params[k] = v
+        assign_key_url = urljoin(self.url_assign, '?' + urlencode(params))
         # dst_volume_url = None
         wak = WeedAssignKeyExtended()
         try:
             g_logger.debug('Getting new dst_volume_url with master-assign-key-url_base: %s' % assign_key_url)
-            r = requests.get(assign_key_url)
+            r = self.session.get(assign_key_url)
             # key_dict sample:
             # {'fid': '2,02b47f02c9e3', 'url': '192.168.1.102:27001', 'publicUrl': '192.168.1.102:27001', 'count': 10}
             key_dict = json.loads(r.content)
@@ -138,7 +156,7 @@ class WeedMaster(object):
             return None
         return wak
 
-    def lookup(self, volume_id_or_fid, cache_duration_in_seconds=g_volume_cache_duration_in_seconds) -> None or {}:
+    def lookup(self, volume_id_or_fid, cache_duration_in_seconds=None) -> None or {}:
         """
         lookup the locations of a volume@volume_id_or_fid.
         returns a dict like below if successful else None:
@@ -155,39 +173,114 @@ class WeedMaster(object):
 
         Arguments:
         - `self`:
+        - `cache_duration_in_seconds`: if given, do not use cached locations older than this.
+            cached locations expire after conf.g_volume_cache_duration_in_seconds anyway.
         """
-        if ',' in volume_id_or_fid:
-            _volume_id = volume_id_or_fid.split(',')[0]
-        elif '/' in volume_id_or_fid:
-            _volume_id = volume_id_or_fid.split('/')[0]
-        else:
-            _volume_id = volume_id_or_fid
-        # result = None
+        _volume_id = get_volume_id(volume_id_or_fid)
+        # concurrent misses of the same volume_id share one request to master.
+        # "not found" is cached shortly; expired locations are served while being refreshed in background.
         try:
-            # g_logger.warning('id(master): %x, cache should be hit: %s' % (id(self), self.volumes_cache.has_key(_volume_id)))
-            # g_logger.warning('self.volumes_cache: %s' % self.volumes_cache)
-            # try cache first
-            if _volume_id in self.volumes_cache and (
-                    time.time() - self.volumes_cache[_volume_id][1]) <= cache_duration_in_seconds:
-                g_logger.debug('volume_cache(lookup by volume_id) hits')
-                return self.volumes_cache[_volume_id][0]
-            else:
-                r = requests.get(self.url_lookup + '?volumeId=%s' % _volume_id)
-                if not r.ok:  # not HTTP-200, like HTTP-404, ...
-                    return None
-                result = json.loads(r.content)
-
-                # refresh cache
-                self.volumes_cache.update({_volume_id: (result, time.time())})
-                # g_logger.warning('volume_cache(lookup by volume_id) not hit, dst: %s, keys: %s' % (_volume_id, self.volumes_cache.keys())
-
-            # g_logger.warning('after updating, self.volumes_cache: %s' % self.volumes_cache)
+            return self.volumes_cache.get_or_load(_volume_id, self._lookup, max_age=cache_duration_in_seconds)
+        except Exception:
+            return None
+
+    def _lookup(self, volume_id) -> None or {}:
+        """ lookup @volume_id on master, bypassing the cache.
 
+        returns None if master says it is not found, raises if master could not be reached.
+        """
+        try:
+            r = self.session.get(self.url_lookup + '?volumeId=%s' % volume_id)
+            if not r.ok:  # not HTTP-200, like HTTP-404, ...
+                g_logger.warning('Volume %s not found. [HTTP %d]' % (volume_id, r.status_code))
+                return None
+            return json.loads(r.content)
         except Exception as e:
             g_logger.error("Could not get status of this volume: %s. "
                            "Exception is: %s" % (self.url_status, e))
-            result = None
-        return result
+            raise
+
+    def _on_host_down(self, host):
+        """ forget cached locations of volumes on @host(eg: '127.0.0.1:8080'), called when its circuit opens """
+        def _on_host(volume_id, lookup_result):
+            return bool(lookup_result) and any(host in (location.get('url'), location.get('publicUrl'))
+                                               for location in lookup_result.get('locations', []))
+
+        count = self.volumes_cache.invalidate_if(_on_host)
+        if count:
+            g_logger.info('forgot locations of %d volumes on %s, which is down' % (count, host))
+
+    def lookup_many(self, volume_ids_or_fids, max_workers=16) -> {}:
+        """
+        lookup the locations of many volumes in one or a few master calls.
+        returns a dict of {volume_id: result of lookup(volume_id)}.
+
+        cached volumes are served from cache; if more than one volume misses, the locations of all
+        volumes are read from one "/dir/status"(topology) call; the rest are looked up concurrently.
+        """
+        volume_ids = {get_volume_id(v) for v in volume_ids_or_fids}
+        results = {}
+        for volume_id in volume_ids:
+            found, locations = self.volumes_cache.peek(volume_id)
+            if found:
+                results[volume_id] = locations
+        misses = volume_ids - set(results)
+
+        if len(misses) > 1:
+            for volume_id, locations in self._get_locations_from_topology(self.get_status()).items():
+                self.volumes_cache.set(volume_id, locations)
+                if volume_id in misses:
+                    results[volume_id] = locations
+            misses -= set(results)
+
+        results.update(run_concurrently(lambda v: (v, self.lookup(v)), misses, max_workers=max_workers))
+        return results
+
+    def warm_up_volume_cache(self) -> int:
+        """
+        fill self.volumes_cache with locations of all writable/readable volumes in topology.
+        returns how many volumes are cached.
+        """
+        status = self.get_status()
+        locations_by_volume_id = self._get_locations_from_topology(status)
+        for volume_id, locations in locations_by_volume_id.items():
+            self.volumes_cache.set(volume_id, locations)
+
+        # topology of old weed-fs versions has no volume ids per data node, lookup "layouts" ids instead
+        if status and not locations_by_volume_id:
+            volume_ids = set()
+            for layout in status.get('Topology', {}).get('layouts') or []:
+                volume_ids.update(str(v) for v in layout.get('writables') or [])
+            locations_by_volume_id = {k: v for k, v in self.lookup_many(volume_ids).items() if v}
+
+        g_logger.info('warmed up volume cache with %d volumes' % len(locations_by_volume_id))
+        return len(locations_by_volume_id)
+
+    @staticmethod
+    def _get_locations_from_topology(status) -> {}:
+        """
+        return {volume_id: {"locations": [{"url": ..., "publicUrl": ...}, ...]}} read from @status(of get_status).
+
+        topology of data nodes looks like below, "VolumeIds" is a list of ranges:
+        -----------
+        {"Url": "127.0.0.1:8080", "PublicUrl": "127.0.0.1:8080", "Volumes": 7, "VolumeIds": " 1-3 5 7"}
+        -----------
+        """
+        locations_by_volume_id = {}
+        if not status:
+            return locations_by_volume_id
+        try:
+            for data_center in status['Topology'].get('DataCenters') or []:
+                for rack in data_center.get('Racks') or []:
+                    for data_node in rack.get('DataNodes') or []:
+                        location = {'url': data_node['Url'],
+                                    'publicUrl': data_node.get('PublicUrl') or data_node['Url']}
+                        for volume_id in parse_volume_id_ranges(data_node.get('VolumeIds', '')):
+                            lookup_result = locations_by_volume_id.setdefault(volume_id, {'locations': []})
+                            lookup_result['locations'].append(location)
+        except Exception as e:
+            g_logger.error('Could not read volume locations from topology. e: %s' % e)
+        return locations_by_volume_id
 
     def get_volume(self, fid) -> WeedVolume or None:
         """ get an instance of WeedVolume by @fid"""
@@ -199,7 +292,7 @@ class WeedMaster(object):
 
         selected_location = locations_list[0]
         public_url = selected_location['publicUrl']
-        volume = WeedVolume(url_base=f"http://{public_url}")
+        volume = WeedVolume(url_base=f"http://{public_url}", session=self.session)
         return volume
 
     def vacuum(self) -> {}:
@@ -274,7 +367,7 @@ class WeedMaster(object):
         - `self`:
         """
         try:
-            r = requests.get(self.url_vacuum)
+            r = self.session.get(self.url_vacuum)
             result = json.loads(r.content)
         except Exception as e:
             g_logger.error("Could not get status of this volume: %s. "
@@ -290,7 +383,7 @@ class WeedMaster(object):
         - `self`:
         """
         try:
-            r = requests.get(self.url_status)
+            r = self.session.get(self.url_status)
             result = json.loads(r.content)
         except Exception as e:
             g_logger.error('Could not get status of this volume: %s. Exception is: %s' % (self.url_status, e))
@@ -28,10 +28,28 @@ operations to weedfs.
 
 __all__ = ['WeedOperation']
 
+import contextvars
+import copy
 import io
-import random
+import mimetypes
+import os
+import queue
+import re
+import stat
+import threading
+import time
+from urllib.parse import urljoin
 
+from weed import conf
+from weed.cache import WeedTTLCache
+from weed.deadline import deadline
+from weed.fid_pool import WeedFidPool
+from weed.hedge import WeedCancelToken, cancellable
 from weed.master import *
+from weed.selector import WeedLocationSelector
+from weed.session import get_default_session
+from weed.stream import WeedMultipartEncoder, WeedRangeFile, WeedRangeReader, WeedResponseStream, get_ranges, \
+    read_content
 from weed.util import *
 
 
@@ -42,11 +60,50 @@ class WeedOperation(object):
     The master will find a volume automaticlly.
     Currently, implement it with requests. Maybe *tornado or  *mongrel2 + brubeck* is better?
 
+    All requests(to master and volumes) go through @session, a WeedSession which keeps
+    connections alive. It defaults to the session shared by the whole package.
+
+    If @fid_pool_block_size > 1, "put" without a fid takes fids from a WeedFidPool which
+    reserves @fid_pool_block_size fids per assign, instead of asking master for each file.
+
+    Reads go to the replica which @selector(a WeedLocationSelector, by default one per WeedOperation)
+    prefers by latency, error rate and load. If reading fails there, "get", "get_many" and
+    "get_stream" try the other replicas within the same call.
+
+    If @compression(a WeedCompression) is given, "put" compresses the files it picks(eg: json, text above
+    a size) while uploading them, and seaweedfs stores them compressed. reads are decompressed while streaming.
+
+    If @hedge(a WeedHedgePolicy) is given, "get" and "get_many" also ask the next replica when the first
+    has not answered after the policy's delay. The first answer wins and the slower request is cancelled.
+
+    If @exists_cache_duration_in_seconds > 0, "exists" and "exists_many" remember fids found to exist
+    for that long.
+
+    If @content_cache(a WeedContentCache) is given, "get" serves files from it while they are fresh,
+    and revalidates expired ones with "If-None-Match", so unchanged files are not downloaded again.
+    @disk_cache(a WeedDiskCache) works the same behind @content_cache, and survives restarts.
+    put(with a fid), delete and cp through this WeedOperation invalidate the cached file.
+
     """
 
-    def __init__(self, master_url_base='http://localhost:9333', prefetch_volume_ids=False):
+    def __init__(self, master_url_base='http://localhost:9333', prefetch_volume_ids=False, session=None,
+                 fid_pool_block_size=1, content_cache=None, disk_cache=None, exists_cache_duration_in_seconds=0,
+                 selector=None, hedge=None, compression=None):
         self.master_url_base = master_url_base
-        self.master = WeedMaster(url_base=master_url_base, prefetch_volume_ids=prefetch_volume_ids)
+        self.session = session or get_default_session()
+        self.master = WeedMaster(url_base=master_url_base, prefetch_volume_ids=prefetch_volume_ids,
+                                 session=self.session)
+        self.fid_pool = None
+        if fid_pool_block_size > 1:
+            self.fid_pool = WeedFidPool(self.master, block_size=fid_pool_block_size)
+        self.content_cache = content_cache
+        self.disk_cache = disk_cache
+        self.selector = selector or WeedLocationSelector()
+        self.hedge = hedge
+        self.compression = compression
+        self.exists_cache = None
+        if exists_cache_duration_in_seconds > 0:
+            self.exists_cache = WeedTTLCache(max_size=100000, ttl=exists_cache_duration_in_seconds, jitter=0)
 
     # def get_volume_fid_full_url(self, fid):
     #     ''' (deprecated, use get_fid_full_url instead) return a random fid_full_url of volume by @fid
@@ -74,13 +131,17 @@ class WeedOperation(object):
         if count == 1:
             return [fid]
         else:
-            fids = [fid] + [fid + ('_%d' % (i + 1)) for i in range(count)]
+            fids = [fid] + [fid + ('_%d' % (i + 1)) for i in range(count - 1)]
             return fids
 
     def get_fid_full_url(self, fid, use_public_url=False) -> None or str:
-        """ return a random fid_full_url of volume by @fid
+        """ return the fid_full_url of volume by @fid on the location self.selector prefers
+
+        the selector(a WeedLocationSelector) takes the better of two random healthy locations, scored by
+        their recent latency, error rate and requests in flight, so slow or failing volume servers are
+        avoided; hosts failing lately, or whose circuit is open, come last.
 
-        eg: (randomly choosed from locations)
+        eg: (chosen from locations)
           return:  'http://127.0.0.1:27000/3,1234101234'  or
           return:  'http://127.0.0.1:27001/3,1234101234'  or
           return:  'http://127.0.0.1:27002/3,1234101234'
@@ -100,25 +161,30 @@ class WeedOperation(object):
         return something like: 'http://127.0.0.1:8080/3,0230203913'
         """
         volume_id = fid.split(',')[0]
-        full_url = None
-        try:
-            r = self.master.lookup(volume_id)
-            locations = r['locations']
+        return self._choose_fid_full_url(fid, self.master.lookup(volume_id), use_public_url)
 
-            # choose a random location
-            location = locations[random.randint(0, len(locations) - 1)]
-            if not use_public_url:
-                full_url = 'http://%s/%s' % (location['url'], fid)
-            else:
-                full_url = 'http://%s/%s' % (location['publicUrl'], fid)
+    def _choose_fid_full_url(self, fid, lookup_result, use_public_url=False) -> None or str:
+        """ return fid_full_url of @fid on the location of @lookup_result(returned by WeedMaster.lookup)
+        which the selector prefers """
+        fid_full_urls = self._fid_full_urls(fid, lookup_result, use_public_url)
+        return fid_full_urls[0] if fid_full_urls else None
+
+    def _fid_full_urls(self, fid, lookup_result, use_public_url=False) -> [str]:
+        """ return fid_full_urls of @fid on all locations of @lookup_result, in the order to try them """
+        try:
+            key = 'publicUrl' if use_public_url else 'url'
+            fid_full_urls = self.selector.order(['http://%s/%s' % (location[key], fid)
+                                                 for location in lookup_result['locations']])
+            # hosts whose circuit is open would fail at once, try them last
+            return sorted(fid_full_urls, key=self.session.breaker.is_open)
         except Exception as e:
             g_logger.error('Could not get volume location of this fid: %s. Exception is: %s' % (fid, e))
-        return full_url
+        return []
 
     # -----------------------------------------------------------
     #    weedfs operation: get/put/delete, and CRUD-aliases starts
     # -----------------------------------------------------------
-    def get(self, fid, file_name='') -> WeedOperationResponse:
+    def get(self, fid, file_name='', deadline_in_seconds=None) -> WeedOperationResponse:
         """
         read/get a file from weed-fs with @fid.
 
@@ -130,35 +196,589 @@ class WeedOperation(object):
           if True -> just return the file's content
           if False -> return a response of requests.Respond object. (eg: You can get content_type of the file being get)
 
+        @deadline_in_seconds: the whole call, lookup included, gives up after it. defaults to conf.g_deadline_in_seconds
+
         return a WeedOperationResponse instance
         """
-        g_logger.debug('|--> Getting file. fid: %s, file_name:%s' % (fid, file_name))
+        with deadline(deadline_in_seconds):
+            g_logger.debug('|--> Getting file. fid: %s, file_name:%s' % (fid, file_name))
+
+            cache_entry = None
+            if self.content_cache is not None or self.disk_cache is not None:
+                cache_entry = self._get_cached(fid)
+                cached, _, fresh = cache_entry
+                if fresh:  # no need to look up its volume
+                    return self._from_content_cache(cached, file_name)
+            fid_full_urls = self._fid_full_urls(fid, self.master.lookup(get_volume_id(fid)))
+            return self._get_from_urls(fid, fid_full_urls, file_name, cache_entry)
+
+    def _get_from_urls(self, fid, fid_full_urls, file_name='', cache_entry=None, limiter=None) \
+            -> WeedOperationResponse:
+        """ read file @fid from the first of @fid_full_urls(its replicas) which answers
+
+        @limiter: a WeedHostLimiter. if given, each request holds a slot of the host it is sent to
+        """
+        if self.hedge is not None and len(fid_full_urls) > 1:
+            return self._get_hedged(fid, fid_full_urls, file_name, cache_entry, limiter)
+        wor = None
+        for fid_full_url in fid_full_urls or [None]:
+            wor = self._get_from_url(fid, fid_full_url, file_name, cache_entry, limiter=limiter)
+            if wor.ok():
+                break
+            g_logger.warning('Could not read fid: %s from %s, trying other replicas' % (fid, fid_full_url))
+        return wor
+
+    def _get_hedged(self, fid, fid_full_urls, file_name='', cache_entry=None, limiter=None) -> WeedOperationResponse:
+        """ read file @fid from the first of @fid_full_urls, and from the second one too if the first has not
+        answered after self.hedge's delay. the first successful answer wins and the other request is cancelled.
+        failed requests fail over to the remaining urls, like _get_from_urls.
+        """
+        if cache_entry is None and (self.content_cache is not None or self.disk_cache is not None):
+            cache_entry = self._get_cached(fid)
+            if cache_entry[2]:  # fresh, no request to hedge
+                return self._from_content_cache(cache_entry[0], file_name)
+        delay = self.hedge.next_delay()
+        results = queue.Queue()
+        pending = list(fid_full_urls)
+        tokens = []
+        started_at = {}  # token -> time.monotonic() its request started, while it runs
+
+        def _attempt(fid_full_url, token):
+            started = time.monotonic()
+            wor = self._get_from_url(fid, fid_full_url, file_name, cache_entry, cancel=token, limiter=limiter)
+            results.put((fid_full_url, wor, time.monotonic() - started, token))
+
+        def _start():
+            token = WeedCancelToken()
+            tokens.append(token)
+            started_at[token] = time.monotonic()
+            if delay is None:  # not hedging(eg: still learning the delay), no thread needed
+                _attempt(pending.pop(0), token)
+                return
+            # daemon: a cancelled request stuck in connecting must not keep the interpreter alive.
+            # the context carries the deadline of the read into the thread
+            threading.Thread(target=contextvars.copy_context().run, args=(_attempt, pending.pop(0), token),
+                             daemon=True).start()
+
+        _start()
+        running, hedged, hedge_token, wor = 1, False, None, None
+        while running:
+            timeout = delay if pending and not hedged and delay is not None else None
+            try:
+                fid_full_url, wor, latency, winner = results.get(timeout=timeout)
+            except queue.Empty:
+                hedged = True  # hedge once per read, even if the budget denies it
+                if self.hedge.try_hedge():
+                    g_logger.debug('Hedging read of fid: %s after %.3fs' % (fid, delay))
+                    _start()
+                    hedge_token = tokens[-1]
+                    running += 1
+                continue
+            running -= 1
+            winner_started_at = started_at.pop(winner)
+            if wor.ok():
+                for token in tokens:
+                    if token is not winner:
+                        token.cancel()
+                self.hedge.record(latency, hedge_won=winner is hedge_token)
+                # a slower request started earlier(eg: the primary a hedge beat) took at least this long.
+                # leaving it out would drag the learned delay down whenever hedges win
+                now = time.monotonic()
+                for token, token_started_at in started_at.items():
+                    if token_started_at < winner_started_at:
+                        self.hedge.record(now - token_started_at)
+                return wor
+            g_logger.warning('Could not read fid: %s from %s, trying other replicas' % (fid, fid_full_url))
+            if pending and not running:
+                _start()
+                running += 1
+        return wor
+
+    @staticmethod
+    def _from_content_cache(cached, file_name='') -> WeedOperationResponse:
+        """ a copy of the WeedOperationResponse @cached, so callers can not change the cached one """
+        wor = copy.copy(cached)
+        wor.name = file_name
+        return wor
+
+    def _get_cached(self, fid) -> (WeedOperationResponse, str, bool):
+        """ look @fid up in content_cache, then in disk_cache. returns (WeedOperationResponse or None, etag, fresh).
+
+        a fresh hit of disk_cache is put into content_cache too.
+        """
+        stale = (None, '', False)
+        if self.content_cache is not None:
+            cached, etag, fresh = self.content_cache.get(fid)
+            if fresh:
+                return cached, etag, True
+            if cached is not None:
+                stale = (cached, etag, False)
+        if self.disk_cache is not None:
+            entry, etag, fresh = self.disk_cache.get(fid)
+            if entry is not None and (fresh or stale[0] is None):
+                wor = WeedOperationResponse()
+                wor.status = Status.SUCCESS
+                wor.fid = fid
+                wor.content_type = entry.content_type
+                wor.etag = etag
+                try:
+                    wor.content = entry.read()
+                except OSError:  # evicted by another process meanwhile
+                    return stale
+                if not fresh:
+                    return wor, etag, False
+                if self.content_cache is not None:
+                    self.content_cache.set(fid, wor, entry.size, etag, ttl=max(0, entry.expires_at - time.time()))
+                return wor, etag, True
+        return stale
 
-        fid_full_url = 'wrong_url'
+    def _set_cached(self, fid, wor):
+        """ cache the content of @wor(got with http 200) in content_cache and disk_cache """
+        if self.content_cache is not None:
+            self.content_cache.set(fid, self._from_content_cache(wor), len(wor.content), wor.etag)
+        if self.disk_cache is not None:
+            try:
+                self.disk_cache.set(fid, wor.content, wor.etag, wor.content_type or '')
+            except Exception as e:  # eg: the disk is full, reading still works
+                g_logger.warning('Could not cache fid: %s on disk. e: %s' % (fid, e))
+
+    def _refresh_cached(self, fid, cached):
+        """ @cached is not modified(http 304), keep it fresh for another ttl """
+        if self.content_cache is not None:
+            if fid in self.content_cache:
+                self.content_cache.refresh(fid)
+            else:
+                self.content_cache.set(fid, self._from_content_cache(cached), len(cached.content), cached.etag)
+        if self.disk_cache is not None:
+            if fid in self.disk_cache:
+                self.disk_cache.refresh(fid)
+            else:
+                self._set_cached(fid, cached)
+
+    def _invalidate_cached(self, fid):
+        """ forget what is cached of @fid, after it is changed or removed """
+        if self.exists_cache is not None:
+            self.exists_cache.invalidate(fid)
+        if self.content_cache is not None:
+            self.content_cache.invalidate(fid)
+        if self.disk_cache is not None:
+            self.disk_cache.invalidate(fid)
+
+    def _get_from_url(self, fid, fid_full_url, file_name='', cache_entry=None, cancel=None, limiter=None) \
+            -> WeedOperationResponse:
+        """ read file @fid from @fid_full_url, returns a WeedOperationResponse
+
+        @cache_entry: what _get_cached(@fid) returned, if the caller already asked it
+        @cancel: a WeedCancelToken. if given, cancelling it closes the connection, even before the answer comes
+        the body is read chunk by chunk, so the current deadline bounds it too
+        @limiter: a WeedHostLimiter. if given, the request holds a slot of the host of @fid_full_url
+        """
+        if limiter is not None and fid_full_url:
+            with limiter.limit(fid_full_url):
+                return self._get_from_url(fid, fid_full_url, file_name, cache_entry, cancel)
         wor = WeedOperationResponse()
+        wor.fid = fid
+        cached, etag, headers = None, '', None
+        if self.content_cache is not None or self.disk_cache is not None:
+            cached, etag, fresh = cache_entry or self._get_cached(fid)
+            if fresh:
+                return self._from_content_cache(cached, file_name)
+            if cached is not None and etag:
+                headers = {'If-None-Match': '"%s"' % etag}
         try:
-            fid_full_url = self.get_fid_full_url(fid)
             g_logger.debug('Reading file fid: %s, file_name: %s, fid_full_url: %s' % (fid, file_name, fid_full_url))
-            rsp = self.get_http_response(fid_full_url)
+            with self.selector.track(fid_full_url) as track:
+                try:
+                    with cancellable(cancel):
+                        rsp = self.session.get(fid_full_url, headers=headers, stream=True)
+                except requests.exceptions.RequestException:
+                    if cancel is None or not cancel.cancelled:
+                        raise
+                    rsp = None  # cut while waiting for the answer: the host is slow, not failing
+                track.ok = rsp is None or rsp.status_code < 500
+            if rsp is None:
+                raise IOError('cancelled, another replica answered first')
+            if cancel is not None:
+                cancel.register(rsp)
+            try:
+                content = read_content(rsp)  # cancel.cancel() may close it meanwhile
+            finally:
+                rsp.close()
+            if cancel is not None and cancel.cancelled:
+                raise IOError('cancelled, another replica answered first')
+            if not track.ok:
+                raise IOError('HTTP %d' % rsp.status_code)
+            if rsp.status_code == 304 and cached is not None:  # not modified, no body transferred
+                self._refresh_cached(fid, cached)
+                return self._from_content_cache(cached, file_name)
             wor.status = Status.SUCCESS
             wor.fid = fid
             wor.url = fid_full_url
             wor.name = file_name
-            wor.content = rsp.content
+            wor.content = content
             wor.content_type = rsp.headers.get('content-type')
+            wor.etag = rsp.headers.get('etag', '').strip('"')
+            if rsp.status_code == 200:
+                self._set_cached(fid, wor)
+            else:
+                self._invalidate_cached(fid)
         except Exception as e:
             err_msg = 'Could not read file fid: %s, file_name: %s, fid_full_url: %s, e: %s' % (
                 fid, file_name, fid_full_url, e)
+            if cancel is not None and cancel.cancelled:
+                g_logger.debug(err_msg)
+            else:
+                g_logger.error(err_msg)
+            wor.status = Status.FAILED
+            wor.message = err_msg
+
+        return wor
+
+    def get_stream(self, fid, file_name='', chunk_size=None, headers=None) -> WeedOperationResponse:
+        """
+        read a file from weed-fs with @fid without loading it into memory.
+
+        returns a WeedOperationResponse whose "stream" is a file-like WeedResponseStream: iterate it
+        to get chunks of @chunk_size(defaults to conf.g_stream_chunk_size_in_bytes) bytes, or read() it.
+        Close the stream when done, so its connection goes back to the pool.
+        Reading the stream raises WeedDeadlineExceeded once the deadline current at this call has passed.
+
+        eg:
+            wor = op.get_stream(fid)
+            if wor:
+                with wor.stream as stream:
+                    for chunk in stream:
+                        ...
+        """
+        g_logger.debug('|--> Getting file as stream. fid: %s, file_name:%s' % (fid, file_name))
+        wor = WeedOperationResponse()
+        wor.fid = fid
+        wor.name = file_name
+        # a replica failing to answer(not a 4xx, eg: 404) makes us try the next one
+        for fid_full_url in self._fid_full_urls(fid, self.master.lookup(get_volume_id(fid))) or [None]:
+            wor.url = fid_full_url
+            track = None
+            try:
+                with self.selector.track(fid_full_url) as track:
+                    rsp = self.session.get(fid_full_url, stream=True, headers=headers)
+                    track.ok = rsp.status_code < 500
+                if not rsp.ok:
+                    rsp.close()
+                    raise IOError('HTTP %d' % rsp.status_code)
+                wor.status = Status.SUCCESS
+                wor.content_type = rsp.headers.get('content-type')
+                wor.etag = rsp.headers.get('etag', '').strip('"')
+                wor.stream = WeedResponseStream(rsp, chunk_size)
+                return wor
+            except Exception as e:
+                err_msg = 'Could not read file fid: %s, file_name: %s, fid_full_url: %s, e: %s' % (
+                    fid, file_name, fid_full_url, e)
+                g_logger.error(err_msg)
+                wor.status = Status.FAILED
+                wor.message = err_msg
+                if track is None or track.ok:
+                    break
+        return wor
+
+    def get_to_file(self, fid, path_or_fp, chunk_size=None, deadline_in_seconds=None) -> WeedOperationResponse:
+        """
+        download file @fid straight into @path_or_fp(a file path or a file-object opened in binary mode),
+        chunk by chunk, so memory used does not grow with file size.
+
+        returns a WeedOperationResponse whose "storage_size" is the number of bytes written.
+        if @path_or_fp is a path and downloading fails, the partly written file is removed.
+        @deadline_in_seconds: the whole call, lookup and body included, gives up after it.
+            defaults to conf.g_deadline_in_seconds
+        """
+        with deadline(deadline_in_seconds):
+            return self._get_to_file(fid, path_or_fp, chunk_size)
+
+    def _get_to_file(self, fid, path_or_fp, chunk_size=None) -> WeedOperationResponse:
+        wor = self.get_stream(fid, chunk_size=chunk_size)
+        if not wor:
+            return wor
+
+        is_our_responsibility_to_close_file = isinstance(path_or_fp, str)
+        try:
+            with wor.stream as stream:
+                _fp = open(path_or_fp, 'wb') if is_our_responsibility_to_close_file else path_or_fp
+                try:
+                    for chunk in stream:
+                        _fp.write(chunk)
+                        wor.storage_size += len(chunk)
+                finally:
+                    if is_our_responsibility_to_close_file:
+                        _fp.close()
+        except Exception as e:
+            err_msg = 'Could not write file fid: %s to %s, e: %s' % (fid, path_or_fp, e)
             g_logger.error(err_msg)
             wor.status = Status.FAILED
             wor.message = err_msg
+            if is_our_responsibility_to_close_file and os.path.exists(path_or_fp):
+                os.remove(path_or_fp)
+        wor.stream = None
+        return wor
+
+    def get_chunk_manifest(self, fid) -> None or WeedChunkManifest:
+        """ the WeedChunkManifest of @fid if it was put as chunks(eg: by put_large), else None
+
+        volume servers join the chunks of such a file on GET(saying "X-File-Store: chunked"),
+        and return the manifest itself with "?cm=false".
+        """
+        fid_full_url = self.get_fid_full_url(fid)
+        try:
+            rsp = self.session.head(fid_full_url)
+            if rsp.headers.get('X-File-Store') != 'chunked':
+                return None
+            rsp = self.session.get(fid_full_url, params={'cm': 'false'})
+            if not rsp.ok:
+                raise IOError('HTTP %d' % rsp.status_code)
+            return WeedChunkManifest.from_json(rsp.content)
+        except Exception as e:
+            g_logger.error('Could not get chunk manifest of fid: %s, fid_full_url: %s, e: %s' % (fid, fid_full_url, e))
+            return None
+
+    def get_large(self, fid, path_or_fp, max_workers=8, max_workers_per_host=4, chunk_size=None) \
+            -> WeedOperationResponse:
+        """
+        download file @fid into @path_or_fp(a file path or a file-object opened in binary mode), fetching
+        the chunks of a chunked file(see put_large) in parallel from their own volume servers,
+        at most @max_workers at a time and @max_workers_per_host per volume server.
+
+        when @path_or_fp is a path or a regular file, each chunk is streamed straight to its offset with
+        os.pwrite. Otherwise(eg: a pipe or a socket file) chunks are written in order, and at most about
+        2 * @max_workers chunks are held in memory.
+        A file which is not chunked is downloaded like get_to_file.
+
+        returns a WeedOperationResponse whose "storage_size" is the number of bytes written.
+        if @path_or_fp is a path and downloading fails, the partly written file is removed.
+        """
+        manifest = self.get_chunk_manifest(fid)
+        if manifest is None:
+            return self.get_to_file(fid, path_or_fp, chunk_size)
+
+        wor = WeedOperationResponse()
+        wor.fid = fid
+        wor.name = manifest.name
+        wor.content_type = manifest.mime
+        chunk_size = chunk_size or conf.g_stream_chunk_size_in_bytes
+        lookups = self._lookup_volumes([chunk.fid for chunk in manifest.chunks], max_workers)
+        limiter = WeedHostLimiter(max_workers_per_host)
+
+        def _chunk_url(chunk) -> str:
+            fid_full_url = self._choose_fid_full_url(chunk.fid, lookups.get(get_volume_id(chunk.fid)))
+            if not fid_full_url:
+                raise IOError('Could not get volume location of chunk: %s' % chunk.fid)
+            return fid_full_url
+
+        def _get_chunk(fid_full_url) -> requests.Response:
+            rsp = self.session.get(fid_full_url, stream=True)
+            if not rsp.ok:
+                rsp.close()
+                raise IOError('HTTP %d of chunk: %s' % (rsp.status_code, fid_full_url))
+            return rsp
+
+        def _pwrite_chunk(chunk):
+            written = 0
+            fid_full_url = _chunk_url(chunk)
+            with limiter.limit(fid_full_url), _get_chunk(fid_full_url) as rsp:
+                for data in rsp.iter_content(chunk_size):
+                    view = memoryview(data)
+                    while view:
+                        n = os.pwrite(fd, view, position + chunk.offset + written)
+                        view = view[n:]
+                        written += n
+            if written != chunk.size:
+                raise IOError('Chunk %s has %d bytes, expecting %d' % (chunk.fid, written, chunk.size))
+
+        def _read_chunk(chunk) -> bytes:
+            fid_full_url = _chunk_url(chunk)
+            with limiter.limit(fid_full_url), _get_chunk(fid_full_url) as rsp:
+                content = rsp.content
+            if len(content) != chunk.size:
+                raise IOError('Chunk %s has %d bytes, expecting %d' % (chunk.fid, len(content), chunk.size))
+            return content
+
+        is_our_responsibility_to_close_file = isinstance(path_or_fp, str)
+        try:
+            _fp = open(path_or_fp, 'wb') if is_our_responsibility_to_close_file else path_or_fp
+            try:
+                fd = self._fileno_to_pwrite(_fp)
+                if fd is not None:
+                    _fp.flush()
+                    position = _fp.tell()
+                    for _ in run_concurrently(_pwrite_chunk, manifest.chunks, max_workers=max_workers):
+                        pass
+                    _fp.seek(position + manifest.size)
+                else:
+                    for content in run_concurrently(_read_chunk, manifest.chunks, max_workers=max_workers,
+                                                    ordered=True, max_pending=max_workers):
+                        _fp.write(content)
+                wor.storage_size = manifest.size
+                wor.status = Status.SUCCESS
+            finally:
+                if is_our_responsibility_to_close_file:
+                    _fp.close()
+        except Exception as e:
+            err_msg = 'Could not write chunked file fid: %s to %s, e: %s' % (fid, path_or_fp, e)
+            g_logger.error(err_msg)
+            wor.status = Status.FAILED
+            wor.message = err_msg
+            if is_our_responsibility_to_close_file and os.path.exists(path_or_fp):
+                os.remove(path_or_fp)
+        return wor
+
+    @staticmethod
+    def _fileno_to_pwrite(fp) -> None or int:
+        """ the file descriptor of @fp if it is a regular file which can be written with os.pwrite """
+        try:
+            mode = getattr(fp, 'mode', '')
+            fd = fp.fileno()
+            if hasattr(os, 'pwrite') and 'b' in mode and 'a' not in mode and fp.seekable() \
+                    and stat.S_ISREG(os.fstat(fd).st_mode):
+                return fd
+        except (AttributeError, OSError, ValueError):
+            pass
+        return None
+
+    def get_range(self, fid, offset, length) -> WeedOperationResponse:
+        """
+        read @length bytes from @offset of file @fid with a http Range request.
+
+        returns a WeedOperationResponse whose "content" holds only those bytes,
+        which is shorter than @length(or empty) if the file ends before.
+        """
+        return self.get_ranges(fid, [(offset, length)])[0]
+
+    def get_ranges(self, fid, ranges) -> [WeedOperationResponse]:
+        """
+        read byte @ranges([(offset, length), ...]) of file @fid with one multi-range http request.
+
+        returns a WeedOperationResponse for each range, in the order of @ranges.
+        """
+        fid_full_url = self.get_fid_full_url(fid)
+        wors = []
+        for _ in ranges:
+            wor = WeedOperationResponse()
+            wor.fid = fid
+            wor.url = fid_full_url
+            wors.append(wor)
+        try:
+            rsp, contents = get_ranges(self.session, fid_full_url, ranges)
+            for wor, content in zip(wors, contents):
+                wor.status = Status.SUCCESS
+                wor.content = content
+                wor.content_type = rsp.headers.get('content-type') if rsp is not None else ''
+        except Exception as e:
+            err_msg = 'Could not read ranges %s of fid: %s, fid_full_url: %s, e: %s' % (
+                ranges, fid, fid_full_url, e)
+            g_logger.error(err_msg)
+            for wor in wors:
+                wor.status = Status.FAILED
+                wor.message = err_msg
+        return wors
+
+    def get_range_file(self, fid, buffer_size=None) -> None or io.BufferedReader:
+        """
+        return a readonly, seekable file-object of file @fid which downloads lazily with
+        http Range requests, at least @buffer_size(defaults to conf.g_stream_chunk_size_in_bytes) bytes a time.
+        returns None if @fid could not be found.
+
+        eg:
+            with op.get_range_file(fid) as f:
+                f.seek(-128, io.SEEK_END)
+                tail = f.read()
+        """
+        fid_full_url = self.get_fid_full_url(fid)
+        try:
+            rsp = self.session.head(fid_full_url, headers={'Accept-Encoding': 'identity'})
+            if not rsp.ok:
+                raise IOError('HTTP %d HEAD %s' % (rsp.status_code, fid_full_url))
+            size = int(rsp.headers['content-length'])
+        except Exception as e:
+            g_logger.error('Could not open fid: %s, fid_full_url: %s as file. e: %s' % (fid, fid_full_url, e))
+            return None
+
+        return io.BufferedReader(WeedRangeFile(WeedRangeReader(self.session, fid_full_url), size, fid),
+                                 buffer_size or conf.g_stream_chunk_size_in_bytes)
+
+    def get_into(self, fid, buffer) -> WeedOperationResponse:
+        """
+        download file @fid straight into @buffer, any writable buffer(bytearray, memoryview, mmap, array, ...),
+        reading from the socket with readinto, without intermediate bytes objects.
+
+        returns a WeedOperationResponse whose "storage_size" is the number of bytes written into @buffer.
+        it fails if the file is larger than @buffer, whose content is undefined then.
+
+        eg:
+            buffer = bytearray(1024 * 1024)
+            wor = op.get_into(fid, buffer)
+            data = memoryview(buffer)[:wor.storage_size]
+        """
+        # ask for the stored bytes as is, so they need not be decoded
+        wor = self.get_stream(fid, headers={'Accept-Encoding': 'identity'})
+        if not wor:
+            return wor
 
+        view = memoryview(buffer).cast('B')
+        try:
+            with wor.stream as stream:
+                content_length = int(stream.response.headers.get('content-length') or 0)
+                if content_length > len(view):
+                    raise ValueError('buffer(%d bytes) is smaller than the file(%d bytes)'
+                                     % (len(view), content_length))
+                n = 0
+                while n < len(view):
+                    r = stream.readinto(view[n:])
+                    if not r:
+                        break
+                    n += r
+                wor.storage_size = n
+                # reads nothing at the end of the file, which also gives the connection back to the pool
+                if n == len(view) and stream.readinto(bytearray(1)):
+                    raise ValueError('buffer(%d bytes) is smaller than the file' % len(view))
+        except Exception as e:
+            err_msg = 'Could not read fid: %s into buffer, e: %s' % (fid, e)
+            g_logger.error(err_msg)
+            wor.status = Status.FAILED
+            wor.message = err_msg
+        finally:
+            view.release()
+        wor.stream = None
         return wor
 
+    def get_many(self, fids, ordered=True, max_workers=16, max_workers_per_host=4):
+        """ read many files concurrently. yields a WeedOperationResponse for each fid.
+
+        @fids: an iterable of fids.
+        @ordered: if True, yield in the order of @fids, else as soon as each one completes.
+        @max_workers: total concurrent downloads.
+        @max_workers_per_host: concurrent downloads per volume server.
+
+        Each distinct volume_id is looked up only once.
+
+        eg:
+            contents = [wor.content for wor in op.get_many(fids)]
+        """
+        fids = list(fids)
+        lookups = self._lookup_volumes(fids, max_workers)
+        limiter = WeedHostLimiter(max_workers_per_host)
+
+        def _get(fid) -> WeedOperationResponse:
+            fid_full_urls = self._fid_full_urls(fid, lookups.get(get_volume_id(fid)))
+            # each replica tried(failed over to, or hedged) holds a slot of its own host
+            return self._get_from_urls(fid, fid_full_urls, limiter=limiter)
+
+        return run_concurrently(_get, fids, max_workers=max_workers, ordered=ordered)
+
+    def _lookup_volumes(self, fids, max_workers=16) -> {}:
+        """ lookup each distinct volume_id of @fids once. returns {volume_id: lookup_result} """
+        return self.master.lookup_many(fids, max_workers=max_workers)
+
     def get_url(self, fid) -> None or str:
-        """ return a random fid_full_url of volume by @fid, alias to get_fid_full_url(fid)
+        """ return the preferred fid_full_url of volume by @fid, alias to get_fid_full_url(fid)
 
-        eg: (randomly choosed from locations)
+        eg: (chosen from locations)
           return:  'http://127.0.0.1:27000/3,1234101234'  or
           return:  'http://127.0.0.1:27001/3,1234101234'  or
           return:  'http://127.0.0.1:27002/3,1234101234'
@@ -168,54 +788,72 @@ class WeedOperation(object):
         return self.get_fid_full_url(fid)
 
     @staticmethod
-    def get_http_response(fid_full_url) -> requests.Response:
+    def get_http_response(fid_full_url, session=None) -> requests.Response:
         """ return a "requests.Response" if we want whole info of the http request """
-        return requests.get(fid_full_url)
+        return (session or get_default_session()).get(fid_full_url)
 
     def get_content(self, fid, file_name='') -> bytes:
         """ return just file's content. use method "get" to get more file's info """
         return self.get(fid, file_name).content
 
-    def put(self, fp, fid=None, file_name='') -> None or WeedOperationResponse:
+    def put(self, fp, fid=None, file_name='', deadline_in_seconds=None) -> None or WeedOperationResponse:
         """  put a file to weed-fs.
 
         if @fid provided, put @fp with @fid;
         if @fid not provided, generate a new fid for it.
 
+        @deadline_in_seconds: the whole call, lookup included, gives up after it. defaults to conf.g_deadline_in_seconds
+
         return a WeedOperationResponse instance
         """
-        g_logger.info('|--> Putting file@fid:%s, file_name:%s' % (fid, file_name))
-        fid_full_url = 'wrong_url'
-        _fid = fid
+        with deadline(deadline_in_seconds):
+            g_logger.info('|--> Putting file@fid:%s, file_name:%s' % (fid, file_name))
+            fid_full_url = 'wrong_url'
+            _fid = fid
+            try:
+                if not fid:
+                    if self.fid_pool:
+                        wak = self.fid_pool.acquire()
+                    else:
+                        wak = self.master.acquire_new_assign_key()
+                    # print(wak)
+                    _fid = wak.fid
+                    g_logger.debug('no fid. accquired new one: "%s"' % _fid)
+                    fid_full_url = wak.fid_full_url
+                else:
+                    fid_full_url = self.get_fid_full_url(fid)
+            except Exception as e:
+                err_msg = 'Could not put file. fp: "%s", file_name: "%s", fid_full_url: "%s", e: %s' % (
+                    fp, file_name, fid_full_url, e)
+                g_logger.error(err_msg)
+                return None
+
+            return self._put_to_url(fp, _fid, fid_full_url, file_name)
+
+    def _put_to_url(self, fp, fid, fid_full_url, file_name='') -> WeedOperationResponse:
+        """ put @fp(a file-object or a path) to @fid_full_url, returns a WeedOperationResponse """
+        wor = WeedOperationResponse()
+        is_our_responsibility_to_close_file = False
         try:
-            if not fid:
-                wak = self.master.acquire_new_assign_key()
-                # print(wak)
-                _fid = wak.fid
-                g_logger.debug('no fid. accquired new one: "%s"' % _fid)
-                fid_full_url = wak.fid_full_url
+            if isinstance(fp, str):
+                _fp = open(fp, 'rb')
+                is_our_responsibility_to_close_file = True
             else:
-                fid_full_url = self.get_fid_full_url(fid)
+                _fp = fp
         except Exception as e:
-            err_msg = 'Could not put file. fp: "%s", file_name: "%s", fid_full_url: "%s", e: %s' % (
-                fp, file_name, fid_full_url, e)
+            err_msg = 'Could not open file: "%s". e: %s' % (fp, e)
             g_logger.error(err_msg)
-            return None
-
-        wor = WeedOperationResponse()
-        is_our_responsibility_to_close_file = False
-        if isinstance(fp, str):
-            _fp = open(fp, 'rb')
-            is_our_responsibility_to_close_file = True
-        else:
-            _fp = fp
+            wor.status = Status.FAILED
+            wor.message = err_msg
+            return wor
 
         try:
             g_logger.info('Putting file with fid: %s, fid_full_url:%s for file: fp: %s, file_name: %s'
-                          % (_fid, fid_full_url, fp, file_name))
-            wor = put_file(_fp, fid_full_url, file_name)
+                          % (fid, fid_full_url, fp, file_name))
+            wor = put_file(_fp, fid_full_url, file_name, session=self.session, compression=self.compression)
             g_logger.info('%s' % wor)
-            wor.fid = _fid
+            wor.fid = fid
+            self._invalidate_cached(fid)
         except Exception as e:
             err_msg = 'Could not put file. fp: "%s", file_name: "%s", fid_full_url: "%s", e: %s' % (
                 fp, file_name, fid_full_url, e)
@@ -232,68 +870,343 @@ class WeedOperation(object):
 
         return wor
 
-    def delete(self, fid, file_name='') -> WeedOperationResponse:
+    def put_many(self, files, block_size=100, max_workers=16, max_workers_per_host=4):
+        """ put many files concurrently. yields a WeedOperationResponse for each file as it completes.
+
+        @files: an iterable(may be a lazy generator) of file-objects, file paths or (fp_or_path, file_name) tuples.
+        @block_size: fids are assigned in blocks of @block_size, one master call per block.
+            Each block lives on one volume server, so uploads are grouped by volume server.
+        @max_workers: total concurrent uploads.
+        @max_workers_per_host: concurrent uploads per volume server.
+
+        Each WeedOperationResponse has "fid" and "name"(file_name, or the basename if @fp is a path) set,
+        check "status" for per-file success or failure.
+
+        eg:
+            for wor in op.put_many(glob.glob('thumbnails/*.jpg')):
+                print(wor.name, wor.fid, wor.ok())
+        """
+        fid_pool = self.fid_pool or WeedFidPool(self.master, block_size=block_size)
+        limiter = WeedHostLimiter(max_workers_per_host)
+
+        def _items():
+            for f in files:
+                fp, file_name = f if isinstance(f, tuple) else (f, '')
+                if not file_name and isinstance(fp, str):
+                    file_name = os.path.basename(fp)
+                yield fp, file_name, fid_pool.acquire()
+
+        def _put(item) -> WeedOperationResponse:
+            fp, file_name, wak = item
+            if not wak:
+                wor = WeedOperationResponse()
+                wor.name = file_name
+                wor.message = 'Could not acquire a fid from master for file: %s' % fp
+                g_logger.error(wor.message)
+                return wor
+            with limiter.limit(wak.fid_full_url):
+                wor = self._put_to_url(fp, wak.fid, wak.fid_full_url, file_name)
+            wor.name = wor.name or file_name
+            return wor
+
+        return run_concurrently(_put, _items(), max_workers=max_workers)
+
+    def put_large(self, fp, file_name='', chunk_size=None, chunks_per_assign=4, max_workers=8,
+                  max_workers_per_host=4) -> WeedOperationResponse:
+        """ put a large file as chunks plus a chunk manifest, so it is not limited by the size of one volume.
+
+        @fp is read sequentially, @chunk_size(defaults to conf.g_chunk_size_in_bytes) bytes per chunk, and
+        chunks are uploaded concurrently, at most @max_workers at a time and @max_workers_per_host per
+        volume server. At most about 2 * @max_workers chunks are held in memory whatever the file size.
+        Fids are assigned @chunks_per_assign at a time, each block usually on another volume, so chunks
+        spread over the volume servers.
+
+        When all chunks are stored, a WeedChunkManifest is put with "?cm=true": a "get" of the returned
+        fid reads the whole file and a "delete" removes the chunks too. If any chunk fails, the stored
+        chunks are deleted again and a failed WeedOperationResponse is returned.
+        A file not larger than @chunk_size is put as a plain file.
+
+        returns a WeedOperationResponse, "storage_size" is the size of the whole file.
+        """
+        chunk_size = chunk_size or conf.g_chunk_size_in_bytes
+        if isinstance(fp, str):
+            file_name = file_name or os.path.basename(fp)
+            with open(fp, 'rb') as _fp:
+                return self.put_large(_fp, file_name, chunk_size, chunks_per_assign, max_workers,
+                                      max_workers_per_host)
+
+        fid_pool = WeedFidPool(self.master, block_size=chunks_per_assign, background_refill=False)
+        limiter = WeedHostLimiter(max_workers_per_host)
+        manifest = WeedChunkManifest(name=file_name,
+                                     mime=mimetypes.guess_type(file_name)[0] or 'application/octet-stream')
+        wor = WeedOperationResponse()
+        wor.name = file_name
+
+        first, second = fp.read(chunk_size), fp.read(chunk_size)
+        if not second:  # a small file, no need for chunks
+            wak = fid_pool.acquire()
+            if not wak:
+                wor.message = 'Could not acquire a fid from master for file: %s' % file_name
+                g_logger.error(wor.message)
+                return wor
+            return self._put_to_url(io.BytesIO(first), wak.fid, wak.fid_full_url, file_name)
+
+        failed = threading.Event()  # stops reading more chunks once one fails
+
+        def _chunks():
+            index, offset, data = 0, 0, first
+            while data and not failed.is_set():
+                yield index, offset, data, fid_pool.acquire()
+                index, offset = index + 1, offset + len(data)
+                data = second if index == 1 else fp.read(chunk_size)
+
+        chunks, errors = {}, []  # chunks are recorded as they are stored, so a failure can remove them all
+
+        def _put_chunk(item):
+            index, offset, data, wak = item
+            try:
+                if not wak:
+                    raise Exception('Could not acquire a fid from master for chunk %d' % index)
+                with limiter.limit(wak.fid_full_url):
+                    chunk_wor = self._put_to_url(io.BytesIO(data), wak.fid, wak.fid_full_url,
+                                                 '%s-%d' % (file_name, index + 1))
+                if not chunk_wor.ok():
+                    raise Exception(chunk_wor.message)
+                chunks[index] = WeedChunkInfo(wak.fid, offset, len(data))
+            except Exception as e:
+                errors.append('%s' % e)
+                failed.set()
+
+        try:
+            for _ in run_concurrently(_put_chunk, _chunks(), max_workers=max_workers, max_pending=max_workers):
+                pass
+        except Exception as e:  # reading @fp fails
+            errors.append('%s' % e)
+
+        manifest.chunks = [chunks[i] for i in sorted(chunks)]
+        manifest.size = sum(c.size for c in manifest.chunks)
+        if not errors:
+            manifest_wak = fid_pool.acquire()
+            if manifest_wak:
+                try:
+                    wor = put_file(io.BytesIO(manifest.to_json().encode('utf-8')),
+                                   manifest_wak.fid_full_url + '?cm=true', file_name,
+                                   http_headers={'content-type': 'application/json'}, session=self.session)
+                    wor.fid = manifest_wak.fid
+                    wor.name = file_name
+                    wor.url = manifest_wak.fid_full_url
+                    wor.storage_size = manifest.size
+                    if wor.ok():
+                        return wor
+                    errors.append(wor.message)
+                except Exception as e:
+                    errors.append('%s' % e)
+            else:
+                errors.append('Could not acquire a fid from master for the chunk manifest')
+
+        wor.status = Status.FAILED
+        wor.message = 'Could not put large file: %s. %s' % (file_name, '; '.join(errors))
+        g_logger.error(wor.message)
+        for chunk_wor in self.delete_many([c.fid for c in manifest.chunks], max_workers=max_workers):
+            if not chunk_wor.ok():
+                g_logger.warning('Could not remove chunk %s of failed file: %s' % (chunk_wor.fid, file_name))
+        return wor
+
+    def delete(self, fid, file_name='', deadline_in_seconds=None) -> WeedOperationResponse:
         """ remove a file in weed-fs with @fid.
 
         if storage == 0, then @fid in weedfs is not exist.
 
+        @deadline_in_seconds: the whole call, lookup included, gives up after it. defaults to conf.g_deadline_in_seconds
+
         return a WeedOperationResponse instance
         """
-        g_logger.debug('|--> Deleting file@%s, file_name: %s' % (fid, file_name))
-        wor = WeedOperationResponse()
-        fid_full_url = 'wrong_url'
-        try:
-            fid_full_url = self.get_fid_full_url(fid)
-            g_logger.debug('Deleting file: fid: %s, file_name: %s, fid_full_url: %s' % (fid, file_name, fid_full_url))
+        with deadline(deadline_in_seconds):
+            g_logger.debug('|--> Deleting file@%s, file_name: %s' % (fid, file_name))
+            wor = WeedOperationResponse()
+            fid_full_url = 'wrong_url'
+            try:
+                fid_full_url = self.get_fid_full_url(fid)
+                g_logger.debug('Deleting file: fid: %s, file_name: %s, fid_full_url: %s' % (fid, file_name, fid_full_url))
 
-            r = requests.delete(fid_full_url)
-            rsp_json = r.json()
+                r = self.session.delete(fid_full_url)
+                self._invalidate_cached(fid)
+                rsp_json = r.json()
 
-            wor.status = Status.SUCCESS
+                wor.status = Status.SUCCESS
+                wor.fid = fid
+                wor.url = fid_full_url
+                wor.name = file_name
+
+                if 'size' in rsp_json:
+                    wor.storage_size = rsp_json['size']
+                    if wor.storage_size == 0:
+                        err_msg = ('Error: fid@%s is not exist.' % fid)
+                        wor.status = Status.FAILED
+                        wor.message = err_msg
+                        g_logger.error(err_msg)
+            except Exception as e:
+                err_msg = 'Deleting file: fid: %s, file_name: %s, fid_full_url: %s, e: %s' % (
+                    fid, file_name, fid_full_url, e)
+                g_logger.error(err_msg)
+                wor.status = Status.FAILED
+                wor.message = err_msg
+                g_logger.error(err_msg)
+
+            return wor
+
+    def delete_many(self, fids, chunk_size=100, max_workers=16, max_workers_per_host=4) -> [WeedOperationResponse]:
+        """ remove many files. returns a WeedOperationResponse for each fid, in the order of @fids.
+
+        see iter_delete_many for the arguments, and to get the responses as batches complete.
+        """
+        fids = list(fids)
+        wors = {wor.fid: wor for wor in self.iter_delete_many(fids, chunk_size, max_workers, max_workers_per_host)}
+        return [wors[fid] for fid in fids]
+
+    def iter_delete_many(self, fids, chunk_size=100, max_workers=16, max_workers_per_host=4):
+        """ remove many files. yields a WeedOperationResponse for each fid as its batch completes.
+        nothing is removed until it is iterated.
+
+        fids are grouped by volume server and removed through the volume server's batch delete
+        endpoint(POST /delete with fid=...&fid=...), at most @chunk_size fids per request.
+        The batch endpoint does not replicate, so each fid is removed on every location of its volume,
+        and reported removed only if all of them confirm it, else with the first error.
+        Batches run in parallel, at most @max_workers_per_host at a time per volume server.
+
+        like "delete", if storage_size == 0, then the fid in weedfs is not exist.
+        """
+        fids = list(fids)
+        lookups = self._lookup_volumes(fids, max_workers)
+        limiter = WeedHostLimiter(max_workers_per_host)
+
+        batches = {}  # volume server url -> [fid, ...]
+        replicas = {}  # fid -> number of locations not answered yet
+        unresolved = []
+        for fid in dict.fromkeys(fids):  # each fid once
+            fid_full_urls = self._fid_full_urls(fid, lookups.get(get_volume_id(fid)))
+            if not fid_full_urls:
+                unresolved.append(fid)
+                continue
+            replicas[fid] = len(fid_full_urls)
+            for fid_full_url in fid_full_urls:
+                batches.setdefault(fid_full_url[:-len(fid)], []).append(fid)
+        chunks = [(url, fids_of_url[i:i + chunk_size])
+                  for url, fids_of_url in batches.items()
+                  for i in range(0, len(fids_of_url), chunk_size)]
+
+        def _delete_chunk(chunk) -> [WeedOperationResponse]:
+            url, chunk_fids = chunk
+            with limiter.limit(url):
+                return self._batch_delete(url, chunk_fids)
+
+        for fid in unresolved:
+            wor = WeedOperationResponse()
             wor.fid = fid
-            wor.url = fid_full_url
-            wor.name = file_name
+            wor.message = 'Could not get volume location of this fid: %s' % fid
+            g_logger.error(wor.message)
+            yield wor
+        merged = {}  # fid -> the first failed answer of its replicas, else a successful one
+        for wors in run_concurrently(_delete_chunk, chunks, max_workers=max_workers):
+            for wor in wors:
+                if wor.fid not in merged or (merged[wor.fid].ok() and not wor.ok()):
+                    merged[wor.fid] = wor
+                replicas[wor.fid] -= 1
+                if not replicas[wor.fid]:
+                    yield merged.pop(wor.fid)
 
-            if 'size' in rsp_json:
-                wor.storage_size = rsp_json['size']
-                if wor.storage_size == 0:
-                    err_msg = ('Error: fid@%s is not exist.' % fid)
+    def _batch_delete(self, volume_url, fids) -> [WeedOperationResponse]:
+        """ remove @fids on volume server @volume_url in one request """
+        delete_url = urljoin(volume_url, '/delete')
+        wors = {}
+        for fid in fids:
+            wor = wors[fid] = WeedOperationResponse()
+            wor.fid = fid
+            wor.url = volume_url + fid
+            wor.message = 'No result of fid@%s from volume server' % fid
+        try:
+            r = self.session.post(delete_url, data={'fid': fids})
+            for fid in fids:
+                self._invalidate_cached(fid)
+            # rsp_json sample:
+            # [{"fid": "3,01637037d6", "status": 202, "size": 1024},
+            #  {"fid": "3,02637037d6", "status": 404, "error": "not found"}]
+            for item in r.json():
+                wor = wors.get(item.get('fid'))
+                if wor is None:
+                    continue
+                wor.storage_size = item.get('size', 0)
+                if item.get('error') or wor.storage_size == 0:
                     wor.status = Status.FAILED
-                    wor.message = err_msg
-                    g_logger.error(err_msg)
+                    wor.message = 'Error: fid@%s is not exist. %s' % (wor.fid, item.get('error', ''))
+                    g_logger.error(wor.message)
+                else:
+                    wor.status = Status.SUCCESS
+                    wor.message = 'ok'
         except Exception as e:
-            err_msg = 'Deleting file: fid: %s, file_name: %s, fid_full_url: %s, e: %s' % (
-                fid, file_name, fid_full_url, e)
+            err_msg = 'Could not batch delete %d fids on %s, e: %s' % (len(fids), delete_url, e)
             g_logger.error(err_msg)
-            wor.status = Status.FAILED
-            wor.message = err_msg
-            g_logger.error(err_msg)
-
-        return wor
+            for wor in wors.values():
+                wor.status = Status.FAILED
+                wor.message = err_msg
+        return list(wors.values())
 
-    def exists(self, fid) -> bool:
-        """ detects @fid's existence """
-        if ',' not in fid:  # fid should have a volume_id
-            return False
-        try:
-            volume_id = fid.split(',')[0]
-        except Exception as e:
-            g_logger.error('Invalid fid:"%s". e: %s' % (fid, e))
-            return False
+    def exists(self, fid, deadline_in_seconds=None) -> bool:
+        """ detects @fid's existence, with one(usually cached) lookup and one HEAD.
+        gives up after @deadline_in_seconds(defaults to conf.g_deadline_in_seconds) """
+        with deadline(deadline_in_seconds):
+            if ',' not in fid:  # fid should have a volume_id
+                return False
+            if self.exists_cache is not None and self.exists_cache.get(fid):
+                return True
+            fid_full_url = self._choose_fid_full_url(fid, self.master.lookup(fid))
+            if not fid_full_url:
+                return False
+            return self._head_exists(fid, fid_full_url)
 
-        if not self.master.lookup(volume_id):
-            return False
-        fid_full_url = self.get_fid_full_url(fid)
+    def _head_exists(self, fid, fid_full_url) -> bool:
+        """ HEAD @fid_full_url, caches a positive answer in exists_cache """
         try:
-            rsp = requests.head(fid_full_url, allow_redirects=True)
+            rsp = self.session.head(fid_full_url, allow_redirects=True)
             if not rsp.ok:
                 return False
-            else:
-                return True
+            if self.exists_cache is not None:
+                self.exists_cache.set(fid, True)
+            return True
         except Exception as e:
             g_logger.error('Error occurs while requests.head. e: %s' % e)
             return False
 
+    def exists_many(self, fids, max_workers=16, max_workers_per_host=4) -> {}:
+        """ detects the existence of many fids. returns {fid: bool} in the order of @fids.
+
+        Each distinct volume_id is looked up only once. fids are grouped by volume server, and each
+        volume server gets @max_workers_per_host concurrent lanes of HEADs, each lane reusing one
+        pooled keep-alive connection; at most @max_workers lanes run at a time.
+        """
+        fids = list(fids)
+        result = {fid: False for fid in fids}
+        to_check = [fid for fid in result
+                    if ',' in fid and not (self.exists_cache is not None and self.exists_cache.get(fid))]
+        for fid in set(result) - set(to_check):
+            result[fid] = ',' in fid
+        lookups = self._lookup_volumes(to_check, max_workers)
+
+        by_host = {}  # volume server url -> [(fid, fid_full_url), ...]
+        for fid in to_check:
+            fid_full_url = self._choose_fid_full_url(fid, lookups.get(get_volume_id(fid)))
+            if fid_full_url:
+                by_host.setdefault(fid_full_url[:-len(fid)], []).append((fid, fid_full_url))
+        lanes = [items[i::max_workers_per_host]
+                 for items in by_host.values() for i in range(min(max_workers_per_host, len(items)))]
+
+        def _check_lane(lane) -> [(str, bool)]:
+            return [(fid, self._head_exists(fid, fid_full_url)) for fid, fid_full_url in lane]
+
+        for checked in run_concurrently(_check_lane, lanes, max_workers=max_workers):
+            result.update(checked)
+        return result
+
     def crud_create(self, fp, file_name='') -> None or WeedOperationResponse:
         """  CREATE of CRUD(C). Alias to method: "put"
         """
@@ -322,27 +1235,106 @@ class WeedOperation(object):
     #    weedfs operation: CRUD ends
     # -----------------------------------------------------------
 
-    # def create_multiple(self, fp_array):
-    #     ''' create/save multiple files '''
-    #     pass
-
     def cp(self, src_fid, dst_fid, src_file_name='') -> None or WeedOperationResponse:
         """ cp src_fid dst_fid
 
-        replace file@dst_fid with file@src_fid
+        replace file@dst_fid with file@src_fid, or put it with a new fid if @dst_fid is None.
+
+        the body of the source GET is piped into the destination upload chunk by chunk, so both
+        transfers overlap and the file is never held in memory.
         """
         try:
-            src_file_rsp = self.crud_read(src_fid, file_name=src_file_name)
-            fp = io.BytesIO(src_file_rsp.content)
-            g_logger.debug(
-                'Updating file: dst_fid: %s, src_fid: %s, src_file_name: %s,  fp: %s' % (
-                    dst_fid, src_fid, src_file_name, fp))
-            return self.crud_update(fp, dst_fid, src_file_name)
+            if dst_fid:
+                dst_fid_full_url = self.get_fid_full_url(dst_fid)
+            else:
+                wak = self.fid_pool.acquire() if self.fid_pool else self.master.acquire_new_assign_key()
+                dst_fid, dst_fid_full_url = wak.fid, wak.fid_full_url
+            return self._cp(src_fid, dst_fid, dst_fid_full_url, src_file_name)
         except Exception as e:
             err_msg = 'Could not Updating file: dst_fid: %s, src_fid: %s, src_file_name: %s. e: %s' % (
                 dst_fid, src_fid, src_file_name, e)
             g_logger.error(err_msg)
             return None
 
+    def _cp(self, src_fid, dst_fid, dst_fid_full_url, src_file_name='', budget=None) -> WeedOperationResponse:
+        """ pipe file@src_fid into @dst_fid_full_url, raises if reading file@src_fid fails.
+
+        @budget: a WeedByteBudget, one chunk of the stream is reserved from it while copying.
+        """
+        # no content-encoding, so the source's Content-Length is the size of what we upload
+        src_wor = self.get_stream(src_fid, src_file_name, headers={'Accept-Encoding': 'identity'})
+        if not src_wor:
+            raise IOError(src_wor.message)
+        g_logger.debug('Piping file: src_fid: %s into dst_fid: %s, src_file_name: %s' % (
+            src_fid, dst_fid, src_file_name))
+        with src_wor.stream as stream:
+            rsp_headers = stream.response.headers
+            if not src_file_name:  # the name it was put with, eg: 'inline; filename="a.jpg"'
+                match = re.search(r'filename="?([^";]+)"?', rsp_headers.get('content-disposition', ''))
+                src_file_name = match.group(1) if match else ''
+            file_size = None
+            if rsp_headers.get('content-encoding', 'identity').lower() == 'identity' \
+                    and rsp_headers.get('content-length'):
+                file_size = int(rsp_headers['content-length'])
+            encoder = WeedMultipartEncoder(stream, src_file_name, file_content_type=src_wor.content_type,
+                                           file_size=file_size)
+            if budget is None:
+                rsp = post_multipart(dst_fid_full_url, encoder, session=self.session)
+            else:
+                with budget.reserve(min(file_size or encoder.chunk_size, encoder.chunk_size)):
+                    rsp = post_multipart(dst_fid_full_url, encoder, session=self.session)
+        self._invalidate_cached(dst_fid)
+        wor = parse_put_file_response(rsp.json(), dst_fid_full_url)
+        wor.fid = dst_fid
+        return wor
+
+    def cp_many(self, pairs, ordered=False, max_workers=16, max_workers_per_host=4,
+                max_bytes_in_flight=64 * 1024 * 1024):
+        """ copy many files concurrently, eg: to migrate a collection.
+        yields a WeedOperationResponse(of the destination) for each pair as it completes.
+
+        @pairs: an iterable(may be a lazy generator) of (src_fid, dst_fid) or (src_fid, dst_fid, src_file_name).
+            a dst_fid of None puts the copy with a new fid.
+        @ordered: if True, yield in the order of @pairs, else as soon as each one completes.
+        @max_workers: total concurrent copies.
+        @max_workers_per_host: concurrent uploads per destination volume server.
+        @max_bytes_in_flight: every copy streams through one buffer of conf.g_stream_chunk_size_in_bytes(or
+            the file size, if smaller). Copies wait while their buffers would take more than this in total.
+
+        Check "status" of each WeedOperationResponse for per-copy success or failure,
+        "message" says which src_fid failed.
+
+        eg:
+            new_fids = [wor.fid for wor in op.cp_many([(fid, None) for fid in old_fids], ordered=True)]
+        """
+        limiter = WeedHostLimiter(max_workers_per_host)
+        budget = WeedByteBudget(max_bytes_in_flight)
+
+        def _items():
+            for pair in pairs:
+                src_fid, dst_fid, src_file_name = (tuple(pair) + ('',))[:3]
+                if dst_fid:
+                    yield src_fid, dst_fid, self.get_fid_full_url(dst_fid), src_file_name
+                else:
+                    wak = self.fid_pool.acquire() if self.fid_pool else self.master.acquire_new_assign_key()
+                    yield src_fid, wak and wak.fid, wak and wak.fid_full_url, src_file_name
+
+        def _cp(item) -> WeedOperationResponse:
+            src_fid, dst_fid, dst_fid_full_url, src_file_name = item
+            try:
+                if not dst_fid_full_url:
+                    raise IOError('Could not get the destination url')
+                with limiter.limit(dst_fid_full_url):
+                    return self._cp(src_fid, dst_fid, dst_fid_full_url, src_file_name, budget)
+            except Exception as e:
+                wor = WeedOperationResponse()
+                wor.fid = dst_fid or ''
+                wor.name = src_file_name
+                wor.message = 'Could not copy file: src_fid: %s to dst_fid: %s. e: %s' % (src_fid, dst_fid, e)
+                g_logger.error(wor.message)
+                return wor
+
+        return run_concurrently(_cp, _items(), max_workers=max_workers, ordered=ordered)
+
     def __repr__(self):
         return f'<WeedOperation: @master({self.master_url_base}>'
@@ -0,0 +1,172 @@
+# ** -- coding: utf-8 -- **
+# !/usr/bin/env python
+#
+# Copyright (c) 2011 darkdarkfruit <darkdarkfruit@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+
+
+"""
+latency-aware choice among the locations(replicas) of a volume.
+
+WeedLocationSelector keeps, per host, an EWMA of response times, an EWMA of the error rate and
+the number of requests in flight. It picks the better of two random healthy locations(power of
+two choices), so fast servers get more reads without all clients piling onto the same one.
+
+eg:
+    selector = WeedLocationSelector()
+    for url in selector.order(['http://a:8080/3,01', 'http://b:8080/3,01']):
+        with selector.track(url) as track:
+            rsp = session.get(url)
+            track.ok = rsp.status_code < 500
+        if track.ok:
+            break
+"""
+
+__all__ = ['WeedLocationSelector']
+
+import random
+import threading
+import time
+import urllib.parse
+from contextlib import contextmanager
+
+
+class _HostStats(object):
+    __slots__ = ('latency', 'error_rate', 'in_flight', 'failed_at')
+
+    def __init__(self):
+        self.latency = None  # EWMA of seconds, None until the first answer
+        self.error_rate = 0.0  # EWMA of 0(ok) and 1(failed)
+        self.in_flight = 0
+        self.failed_at = 0.0
+
+
+class _Track(object):
+    """ outcome of one tracked request, set "ok" to False if the answer is a failure """
+    __slots__ = ('ok',)
+
+    def __init__(self):
+        self.ok = True
+
+
+class WeedLocationSelector(object):
+    """ chooses the location to read from, by latency, error rate and load. thread-safe. """
+
+    def __init__(self, alpha=0.2, unhealthy_error_rate=0.5, cooldown_in_seconds=10, error_penalty_in_seconds=1.0):
+        """
+
+        Arguments:
+        - `alpha`: weight of the newest sample in the EWMAs
+        - `unhealthy_error_rate`: a host whose error rate is above this is avoided while other
+            hosts are healthy, until @cooldown_in_seconds after its last failure
+        - `cooldown_in_seconds`: after that an unhealthy host gets requests again, to find out
+            whether it has recovered
+        - `error_penalty_in_seconds`: a host failing every request scores like one answering this slowly
+        """
+        self.alpha = alpha
+        self.unhealthy_error_rate = unhealthy_error_rate
+        self.cooldown_in_seconds = cooldown_in_seconds
+        self.error_penalty_in_seconds = error_penalty_in_seconds
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    @staticmethod
+    def _host(url) -> str:
+        return urllib.parse.urlsplit(url if '//' in url else '//' + url).netloc
+
+    def _stats(self, host) -> _HostStats:
+        """ call it with self._lock held """
+        stats = self._hosts.get(host)
+        if stats is None:
+            stats = self._hosts[host] = _HostStats()
+        return stats
+
+    def _is_healthy(self, stats, now) -> bool:
+        return stats.error_rate <= self.unhealthy_error_rate or now - stats.failed_at > self.cooldown_in_seconds
+
+    def _score(self, stats) -> float:
+        """ lower is better. hosts never measured score 0, so they get measured. every failure
+        costs like a slow answer of @error_penalty_in_seconds """
+        latency = stats.latency or 0.0
+        return (latency + stats.error_rate * self.error_penalty_in_seconds) * (1 + stats.in_flight)
+
+    def choose(self, urls) -> None or str:
+        """ return the url to use among @urls(urls or host:ports), None if @urls is empty """
+        ordered = self.order(urls)
+        return ordered[0] if ordered else None
+
+    def order(self, urls) -> [str]:
+        """ return @urls in the order to try them: the power-of-two-choices pick first,
+        then the other healthy ones from best to worst, then the unhealthy ones """
+        urls = list(urls)
+        if len(urls) <= 1:
+            return urls
+        now = time.time()
+        with self._lock:
+            scored = [(url, self._stats(self._host(url))) for url in urls]
+            healthy = [(self._score(stats), url) for url, stats in scored if self._is_healthy(stats, now)]
+            unhealthy = [(self._score(stats), url) for url, stats in scored if not self._is_healthy(stats, now)]
+        healthy.sort(key=lambda x: x[0])
+        unhealthy.sort(key=lambda x: x[0])
+        if len(healthy) > 2:
+            first = min(random.sample(healthy, 2), key=lambda x: x[0])
+            healthy.remove(first)
+            healthy.insert(0, first)
+        return [url for _, url in healthy + unhealthy]
+
+    def record(self, url, latency, ok=True):
+        """ record a request to @url which took @latency seconds """
+        with self._lock:
+            stats = self._stats(self._host(url))
+            stats.error_rate += self.alpha * ((0.0 if ok else 1.0) - stats.error_rate)
+            if ok:
+                stats.latency = latency if stats.latency is None else stats.latency + self.alpha * (
+                    latency - stats.latency)
+            else:
+                stats.failed_at = time.time()
+
+    @contextmanager
+    def track(self, url):
+        """ count a request to @url in flight and record its latency and outcome when it ends.
+        an exception, or setting "ok" of the yielded object to False, records a failure """
+        track = _Track()
+        with self._lock:
+            self._stats(self._host(url)).in_flight += 1
+        started = time.monotonic()
+        try:
+            yield track
+        except BaseException:
+            track.ok = False
+            raise
+        finally:
+            with self._lock:
+                self._stats(self._host(url)).in_flight -= 1
+            self.record(url, time.monotonic() - started, track.ok)
+
+    def stats(self) -> {}:
+        """ return {host: {'latency', 'error_rate', 'in_flight'}} """
+        with self._lock:
+            return {host: {'latency': s.latency, 'error_rate': s.error_rate, 'in_flight': s.in_flight}
+                    for host, s in self._hosts.items()}
+
+    def __repr__(self):
+        return f'<WeedLocationSelector: {len(self._hosts)} hosts>'
@@ -0,0 +1,378 @@
+# ** -- coding: utf-8 -- **
+# !/usr/bin/env python
+#
+# Copyright (c) 2011 darkdarkfruit <darkdarkfruit@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+
+"""
+shared http session of python-weed.
+
+WeedMaster, WeedVolume, WeedOperation, WeedFiler and util.put_file send their
+http requests through a WeedSession. By default they all share one session, so
+connections to master/volume/filer servers are kept alive and reused instead of
+opening a new tcp connection on every lookup, assign, upload and download.
+
+eg:
+    session = WeedSession(pool_connections=64, pool_maxsize=128)
+    op = WeedOperation(session=session)
+    filer = WeedFiler(session=session)
+
+Requests to a host which keeps failing fail fast(see weed.breaker), and failed GET/HEAD requests are retried
+within a retry budget. Requests time out after conf.g_connect_timeout_in_seconds/g_read_timeout_in_seconds,
+or earlier within a deadline(see weed.deadline).
+"""
+
+__all__ = ['WeedSession', 'get_default_session', 'set_default_session', 'can_sendfile']
+
+import http.client
+import io
+import os
+import random
+import stat
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers, get_environ_proxies, select_proxy
+
+from weed import conf
+from weed.breaker import WeedCircuitBreaker, WeedRetryBudget
+from weed.conf import g_logger
+from weed.deadline import WeedDeadlineExceeded, current_deadline, deadline_passed, get_timeout
+from weed.hedge import current_cancel_token
+
+# answers telling the host is down or overloaded, rather than that the request is wrong
+_FAILURE_STATUS_CODES = frozenset([502, 503, 504])
+_RETRYABLE_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+
+
+class _CancellableHTTPConnection(urllib3.connection.HTTPConnection):
+    """ a connection which the current WeedCancelToken(see weed.hedge.cancellable) can cut while it waits
+    for the response """
+
+    def getresponse(self, *args, **kwargs):
+        token = current_cancel_token()
+        if token is None:
+            return super(_CancellableHTTPConnection, self).getresponse(*args, **kwargs)
+        token.register_connection(self)
+        try:
+            return super(_CancellableHTTPConnection, self).getresponse(*args, **kwargs)
+        finally:
+            token.forget_connection(self)
+
+
+class _CancellableHTTPSConnection(_CancellableHTTPConnection, urllib3.connection.HTTPSConnection):
+    pass
+
+
+class _CancellableHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = _CancellableHTTPConnection
+
+
+class _CancellableHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    ConnectionCls = _CancellableHTTPSConnection
+
+
+class _WeedHTTPAdapter(HTTPAdapter):
+    """ a HTTPAdapter whose pools make cancellable connections """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(_WeedHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': _CancellableHTTPConnectionPool,
+                                                   'https': _CancellableHTTPSConnectionPool}
+
+
+class WeedSession(object):
+    """ a pluggable http client with keep-alive connection pools per host.
+
+    It is safe to share one WeedSession between threads.
+
+    Each host has a circuit breaker(@breaker): after some consecutive failures(connection errors, timeouts,
+    http 502/503/504) requests to it raise WeedCircuitOpenError at once, until a probe request succeeds.
+    Failed GET/HEAD requests are retried up to @max_retries times after a jittered backoff, as long as
+    @retry_budget allows it.
+    """
+
+    def __init__(self, pool_connections=None, pool_maxsize=None, pool_block=False, breaker=None,
+                 retry_budget=None, max_retries=None):
+        """
+
+        Arguments:
+        - `pool_connections`: how many per-host pools are kept. defaults to conf.g_http_pool_connections
+        - `pool_maxsize`: how many keep-alive connections are kept per host. defaults to conf.g_http_pool_maxsize
+        - `pool_block`: if True, wait for a free connection instead of opening an extra one when a pool is full
+        - `breaker`: a WeedCircuitBreaker, defaults to a new one with the conf defaults
+        - `retry_budget`: a WeedRetryBudget, defaults to a new one with the conf defaults
+        - `max_retries`: retries of a failed GET/HEAD request. defaults to conf.g_max_retries
+        """
+        self.pool_connections = pool_connections or conf.g_http_pool_connections
+        self.pool_maxsize = pool_maxsize or conf.g_http_pool_maxsize
+        self.pool_block = pool_block
+        self.breaker = breaker or WeedCircuitBreaker()
+        self.retry_budget = retry_budget or WeedRetryBudget()
+        self.max_retries = conf.g_max_retries if max_retries is None else max_retries
+
+        self.session = requests.Session()
+        adapter = _WeedHTTPAdapter(pool_connections=self.pool_connections,
+                                   pool_maxsize=self.pool_maxsize,
+                                   pool_block=self.pool_block)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method, url, **kwargs) -> requests.Response:
+        """ send a http request through the pooled connections.
+
+        raises WeedCircuitOpenError without sending it if the circuit of the host of @url is open.
+        raises WeedDeadlineExceeded if the current deadline passes.
+        unless a "timeout" is given, it is (connect, read) timeouts of the conf, capped by the current deadline.
+        """
+        self.retry_budget.on_request()
+        retries = self.max_retries if method.upper() in _RETRYABLE_METHODS else 0
+        timeout = kwargs.pop('timeout', None)
+        attempt = 0
+        while True:
+            kwargs['timeout'] = get_timeout() if timeout is None else timeout
+            self.breaker.before_request(url)
+            try:
+                rsp = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                token = current_cancel_token()
+                if token is not None and token.cancelled:  # cut by us, not by the host
+                    self.breaker.record(url, None)
+                    raise
+                if deadline_passed():  # the deadline was too short, which tells nothing about the host
+                    self.breaker.record(url, None)
+                    raise WeedDeadlineExceeded('deadline exceeded: %s %s' % (method, url)) from e
+                self.breaker.record(url, False)
+                backoff = self._retry_backoff(attempt, retries)
+                if backoff is None:
+                    raise
+                g_logger.debug('Retrying %s %s after: %s' % (method, url, e))
+            except BaseException:
+                self.breaker.record(url, None)
+                raise
+            else:
+                failed = rsp.status_code in _FAILURE_STATUS_CODES
+                self.breaker.record(url, not failed)
+                backoff = self._retry_backoff(attempt, retries) if failed else None
+                if backoff is None:
+                    return rsp
+                g_logger.debug('Retrying %s %s after: HTTP %d' % (method, url, rsp.status_code))
+                rsp.close()
+            time.sleep(backoff)
+            attempt += 1
+
+    def _retry_backoff(self, attempt, retries) -> None or float:
+        """ return seconds to wait before retrying a failed request, None if it must not be retried """
+        if attempt >= retries:
+            return None
+        # full jitter, so clients failing together do not retry together
+        backoff = random.uniform(0, conf.g_retry_backoff_in_seconds * 2 ** attempt)
+        deadline = current_deadline()
+        if deadline is not None and deadline.remaining() <= backoff:
+            return None
+        return backoff if self.retry_budget.try_retry() else None
+
+    def get(self, url, **kwargs) -> requests.Response:
+        kwargs.setdefault('allow_redirects', True)
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs) -> requests.Response:
+        kwargs.setdefault('allow_redirects', False)
+        return self.request('HEAD', url, **kwargs)
+
+    def post(self, url, data=None, **kwargs) -> requests.Response:
+        return self.request('POST', url, data=data, **kwargs)
+
+    def put(self, url, data=None, **kwargs) -> requests.Response:
+        return self.request('PUT', url, data=data, **kwargs)
+
+    def delete(self, url, **kwargs) -> requests.Response:
+        return self.request('DELETE', url, **kwargs)
+
+    def post_with_sendfile(self, url, fp, count, preamble=b'', epilogue=b'', headers=None) -> requests.Response:
+        """ POST a body of @preamble + @count bytes of @fp from its current position + @epilogue to @url.
+
+        the bytes of @fp are sent by the kernel(socket.sendfile -> os.sendfile) on a pooled keep-alive
+        connection, without being copied through python. only for plain http and real files,
+        see can_sendfile. if a proxy is set for @url, or urllib3 does not lend its connections
+        (see _checkout_connection), the same body is streamed through python with post() instead.
+        """
+        checked_out = None if self._proxy_for(url) else self._checkout_connection(url)
+        if checked_out is None:
+            return self.post(url, data=_SendfileBody(preamble, fp, count, epilogue), headers=headers)
+        conn, put_conn = checked_out
+        parts = urlsplit(url)
+        path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        self.retry_budget.on_request()
+        # only once a connection is at hand, so a let through probe always gets recorded below
+        try:
+            connect_timeout, read_timeout = get_timeout()
+            self.breaker.before_request(url)
+        except BaseException:
+            put_conn(conn)
+            raise
+        ok = None
+        try:
+            if conn.sock is None:
+                conn.timeout = connect_timeout
+                conn.connect()
+            conn.sock.settimeout(read_timeout)
+            conn.putrequest('POST', path)
+            _headers = dict(self.session.headers)
+            _headers.pop('Accept-Encoding', None)
+            _headers.update(headers or {})
+            _headers['Content-Length'] = str(len(preamble) + count + len(epilogue))
+            for k, v in _headers.items():
+                conn.putheader(k, v)
+            conn.endheaders()
+            conn.send(preamble)
+            offset = fp.tell()
+            conn.sock.sendfile(fp, offset, count)
+            conn.send(epilogue)
+
+            # the plain http.client response, as the request was not sent through urllib3.
+            # its body is not content-encoded, Accept-Encoding was not sent
+            httplib_response = http.client.HTTPConnection.getresponse(conn)
+            rsp = requests.Response()
+            rsp.status_code = httplib_response.status
+            rsp.reason = httplib_response.reason
+            rsp.headers = CaseInsensitiveDict(httplib_response.getheaders())
+            rsp.raw = io.BytesIO(httplib_response.read())
+            rsp.encoding = get_encoding_from_headers(rsp.headers)
+            rsp.url = url
+            if httplib_response.will_close:
+                conn.close()
+            ok = rsp.status_code not in _FAILURE_STATUS_CODES
+        except (OSError, urllib3.exceptions.HTTPError) as e:  # connection refused, reset, timed out...
+            conn.close()
+            if deadline_passed():
+                raise WeedDeadlineExceeded('deadline exceeded: POST %s' % url) from e
+            ok = False
+            raise
+        except BaseException:
+            conn.close()
+            raise
+        finally:
+            put_conn(conn)
+            self.breaker.record(url, ok)
+        return rsp
+
+    def _checkout_connection(self, url) -> None or (http.client.HTTPConnection, 'callable'):
+        """ take a keep-alive connection to @url out of its pool, returns (conn, put_conn), put_conn(conn)
+        gives it back. None if urllib3 does not lend its connections the way this expects.
+
+        the only place relying on urllib3 internals: HTTPConnectionPool._get_conn/_put_conn of urllib3>=2
+        (pinned in setup.py), whose connections are http.client.HTTPConnections.
+        """
+        pool = self.session.get_adapter(url).poolmanager.connection_from_url(url)
+        try:
+            get_conn, put_conn = pool._get_conn, pool._put_conn
+        except AttributeError as e:
+            g_logger.warning('Could not take a connection out of urllib3 pools, not using sendfile. e: %s' % e)
+            return None
+        conn = get_conn()
+        if not isinstance(conn, http.client.HTTPConnection):
+            put_conn(conn)
+            return None
+        return conn, put_conn
+
+    def _proxy_for(self, url) -> None or str:
+        """ the proxy requests would send a request to @url through, None if none """
+        proxies = dict(get_environ_proxies(url)) if self.session.trust_env else {}
+        proxies.update(self.session.proxies)
+        return select_proxy(url, proxies)
+
+    def close(self):
+        """ close all pooled connections """
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return f'<WeedSession: pool_connections={self.pool_connections}, pool_maxsize={self.pool_maxsize}>'
+
+
+_default_session = None
+_default_session_lock = threading.Lock()
+
+
+def get_default_session() -> WeedSession:
+    """ return the WeedSession shared by all python-weed objects created without a session """
+    global _default_session
+    if _default_session is None:
+        with _default_session_lock:
+            if _default_session is None:
+                g_logger.debug('creating the default WeedSession')
+                _default_session = WeedSession()
+    return _default_session
+
+
+def set_default_session(session):
+    """ replace the shared WeedSession. objects created before keep using the old one """
+    global _default_session
+    with _default_session_lock:
+        _default_session = session
+
+
+class _SendfileBody(object):
+    """ the body of post_with_sendfile as a readonly file-like object of known "len", to stream it with
+    requests when sendfile can not be used """
+
+    def __init__(self, preamble, fp, count, epilogue):
+        self.len = len(preamble) + count + len(epilogue)
+        self._preamble = io.BytesIO(preamble)
+        self._fp = fp
+        self._remaining = count
+        self._epilogue = io.BytesIO(epilogue)
+
+    def read(self, size=-1) -> bytes:
+        if size is None or size < 0:
+            size = self.len
+        data = self._preamble.read(size)
+        if len(data) < size and self._remaining > 0:
+            chunk = self._fp.read(min(size - len(data), self._remaining))
+            self._remaining = self._remaining - len(chunk) if chunk else 0
+            data += chunk
+        if len(data) < size and self._remaining <= 0:
+            data += self._epilogue.read(size - len(data))
+        return data
+
+
+def can_sendfile(fp, url) -> bool:
+    """ True if @fp can be uploaded to @url with WeedSession.post_with_sendfile:
+    a regular file opened in binary mode, a plain http url and an os supporting sendfile.
+    """
+    if not hasattr(os, 'sendfile') or not url.startswith('http://'):
+        return False
+    try:
+        return 'b' in getattr(fp, 'mode', '') and stat.S_ISREG(os.fstat(fp.fileno()).st_mode)
+    except (AttributeError, OSError, ValueError):
+        return False
@@ -0,0 +1,383 @@
+# ** -- coding: utf-8 -- **
+# !/usr/bin/env python
+#
+# Copyright (c) 2011 darkdarkfruit <darkdarkfruit@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+
+"""
+streaming helpers of python-weed: read file contents chunk by chunk instead of loading
+them into memory at once.
+"""
+
+__all__ = ['WeedResponseStream', 'WeedMultipartEncoder', 'WeedRangeFile', 'WeedRangeReader', 'get_ranges',
+           'read_content']
+
+import io
+import os
+import re
+import uuid
+
+from weed import conf
+from weed.compression import WeedCompressingReader
+from weed.deadline import check_deadline, current_deadline
+
+
+def read_content(response, chunk_size=None, max_bytes=None) -> bytes:
+    """ read the whole body of @response(got with stream=True) chunk by chunk, raising WeedDeadlineExceeded
+    if the current deadline passes meanwhile, eg: a server trickling its answer.
+
+    @max_bytes: if given, stop reading once at least that many bytes are read
+    """
+    current = current_deadline()
+    chunks = []
+    read = 0
+    for chunk in response.iter_content(chunk_size or conf.g_stream_chunk_size_in_bytes):
+        check_deadline(current)
+        chunks.append(chunk)
+        read += len(chunk)
+        if max_bytes is not None and read >= max_bytes:
+            break
+    return b''.join(chunks)
+
+
+class WeedResponseStream(io.RawIOBase):
+    """ a readonly file-like object over the body of a streamed http response.
+
+    iterate it to get chunks of @chunk_size bytes, or read()/readinto() it like a file.
+    close it(or use "with") to give the connection back to the pool.
+    reads raise WeedDeadlineExceeded once the deadline current at its creation, if any, has passed.
+
+    eg:
+        with op.get_stream(fid).stream as stream:
+            for chunk in stream:
+                sock.sendall(chunk)
+    """
+
+    def __init__(self, response, chunk_size=None):
+        """
+
+        Arguments:
+        - `response`: a requests.Response got with stream=True
+        - `chunk_size`: defaults to conf.g_stream_chunk_size_in_bytes
+        """
+        super(WeedResponseStream, self).__init__()
+        self.response = response
+        self.chunk_size = chunk_size or conf.g_stream_chunk_size_in_bytes
+        self.deadline = current_deadline()
+        # let raw reads decode content-encoding(eg: gzip) like iter_content does
+        self.response.raw.decode_content = True
+        # without content-encoding, readinto reads from the socket straight into the caller's buffer
+        # through the http.client response under urllib3, without intermediate bytes objects
+        self._fp = None
+        if response.headers.get('content-encoding', 'identity').lower() == 'identity':
+            self._fp = getattr(response.raw, '_fp', None)
+            if not hasattr(self._fp, 'readinto'):
+                self._fp = None
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        check_deadline(self.deadline)
+        if self._fp is not None:
+            n = self._fp.readinto(b)
+            if not n:  # all read, give the connection back to the pool
+                self.response.raw.release_conn()
+            return n
+        data = self.response.raw.read(len(b))
+        n = len(data)
+        b[:n] = data
+        return n
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return self.readall()
+        check_deadline(self.deadline)
+        return self.response.raw.read(size)
+
+    def readall(self):
+        return b''.join(self)
+
+    def __iter__(self):
+        for chunk in self.response.iter_content(self.chunk_size):
+            check_deadline(self.deadline)
+            yield chunk
+
+    def close(self):
+        if not self.closed:
+            self.response.close()
+        super(WeedResponseStream, self).close()
+
+    def __repr__(self):
+        return f'<WeedResponseStream: {self.response.url}>'
+
+
+class WeedMultipartEncoder(object):
+    """ a multipart/form-data body of one file, read from @fp chunk by chunk while being sent.
+
+    Unlike requests' "files=", the whole body is never built in memory.
+    Pass it as "data" and its "content_type" as the Content-Type header:
+
+        encoder = WeedMultipartEncoder(fp, 'a.jpg')
+        session.post(url, data=encoder, headers={'Content-Type': encoder.content_type})
+
+    "len" is the body size if the size of @fp is known(real files, seekable file-objects), else None
+    and the body is sent with chunked transfer-encoding.
+
+    With @content_encoding(eg: 'gzip'), @fp is compressed while being read and the part gets a
+    "Content-Encoding" header. The compressed size is unknown beforehand, so "len" is None.
+    """
+
+    def __init__(self, fp, file_name='', field_name=None, file_content_type=None, chunk_size=None,
+                 file_size=None, content_encoding=None, compression_level=None):
+        """
+
+        Arguments:
+        - `fp`: a file-object to read from its current position. text file-objects are utf-8 encoded
+        - `file_name`: filename of the part, defaults to the basename of fp.name, or 'a.unknown'
+        - `field_name`: name of the form field, defaults to @file_name
+        - `file_content_type`: Content-Type of the part(eg: 'image/png'), omitted if not given
+        - `chunk_size`: bytes per chunk when iterated, defaults to conf.g_stream_chunk_size_in_bytes
+        - `file_size`: bytes left in @fp when they can not be told from @fp(eg: a WeedResponseStream)
+        - `content_encoding`: compress @fp with it while sending, see weed.compression
+        - `compression_level`: level of @content_encoding, defaults to that of WeedCompressingReader
+        """
+        self.fp = fp
+        self.file_name = file_name or self._guess_file_name(fp) or 'a.unknown'
+        self.field_name = field_name or self.file_name
+        self.chunk_size = chunk_size or conf.g_stream_chunk_size_in_bytes
+        self.boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary=%s' % self.boundary
+
+        headers = 'Content-Disposition: form-data; name="%s"; filename="%s"\r\n' % (
+            self._quote(self.field_name), self._quote(self.file_name))
+        if file_content_type:
+            headers += 'Content-Type: %s\r\n' % file_content_type
+        self.content_encoding = content_encoding
+        if content_encoding:
+            headers += 'Content-Encoding: %s\r\n' % content_encoding
+            fp = WeedCompressingReader(fp, content_encoding, compression_level, self.chunk_size)
+            file_size = None
+        self.preamble = ('--%s\r\n%s\r\n' % (self.boundary, headers)).encode('utf-8')
+        self.epilogue = ('\r\n--%s--\r\n' % self.boundary).encode('utf-8')
+
+        if file_size is None and not content_encoding:
+            file_size = self._remaining_size(fp)
+        self.len = None if file_size is None else len(self.preamble) + file_size + len(self.epilogue)
+        self._parts = [io.BytesIO(self.preamble), fp, io.BytesIO(self.epilogue)]
+
+    @staticmethod
+    def _guess_file_name(fp) -> str:
+        name = getattr(fp, 'name', None)
+        if isinstance(name, str) and not name.startswith('<'):
+            return os.path.basename(name)
+        return ''
+
+    @staticmethod
+    def _quote(s) -> str:
+        return s.replace('"', '%22').replace('\r', '').replace('\n', '')
+
+    @staticmethod
+    def _remaining_size(fp) -> int or None:
+        """ bytes left in binary @fp from its current position, None if unknown """
+        if isinstance(fp, io.TextIOBase):
+            return None
+        try:
+            position = fp.tell()
+            try:
+                return os.fstat(fp.fileno()).st_size - position
+            except (AttributeError, OSError, io.UnsupportedOperation):
+                end = fp.seek(0, io.SEEK_END)
+                fp.seek(position)
+                return end - position
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            return None
+
+    def read(self, size=-1) -> bytes:
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(self.chunk_size), b''))
+        while self._parts:
+            data = self._parts[0].read(size)
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            if data:
+                return data
+            self._parts.pop(0)
+        return b''
+
+    def __iter__(self):
+        return iter(lambda: self.read(self.chunk_size), b'')
+
+    def __repr__(self):
+        return f'<WeedMultipartEncoder: {self.file_name}, len={self.len}>'
+
+
+def get_ranges(session, url, ranges) -> ('requests.Response', [bytes]):
+    """ GET byte @ranges([(offset, length), ...]) of @url with one http Range request.
+
+    returns (response, [bytes of each range]). ranges beyond the end of the file are b''.
+    raises IOError if the server fails.
+
+    the content is requested without content-encoding, so offsets are offsets of the original file.
+    """
+    spec = ','.join('%d-%d' % (offset, offset + length - 1) for offset, length in ranges if length > 0)
+    if not spec:
+        return None, [b'' for _ in ranges]
+    rsp = session.get(url, headers={'Range': 'bytes=' + spec, 'Accept-Encoding': 'identity'}, stream=True)
+    try:
+        if rsp.status_code == 416:  # range not satisfiable: all ranges are beyond the end
+            return rsp, [b'' for _ in ranges]
+        if not rsp.ok:
+            raise IOError('HTTP %d GET %s' % (rsp.status_code, url))
+
+        content_type = rsp.headers.get('content-type', '')
+        if rsp.status_code == 200:  # the server ignores ranges and sends the whole file, read it up to the last range
+            segments = [(0, read_content(rsp, max_bytes=max(offset + length for offset, length in ranges)))]
+        elif content_type.startswith('multipart/byteranges'):
+            segments = _parse_byteranges(read_content(rsp), content_type.split('boundary=')[-1].strip('"'))
+        else:
+            segments = [(_parse_content_range(rsp.headers.get('content-range')), read_content(rsp))]
+    finally:
+        rsp.close()
+
+    results = []
+    for offset, length in ranges:
+        data = b''
+        for start, segment in segments:
+            if start <= offset < start + len(segment):
+                data = segment[offset - start:offset - start + length]
+                break
+        results.append(data)
+    return rsp, results
+
+
+def _parse_content_range(content_range) -> int:
+    """ return start of a Content-Range like 'bytes 0-99/1234'. raises IOError if it is missing or malformed """
+    match = re.match(r'bytes\s+(\d+)-\d+/(\d+|\*)$', (content_range or '').strip())
+    if match is None:
+        raise IOError('invalid Content-Range: %r' % content_range)
+    return int(match.group(1))
+
+
+def _parse_byteranges(body, boundary) -> [(int, bytes)]:
+    """ parse a multipart/byteranges body into [(start, bytes), ...] """
+    segments = []
+    parts = (b'\r\n' + body).split(b'\r\n--' + boundary.encode())
+    for part in parts[1:]:
+        if part.startswith(b'--'):  # the close delimiter
+            break
+        headers, _, data = part.partition(b'\r\n\r\n')
+        for line in headers.split(b'\r\n'):
+            name, _, value = line.partition(b':')
+            if name.strip().lower() == b'content-range':
+                segments.append((_parse_content_range(value.decode()), data))
+    return segments
+
+
+class WeedRangeReader(object):
+    """ the read_range function of a WeedRangeFile over @url: every call is a http Range request.
+
+    if the server ignores ranges(answers 200 with the whole file), the file is downloaded once more, whole,
+    and later ranges are served from it, rather than downloading the file again on every read.
+    """
+
+    def __init__(self, session, url):
+        self.session = session
+        self.url = url
+        self.ranges_ignored = False
+        self.content = None
+
+    def __call__(self, offset, length) -> bytes:
+        if not self.ranges_ignored:
+            rsp, contents = get_ranges(self.session, self.url, [(offset, length)])
+            self.ranges_ignored = rsp is not None and rsp.status_code == 200
+            return contents[0]
+        if self.content is None:
+            rsp = self.session.get(self.url, headers={'Accept-Encoding': 'identity'}, stream=True)
+            try:
+                if not rsp.ok:
+                    raise IOError('HTTP %d GET %s' % (rsp.status_code, self.url))
+                self.content = read_content(rsp)
+            finally:
+                rsp.close()
+        return self.content[offset:offset + length]
+
+    def __repr__(self):
+        return f'<WeedRangeReader: {self.url}>'
+
+
+class WeedRangeFile(io.RawIOBase):
+    """ a readonly, seekable file-like object which reads lazily with http Range requests.
+
+    wrap it with io.BufferedReader to turn many small reads into fewer requests.
+    libraries reading file headers(eg: EXIF, mp4 atoms) only download what they read.
+    """
+
+    def __init__(self, read_range, size, name=''):
+        """
+
+        Arguments:
+        - `read_range`: a function(offset, length) returning the bytes of that range
+        - `size`: size of the file
+        - `name`: name of the file, for information only
+        """
+        super(WeedRangeFile, self).__init__()
+        self.read_range = read_range
+        self.size = size
+        self.name = name
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError('invalid whence: %s' % whence)
+        if position < 0:
+            raise ValueError('negative seek position %d' % position)
+        self.position = position
+        return self.position
+
+    def readinto(self, b):
+        length = min(len(b), self.size - self.position)
+        if length <= 0:
+            return 0
+        data = self.read_range(self.position, length)
+        n = len(data)
+        b[:n] = data
+        self.position += n
+        return n
+
+    def __repr__(self):
+        return f'<WeedRangeFile: {self.name}, size={self.size}>'
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import asyncio
+import io
+
+import pytest
+
+httpx = pytest.importorskip('httpx')
+
+from weed.aio import AsyncWeedMaster, AsyncWeedOperation, AsyncWeedSession  # noqa: E402
+
+
+def make_transport(calls):
+    store = {}
+
+    def handler(request):
+        calls.append((request.method, request.url.path))
+        if request.url.path == '/dir/lookup':
+            return httpx.Response(200, json={'locations': [{'url': 'volume:8080', 'publicUrl': 'volume:8080'}]})
+        if request.url.path == '/dir/assign':
+            return httpx.Response(200, json={'fid': '1,01', 'url': 'volume:8080', 'publicUrl': 'volume:8080', 'count': 1})
+        fid = request.url.path.lstrip('/')
+        if request.method == 'POST':
+            store[fid] = request.read()
+            return httpx.Response(200, json={'name': 'a.txt', 'size': len(store[fid]), 'eTag': 'x'})
+        if request.method == 'DELETE':
+            return httpx.Response(200, json={'size': len(store.pop(fid, b''))})
+        if fid in store:
+            return httpx.Response(200, content=store[fid], headers={'content-type': 'text/plain'})
+        return httpx.Response(404)
+
+    return httpx.MockTransport(handler)
+
+
+def test_async_operation():
+    calls = []
+
+    async def run():
+        async with AsyncWeedOperation(session=AsyncWeedSession(transport=make_transport(calls))) as op:
+            wor = await op.put(io.BytesIO(b'hello'), file_name='a.txt')
+            assert wor.ok() and wor.fid == '1,01'
+            wors = await asyncio.gather(*[op.get(wor.fid) for _ in range(50)])
+            assert all(b'hello' in w.content for w in wors)
+            assert await op.exists(wor.fid)
+            assert (await op.delete(wor.fid)).storage_size > 0
+            assert not await op.exists(wor.fid)
+
+    asyncio.run(run())
+    # concurrent lookups of one volume share one request to master
+    assert calls.count(('GET', '/dir/lookup')) == 1
+
+
+def test_sessions_given_are_left_open():
+    calls = []
+
+    async def run():
+        session = AsyncWeedSession(transport=make_transport(calls))
+        master = AsyncWeedMaster(session=session)
+        async with AsyncWeedOperation(master=master) as op:
+            assert (await op.put(io.BytesIO(b'hello'))).ok()
+        async with AsyncWeedOperation(session=session) as op:
+            assert await op.exists('1,01')
+        # the master and its session still work
+        assert await master.lookup('1') is not None
+        assert b'hello' in (await AsyncWeedOperation(master=master).get('1,01')).content
+        await master.aclose()
+
+    asyncio.run(run())
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+import socket
+import time
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from weed.breaker import *
+from weed.master import WeedMaster
+from weed.session import WeedSession
+
+
+def test_circuit_opens_and_probes():
+    breaker = WeedCircuitBreaker(failure_threshold=3, reset_timeout_in_seconds=0.1)
+    url = 'http://a:8080/3,01'
+    for _ in range(3):
+        breaker.before_request(url)
+        breaker.record(url, False)
+    assert breaker.state(url) == OPEN
+    with pytest.raises(WeedCircuitOpenError):
+        breaker.before_request('http://a:8080/4,02')
+    breaker.before_request('http://b:8080/3,01')  # other hosts are not affected
+
+    time.sleep(0.15)
+    assert breaker.state(url) == HALF_OPEN
+    breaker.before_request(url)  # the probe
+    with pytest.raises(WeedCircuitOpenError):
+        breaker.before_request(url)  # only one probe at a time
+    breaker.record(url, False)
+    assert breaker.state(url) == OPEN  # the probe failed
+
+    time.sleep(0.15)
+    breaker.before_request(url)
+    breaker.record(url, True)
+    assert breaker.state(url) == CLOSED
+    assert breaker.stats() == {}
+
+
+def test_listener():
+    breaker = WeedCircuitBreaker(failure_threshold=2)
+    tripped = []
+    breaker.add_listener(tripped.append)
+    for _ in range(4):
+        breaker.record('a:8080', False)
+    assert tripped == ['a:8080']  # once, when the circuit opened
+
+
+def test_retry_budget():
+    budget = WeedRetryBudget(ratio=0.5, burst=1)
+    assert budget.try_retry()
+    assert not budget.try_retry()
+    budget.on_request()
+    budget.on_request()
+    assert budget.try_retry()
+    assert budget.stats() == {'requests': 2, 'retries': 2, 'denied': 1}
+
+
+class _FlakyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.calls += 1
+        status = 503 if self.server.calls <= self.server.failures else 200
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+def test_session_retries_and_fails_fast(http_server):
+    server, url = http_server(_FlakyHandler, calls=0, failures=1)
+    url += '/3,01'
+    with WeedSession(breaker=WeedCircuitBreaker(failure_threshold=3, reset_timeout_in_seconds=60),
+                     max_retries=2) as session:
+        assert session.get(url).status_code == 200  # retried after a 503
+        assert server.calls == 2
+        assert session.post(url).status_code == 501  # not retried
+        assert server.calls == 2
+
+        with socket.socket() as s:  # a port nobody listens on
+            s.bind(('127.0.0.1', 0))
+            dead_url = 'http://127.0.0.1:%d/3,01' % s.getsockname()[1]
+        with pytest.raises(IOError):
+            session.get(dead_url)  # 1 try + 2 retries open the circuit
+        started = time.monotonic()
+        with pytest.raises(WeedCircuitOpenError):
+            session.get(dead_url)
+        assert time.monotonic() - started < 0.01
+
+
+def test_master_forgets_locations_on_a_host_down():
+    session = WeedSession(breaker=WeedCircuitBreaker(failure_threshold=1))
+    master = WeedMaster(url_base='http://127.0.0.1:1', session=session)
+    master.volumes_cache.set('3', {'locations': [{'url': 'a:8080', 'publicUrl': 'a:8080'}]})
+    master.volumes_cache.set('4', {'locations': [{'url': 'b:8080', 'publicUrl': 'b:8080'}]})
+    session.breaker.record('http://a:8080/3,01', False)
+    assert '3' not in master.volumes_cache
+    assert '4' in master.volumes_cache
+
+
+def test_dead_listeners_are_pruned():
+    session = WeedSession(breaker=WeedCircuitBreaker(failure_threshold=1))
+    for _ in range(100):
+        WeedMaster(url_base='http://127.0.0.1:1', session=session)
+    master = WeedMaster(url_base='http://127.0.0.1:1', session=session)
+    assert len(session.breaker._listeners) <= 2  # gone masters do not pile up
+    session.breaker.record('http://a:8080/3,01', False)
+    assert session.breaker._listeners == [session.breaker._listeners[0]]
+    assert session.breaker._listeners[0]() == master._on_host_down
+
+
+def test_sendfile_probe_is_recorded_without_a_connection(tmp_path):
+    session = WeedSession(breaker=WeedCircuitBreaker(failure_threshold=1, reset_timeout_in_seconds=0))
+    url = 'http://127.0.0.1:1/3,01'
+    session.breaker.record(url, False)
+    assert session.breaker.state(url) == HALF_OPEN
+    session.session.get_adapter(url).poolmanager.connection_from_url(url).close()
+    path = tmp_path / 'a.bin'
+    path.write_bytes(b'a')
+    with open(path, 'rb') as fp:
+        with pytest.raises(Exception):
+            session.post_with_sendfile(url, fp, 1)  # the pool is closed, no connection
+    session.breaker.before_request(url)  # the circuit is not left probing forever
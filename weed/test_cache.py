@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+
+from weed import conf
+from weed.cache import WeedContentCache, WeedTTLCache
+
+
+def test_lru_eviction():
+    cache = WeedTTLCache(max_size=2, ttl=60)
+    cache.set('1', 'a')
+    cache.set('2', 'b')
+    assert cache.get('1') == 'a'  # '2' becomes the least recently used
+    cache.set('3', 'c')
+    assert cache.get('2') is None
+    assert cache.get('1') == 'a' and cache.get('3') == 'c'
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions'], stats['size']) == (3, 1, 1, 2)
+
+
+def test_ttl():
+    cache = WeedTTLCache(ttl=0.05, jitter=0)
+    cache.set('1', 'a')
+    assert '1' in cache
+    assert cache.get('1', max_age=0) is None
+    time.sleep(0.06)
+    assert cache.get('1') is None
+
+
+def test_default_ttl_follows_conf():
+    duration = conf.g_volume_cache_duration_in_seconds
+    try:
+        conf.set_volume_cache_duration_in_seconds(0)
+        cache = WeedTTLCache()
+        cache.set('1', 'a')
+        assert cache.get('1') is None
+    finally:
+        conf.set_volume_cache_duration_in_seconds(duration)
+
+
+def test_single_flight():
+    cache = WeedTTLCache(ttl=60)
+    calls = []
+
+    def loader(key):
+        calls.append(key)
+        time.sleep(0.05)
+        return {'locations': []}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load('3', loader))) for _ in range(20)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    assert calls == ['3']
+    assert results == [{'locations': []}] * 20
+
+    assert cache.get_or_load('4', lambda key: None) is None
+    assert '4' not in cache
+
+
+def test_negative_cache():
+    cache = WeedTTLCache(ttl=60, negative_ttl=0.05)
+    calls = []
+
+    def loader(key):
+        calls.append(key)
+        return None
+
+    assert cache.get_or_load('404', loader) is None
+    assert cache.get_or_load('404', loader) is None
+    assert calls == ['404']
+    assert cache.stats()['negative_hits'] == 1
+    time.sleep(0.06)
+    cache.get_or_load('404', loader)
+    assert calls == ['404', '404']
+
+
+def test_stale_while_revalidate():
+    cache = WeedTTLCache(ttl=0.05, jitter=0, stale_ttl=60)
+    refreshed = threading.Event()
+
+    def loader(key):
+        time.sleep(0.05)
+        refreshed.set()
+        return 'new'
+
+    cache.set('3', 'old')
+    time.sleep(0.06)
+    begin = time.time()
+    assert cache.get_or_load('3', loader) == 'old'  # served at once while refreshing
+    assert cache.get_or_load('3', loader) == 'old'
+    assert time.time() - begin < 0.04
+    assert refreshed.wait(1)
+    time.sleep(0.01)
+    assert cache.get_or_load('3', loader) == 'new'
+    assert cache.stats()['stale_hits'] == 2
+
+
+def test_loader_error_keeps_stale_entry():
+    cache = WeedTTLCache(ttl=0.01, jitter=0, stale_ttl=60)
+    cache.set('3', 'old')
+    time.sleep(0.02)
+
+    def loader(key):
+        raise IOError('master is down')
+
+    assert cache.get_or_load('3', loader) == 'old'
+    time.sleep(0.02)
+    assert cache.get_or_load('3', loader) == 'old'
+
+
+def test_content_cache_byte_budget():
+    cache = WeedContentCache(max_bytes=100, max_object_size=60, ttl=60)
+    cache.set('1', 'a', 40)
+    cache.set('2', 'b', 40)
+    cache.set('big', 'c', 61)  # larger than max_object_size
+    assert 'big' not in cache
+    assert cache.get('1') == ('a', '', True)  # '2' becomes the least recently used
+    cache.set('3', 'd', 40)
+    assert '2' not in cache and '1' in cache and '3' in cache
+    stats = cache.stats()
+    assert (stats['bytes'], stats['size'], stats['evictions']) == (80, 2, 1)
+    cache.set('1', 'e', 10)  # replacing an entry frees its bytes
+    assert cache.stats()['bytes'] == 50
+
+
+def test_content_cache_revalidation():
+    cache = WeedContentCache(ttl=0.05)
+    cache.set('1', 'a', 1, etag='e1')
+    time.sleep(0.06)
+    assert cache.get('1') == ('a', 'e1', False)  # expired, kept for revalidation
+    cache.refresh('1')
+    assert cache.get('1') == ('a', 'e1', True)
+    cache.invalidate('1')
+    assert cache.get('1') == (None, '', False)
+    assert cache.stats()['revalidations'] == 1
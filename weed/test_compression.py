@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import gzip
+import io
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from weed import compression
+from weed.compression import GZIP, ZSTD, WeedCompressingReader, WeedCompression
+from weed.session import WeedSession
+from weed.stream import WeedMultipartEncoder, WeedResponseStream
+from weed.util import choose_content_encoding
+
+DATA = b''.join(b'{"id": %d, "name": "item %d"}\n' % (i, i) for i in range(10000))
+
+
+def test_choose():
+    c = WeedCompression(min_size=1024)
+    assert c.choose('application/json', 2048) == GZIP
+    assert c.choose('text/html; charset=utf-8', None) == GZIP  # unknown size, eg: a stream
+    assert c.choose('application/vnd.api+json', 2048) == GZIP
+    assert c.choose('application/json', 100) is None  # too small to be worth it
+    assert c.choose('image/jpeg', 2048) is None  # already compressed
+    assert WeedCompression(content_types=['image/bmp']).choose('text/plain', 2048) is None
+
+    fp = io.BytesIO(DATA)
+    assert choose_content_encoding(c, fp, 'a.json') == GZIP
+    assert choose_content_encoding(c, fp, 'a.bin') is None
+    assert choose_content_encoding(c, fp, 'a.bin', 'text/csv') == GZIP
+    assert choose_content_encoding(None, fp, 'a.json') is None
+
+
+def test_compressing_reader():
+    reader = WeedCompressingReader(io.BytesIO(DATA), chunk_size=4096)
+    chunks = list(iter(lambda: reader.read(1000), b''))
+    assert max(len(chunk) for chunk in chunks) <= 1000
+    assert gzip.decompress(b''.join(chunks)) == DATA
+    assert reader.bytes_in == len(DATA) and reader.bytes_out < len(DATA) / 4
+
+    reader = WeedCompressingReader(io.StringIO('hello'))
+    assert gzip.decompress(reader.read()) == b'hello'
+
+
+def test_zstd_is_optional():
+    if compression.zstandard is not None:
+        pytest.skip('zstandard is installed')
+    with pytest.raises(ImportError):
+        WeedCompression(encoding=ZSTD)
+
+
+def test_multipart_encoder_compresses():
+    encoder = WeedMultipartEncoder(io.BytesIO(DATA), 'a.json', content_encoding=GZIP)
+    assert encoder.len is None  # sent with chunked transfer-encoding
+    body = b''.join(encoder)
+    assert b'Content-Encoding: gzip\r\n' in encoder.preamble
+    assert gzip.decompress(body[len(encoder.preamble):-len(encoder.epilogue)]) == DATA
+
+
+class _GzipHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = gzip.compress(DATA) if 'gzip' in self.headers.get('Accept-Encoding', '') else DATA
+        self.send_response(200)
+        if body is not DATA:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_response_stream_decompresses(http_server):
+    _, url = http_server(_GzipHandler)
+    with WeedSession() as session:
+        rsp = session.get(url + '/3,01', stream=True)
+        assert rsp.headers['content-encoding'] == 'gzip'  # negotiated by default
+        with WeedResponseStream(rsp, chunk_size=4096) as stream:
+            chunks = list(stream)
+        assert b''.join(chunks) == DATA and len(chunks) > 1
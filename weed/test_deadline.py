@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import io
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from weed import conf
+from weed.deadline import *
+from weed.operation import WeedOperation
+from weed.cache import WeedTTLCache
+from weed.session import WeedSession
+from weed.stream import WeedResponseStream, read_content
+from weed.util import run_concurrently
+
+
+def test_nested_deadlines():
+    assert current_deadline() is None
+    assert get_timeout() == (conf.g_connect_timeout_in_seconds, conf.g_read_timeout_in_seconds)
+    with deadline(10) as outer:
+        with deadline(0.5) as inner:
+            assert current_deadline() is inner
+            connect, read = get_timeout()
+            assert 0.4 < connect <= 0.5 and read == connect
+        with deadline(20) as longer:
+            assert longer is outer  # an inner deadline can not extend an outer one
+        # worker threads of python-weed see the deadline too
+        assert list(run_concurrently(lambda _: current_deadline(), range(2))) == [outer, outer]
+    assert current_deadline() is None
+
+    with deadline(0):
+        with pytest.raises(WeedDeadlineExceeded):
+            get_timeout()
+
+
+class _StalledHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        time.sleep(2)
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+def test_deadline_bounds_stalled_servers(http_server):
+    _, url = http_server(_StalledHandler)
+    with WeedSession() as session:
+        started = time.monotonic()
+        with deadline(0.2):
+            with pytest.raises(WeedDeadlineExceeded):
+                session.get(url + '/3,01')
+        assert time.monotonic() - started < 1
+        assert session.breaker.stats() == {}  # a short deadline says nothing about the host
+
+        op = WeedOperation(master_url_base=url, session=session)
+        started = time.monotonic()
+        wor = op.get('3,01637037d6', deadline_in_seconds=0.2)  # the lookup stalls
+        assert not wor.ok()
+        assert op.put(io.BytesIO(b'hello'), deadline_in_seconds=0.2) is None  # the assign stalls
+        assert time.monotonic() - started < 1.5
+
+
+def test_deadline_bounds_waiting_for_a_load():
+    cache = WeedTTLCache()
+    loading = threading.Event()
+
+    def slow_loader(key):
+        loading.set()
+        time.sleep(1)
+        return key
+
+    leader = threading.Thread(target=cache.get_or_load, args=('3', slow_loader))
+    leader.start()
+    loading.wait()
+    started = time.monotonic()
+    with deadline(0.1):
+        with pytest.raises(WeedDeadlineExceeded):
+            cache.get_or_load('3', slow_loader)
+    assert time.monotonic() - started < 0.5
+    leader.join()
+    assert cache.get('3') == '3'
+
+
+class _TricklingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '40')
+        self.end_headers()
+        try:
+            for _ in range(40):
+                self.wfile.write(b'x')
+                self.wfile.flush()
+                time.sleep(0.05)
+        except OSError:
+            pass
+
+
+def test_deadline_bounds_trickling_bodies(http_server):
+    _, url = http_server(_TricklingHandler)
+    url += '/3,01'
+    with WeedSession() as session:
+        for read in [lambda rsp: read_content(rsp, 1), lambda rsp: b''.join(WeedResponseStream(rsp, 1))]:
+            started = time.monotonic()
+            with deadline(0.3):
+                rsp = session.get(url, stream=True)  # every byte comes well within the read timeout
+                with pytest.raises(WeedDeadlineExceeded):
+                    read(rsp)
+                rsp.close()
+            assert time.monotonic() - started < 1
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+import glob
+import os
+import threading
+import time
+
+from weed.disk_cache import WeedDiskCache
+
+
+def test_disk_cache(tmp_path):
+    cache = WeedDiskCache(str(tmp_path), max_bytes=100, max_object_size=60, ttl=60)
+    cache.set('1', b'a' * 40, etag='e1', content_type='text/plain')
+    entry, etag, fresh = cache.get('1')
+    assert (etag, fresh, entry.size, entry.content_type) == ('e1', True, 40, 'text/plain')
+    assert entry.read() == b'a' * 40
+    assert entry.mmap()[:] == b'a' * 40
+
+    cache.set('big', b'b' * 61)  # larger than max_object_size
+    assert 'big' not in cache
+
+    # contents are stored once
+    cache.set('2', b'a' * 40)
+    assert len(glob.glob(os.path.join(str(tmp_path), 'objects', '*', '*'))) == 1
+    cache.invalidate('1')
+    assert cache.get('2')[0].read() == b'a' * 40
+
+    # survives a restart
+    cache.close()
+    cache = WeedDiskCache(str(tmp_path), max_bytes=100, max_object_size=60, ttl=60)
+    assert cache.get('2')[2]
+    assert cache.stats()['bytes'] == 40
+
+
+def test_disk_cache_eviction(tmp_path):
+    lru = WeedDiskCache(str(tmp_path / 'lru'), max_bytes=100, ttl=60)
+    lfu = WeedDiskCache(str(tmp_path / 'lfu'), max_bytes=100, ttl=60, policy='lfu')
+    for cache in [lru, lfu]:
+        cache.set('1', b'1' * 40)
+        cache.get('1')
+        cache.get('1')
+        time.sleep(0.01)
+        cache.set('2', b'2' * 40)
+        time.sleep(0.01)
+        cache.get('1')
+        cache.set('3', b'3' * 40)
+        assert cache.stats()['bytes'] == 80
+    assert '2' not in lru and '1' in lru
+    assert '2' not in lfu and '1' in lfu
+    lfu.set('4', b'4' * 40)  # '3' is used least often
+    assert '3' not in lfu and '1' in lfu
+    assert len(glob.glob(str(tmp_path / 'lfu' / 'objects' / '*' / '*'))) == 2
+
+
+def test_disk_cache_lfu_keeps_new_entries(tmp_path):
+    cache = WeedDiskCache(str(tmp_path), max_bytes=300, ttl=60, policy='lfu')
+    for key in 'abc':
+        cache.set(key, key.encode() * 100)
+    for key in 'abcab':
+        cache.get(key)
+    cache.set('d', b'd' * 100)  # every other entry has hits, yet the new one is kept
+    assert 'd' in cache and 'c' not in cache
+    cache.get('d')
+    cache.set('e', b'e' * 100)
+    assert 'e' in cache and 'd' not in cache  # 'd' is used least often
+    assert len(cache) == 3
+
+def test_disk_cache_revalidation(tmp_path):
+    cache = WeedDiskCache(str(tmp_path), ttl=0)
+    cache.set('1', b'a', etag='e1')
+    entry, etag, fresh = cache.get('1')
+    assert entry is not None and etag == 'e1' and not fresh  # expired, kept for revalidation
+    cache.refresh('1', ttl=60)
+    assert cache.get('1')[2]
+    assert cache.stats()['revalidations'] == 1
+
+
+def test_disk_cache_connections(tmp_path):
+    cache = WeedDiskCache(str(tmp_path), ttl=60, pool_size=2, access_flush_interval_in_seconds=60)
+    cache.set('1', b'a')
+
+    def threads_read():
+        threads = [threading.Thread(target=cache.get, args=('1',)) for _ in range(20)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    for _ in range(5):
+        threads_read()
+    assert len(cache._idle) <= 2  # connections of finished threads are not kept
+    # reads are remembered in memory, then written at once
+    assert cache._accesses['1'][1] == 100
+    with cache._db() as db:
+        assert db.execute("SELECT hits FROM entries WHERE key = '1'").fetchone()[0] == 0
+    cache.close()
+    assert cache._idle == []
+    cache = WeedDiskCache(str(tmp_path), ttl=60)
+    with cache._db() as db:
+        assert db.execute("SELECT hits FROM entries WHERE key = '1'").fetchone()[0] == 100
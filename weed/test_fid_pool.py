@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+
+from weed.fid_pool import WeedFidPool
+from weed.util import WeedAssignKeyExtended
+
+
+class FakeMaster(object):
+    def __init__(self):
+        self.assign_calls = []
+        self.volume_id = 0
+
+    def acquire_new_assign_key(self, count=1, collection=None, replication=None, ttl=None):
+        self.assign_calls.append((count, collection, replication, ttl))
+        self.volume_id += 1
+        wak = WeedAssignKeyExtended()
+        wak.update({'fid': '%d,01' % self.volume_id, 'url': 'localhost:8080', 'publicUrl': 'localhost:8080',
+                    'count': count})
+        wak.update_full_urls()
+        return wak
+
+
+def test_fid_pool_hands_out_block():
+    master = FakeMaster()
+    pool = WeedFidPool(master, block_size=10, background_refill=False)
+    fids = [pool.acquire().fid for _ in range(10)]
+    assert fids == ['1,01'] + ['1,01_%d' % i for i in range(1, 10)]
+    assert len(master.assign_calls) == 1
+    assert pool.acquire().fid == '2,01'
+
+
+def test_fid_pool_per_collection_and_thread_safety():
+    master = FakeMaster()
+    pool = WeedFidPool(master, block_size=50, background_refill=False)
+    assert pool.acquire(collection='pics').fid != pool.acquire(collection='docs').fid
+    assert master.assign_calls[0][1:] == ('pics', None, None)
+
+    fids = []
+    threads = [threading.Thread(target=lambda: fids.extend(pool.acquire().fid for _ in range(20)))
+               for _ in range(5)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    assert len(set(fids)) == 100
+
+
+def test_fid_pool_refills_in_background():
+    master = FakeMaster()
+    pool = WeedFidPool(master, block_size=4, low_water_mark=2)
+    pool.acquire()
+    pool.acquire()
+    for _ in range(100):
+        if pool.size() == 6:
+            break
+        time.sleep(0.01)
+    assert len(master.assign_calls) == 2
+    assert pool.size() == 6
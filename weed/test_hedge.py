@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+import select
+import time
+from http.server import BaseHTTPRequestHandler
+
+from weed.hedge import WeedCancelToken, WeedHedgePolicy
+from weed.operation import WeedOperation
+from weed.session import WeedSession
+
+
+def test_learned_delay():
+    policy = WeedHedgePolicy(percentile=90, min_samples=10, window=100)
+    assert policy.next_delay() is None  # nothing learned yet
+    for i in range(100):
+        policy.record(i / 1000)
+    assert abs(policy.next_delay() - 0.090) < 0.0015
+    assert WeedHedgePolicy(delay_in_seconds=0.05).next_delay() == 0.05
+
+
+def test_hedge_budget():
+    policy = WeedHedgePolicy(delay_in_seconds=0.01, max_hedge_ratio=0.1, burst=2)
+    assert policy.try_hedge() and policy.try_hedge()
+    assert not policy.try_hedge()  # the burst is used up
+    for _ in range(11):  # 10 reads earn 1 hedge, give float rounding one more
+        policy.next_delay()
+    assert policy.try_hedge()
+    assert not policy.try_hedge()
+    stats = policy.stats()
+    assert stats['reads'] == 11 and stats['hedges'] == 3 and stats['denied'] == 2
+
+
+def test_cancel_token():
+    class _Response(object):
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    token, rsp = WeedCancelToken(), _Response()
+    token.register(rsp)
+    assert not rsp.closed
+    token.cancel()
+    assert rsp.closed and token.cancelled
+    late = _Response()
+    token.register(late)  # answered after being cancelled
+    assert late.closed
+
+
+class _ReplicaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        time.sleep(self.server.delay)
+        body = b'from %d' % self.server.server_address[1]
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_hedged_get(http_server):
+    slow, slow_url = http_server(_ReplicaHandler, delay=2.0)
+    fast, fast_url = http_server(_ReplicaHandler, delay=0)
+    slow_url, fast_url = slow_url + '/3,01637037d6', fast_url + '/3,01637037d6'
+    with WeedSession() as session:
+        op = WeedOperation(session=session, hedge=WeedHedgePolicy(delay_in_seconds=0.2))
+        started = time.monotonic()
+        wor = op._get_from_urls('3,01637037d6', [slow_url, fast_url])
+        assert time.monotonic() - started < 1.5
+        assert wor.ok() and wor.url == fast_url
+        assert wor.content == b'from %d' % fast.server_address[1]
+        assert op.hedge.stats()['hedge_wins'] == 1
+        # the cancelled primary counts with the time it took so far, the winner with its own
+        latencies = sorted(op.hedge._latencies)
+        assert len(latencies) == 2 and latencies[0] < 0.2 <= latencies[1]
+
+        # a fast first replica is not hedged
+        wor = op._get_from_urls('3,01637037d6', [fast_url, slow_url])
+        assert wor.url == fast_url
+        assert op.hedge.stats()['hedges'] == 1
+
+
+class _HangingHandler(BaseHTTPRequestHandler):
+    """ delays its response headers up to 3s, or until the client hangs up """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        started = time.monotonic()
+        readable, _, _ = select.select([self.connection], [], [], 3)
+        if readable and not self.connection.recv(1):  # the client closed the connection
+            self.server.hung_up_after = time.monotonic() - started
+            return
+        body = b'late'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_hedged_get_cancels_a_loser_waiting_for_headers(http_server):
+    slow, slow_url = http_server(_HangingHandler, hung_up_after=None)
+    _, fast_url = http_server(_ReplicaHandler, delay=0)
+    slow_url, fast_url = slow_url + '/3,01637037d6', fast_url + '/3,01637037d6'
+    with WeedSession() as session:
+        op = WeedOperation(session=session, hedge=WeedHedgePolicy(delay_in_seconds=0.1))
+        wor = op._get_from_urls('3,01637037d6', [slow_url, fast_url])
+        assert wor.ok() and wor.url == fast_url
+        for _ in range(50):
+            if slow.hung_up_after is not None:
+                break
+            time.sleep(0.02)
+        assert slow.hung_up_after is not None and slow.hung_up_after < 1  # the loser's connection was closed
+        slow_host = slow_url.split('/')[2]
+        assert op.selector.stats()[slow_host]['in_flight'] == 0
+        assert op.selector.stats()[slow_host]['error_rate'] == 0  # slow, not failing
+        assert session.breaker.stats() == {}
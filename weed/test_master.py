@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+from weed.master import WeedMaster
+from weed.util import parse_volume_id_ranges
+
+STATUS = {'Topology': {'DataCenters': [{'Racks': [{'DataNodes': [
+    {'Url': 'a:8080', 'PublicUrl': 'a:8080', 'VolumeIds': ' 1-3 5'},
+    {'Url': 'b:8080', 'PublicUrl': 'b:8080', 'VolumeIds': '3'}]}]}], 'layouts': []}}
+
+
+def test_parse_volume_id_ranges():
+    assert parse_volume_id_ranges(' 1-3 5 7') == ['1', '2', '3', '5', '7']
+    assert parse_volume_id_ranges('') == []
+
+
+def test_warm_up_and_lookup_many_from_topology():
+    master = WeedMaster(url_base='http://127.0.0.1:1')
+    status_calls = []
+    master.get_status = lambda: status_calls.append(1) or STATUS
+
+    assert master.lookup_many(['1,01', '2', '5/01']) == {
+        '1': {'locations': [{'url': 'a:8080', 'publicUrl': 'a:8080'}]},
+        '2': {'locations': [{'url': 'a:8080', 'publicUrl': 'a:8080'}]},
+        '5': {'locations': [{'url': 'a:8080', 'publicUrl': 'a:8080'}]},
+    }
+    assert len(status_calls) == 1
+    assert len(master.lookup('3')['locations']) == 2  # cached by the same topology call
+
+    master.volumes_cache.clear()
+    assert master.warm_up_volume_cache() == 4
+    assert master.lookup_many(['1', '2', '3', '5'])['3']
+    assert len(status_calls) == 2
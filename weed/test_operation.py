@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+import json
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler
+
+from weed.operation import WeedOperation
+from weed.session import WeedSession
+
+
+class _VolumeHandler(BaseHTTPRequestHandler):
+    """ batch deletes, recording fids in server.deleted. fids in server.missing are answered 404 """
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        fids = urllib.parse.parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())['fid']
+        self.server.deleted.extend(fids)
+        body = json.dumps([{'fid': fid, 'status': 404, 'error': 'not found'} if fid in self.server.missing
+                           else {'fid': fid, 'status': 202, 'size': 10} for fid in fids]).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _location(url) -> {}:
+    host = url.split('//')[-1]
+    return {'url': host, 'publicUrl': host}
+
+
+def test_delete_many_deletes_without_being_iterated(http_server):
+    server, url = http_server(_VolumeHandler, deleted=[], missing=set())
+    with WeedSession() as session:
+        op = WeedOperation(master_url_base='http://127.0.0.1:1', session=session)
+        for volume_id in ['3', '4']:
+            op.master.volumes_cache.set(volume_id, {'locations': [_location(url)]})
+        fids = ['4,01637037d6', '3,01637037d6', '3,02637037d6']
+        op.delete_many(fids, chunk_size=1)
+        assert sorted(server.deleted) == sorted(fids)
+        wors = op.delete_many(fids + ['5,01637037d6'])  # volume 5 is unknown
+        assert [wor.fid for wor in wors] == fids + ['5,01637037d6']
+        assert [wor.ok() for wor in wors] == [True, True, True, False]
+
+        server.deleted.clear()
+        op.iter_delete_many(fids)  # lazy
+        assert server.deleted == []
+
+
+def test_delete_many_deletes_on_every_replica(http_server):
+    servers = [http_server(_VolumeHandler, deleted=[], missing=set()) for _ in range(2)]
+    fids = ['3,01637037d6', '3,02637037d6']
+    servers[1][0].missing.add(fids[1])
+    with WeedSession() as session:
+        op = WeedOperation(master_url_base='http://127.0.0.1:1', session=session)
+        op.master.volumes_cache.set('3', {'locations': [_location(url) for _, url in servers]})
+        wors = op.delete_many(fids + fids[:1])
+        for server, _ in servers:
+            assert sorted(server.deleted) == sorted(fids)  # the batch endpoint does not replicate
+        assert [wor.fid for wor in wors] == fids + fids[:1]
+        assert wors[0].ok() and wors[0].storage_size == 10
+        assert not wors[1].ok() and 'not found' in wors[1].message  # one replica did not have it
+
+
+class _CountingHandler(BaseHTTPRequestHandler):
+    """ answers GETs after 50ms(or HTTP 500 if server.failing), counting concurrent ones in server.max_in_flight """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+        time.sleep(0.05)
+        with self.server.lock:
+            self.server.in_flight -= 1
+        body = b'x'
+        self.send_response(500 if self.server.failing else 200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_get_many_limits_every_host_tried(http_server):
+    servers = [http_server(_CountingHandler, failing=failing, lock=threading.Lock(), in_flight=0, max_in_flight=0)
+               for failing in [True, False]]
+    locations = [_location(url) for _, url in servers]
+    with WeedSession() as session:
+        op = WeedOperation(master_url_base='http://127.0.0.1:1', session=session)
+        op.master.volumes_cache.set('3', {'locations': locations})
+        op.master.volumes_cache.set('4', {'locations': locations[::-1]})
+        fids = ['%d,%02x637037d6' % (3 + i % 2, i) for i in range(8)]
+        wors = list(op.get_many(fids, max_workers=8, max_workers_per_host=1))
+        assert all(wor.ok() for wor in wors)  # failed over from the failing replica
+        assert [server.max_in_flight for server, _ in servers] == [1, 1]
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+import collections
+
+from weed.operation import WeedOperation
+from weed.selector import WeedLocationSelector
+
+URLS = ['http://a:8080/3,01', 'http://b:8080/3,01', 'http://c:8080/3,01']
+
+
+def test_prefers_fast_hosts():
+    selector = WeedLocationSelector()
+    for _ in range(10):
+        selector.record('http://a:8080/1,01', 0.100)
+        selector.record('http://b:8080/1,01', 0.001)
+        selector.record('http://c:8080/1,01', 0.010)
+    chosen = collections.Counter(selector.choose(URLS) for _ in range(300))
+    # power of two choices: the slowest host is never chosen, the fastest most often
+    assert chosen['http://a:8080/3,01'] == 0
+    assert chosen['http://b:8080/3,01'] > chosen['http://c:8080/3,01'] > 0
+    assert selector.order(URLS)[-1] == 'http://a:8080/3,01'
+
+
+def test_avoids_failing_hosts():
+    selector = WeedLocationSelector(cooldown_in_seconds=60)
+    selector.record('http://b:8080/1,01', 0.001)
+    for _ in range(5):
+        selector.record('http://a:8080/1,01', 0.001, ok=False)
+    assert selector.order(URLS[:2]) == ['http://b:8080/3,01', 'http://a:8080/3,01']
+
+    selector = WeedLocationSelector(cooldown_in_seconds=0)
+    for _ in range(5):
+        selector.record('http://a:8080/1,01', 0.001, ok=False)
+    assert selector._is_healthy(selector._hosts['a:8080'], float('inf'))  # after the cooldown
+
+
+def test_track():
+    selector = WeedLocationSelector()
+    try:
+        with selector.track('http://a:8080/1,01'):
+            assert selector.stats()['a:8080']['in_flight'] == 1
+            raise IOError('connection refused')
+    except IOError:
+        pass
+    with selector.track('http://b:8080/1,01') as track:
+        track.ok = False  # eg: http 503
+    stats = selector.stats()
+    assert stats['a:8080']['in_flight'] == 0
+    assert stats['a:8080']['error_rate'] > 0 and stats['b:8080']['error_rate'] > 0
+
+
+def test_operation_orders_locations():
+    op = WeedOperation(master_url_base='http://127.0.0.1:1')
+    for _ in range(5):
+        op.selector.record('http://a:8080/3,01', 0.1, ok=False)
+    lookup = {'locations': [{'url': 'a:8080', 'publicUrl': 'a:8080'}, {'url': 'b:8080', 'publicUrl': 'b:8080'}]}
+    assert op._fid_full_urls('3,01', lookup) == ['http://b:8080/3,01', 'http://a:8080/3,01']
+    assert op._choose_fid_full_url('3,01', lookup, use_public_url=True) == 'http://b:8080/3,01'
+    assert op._choose_fid_full_url('3,01', None) is None
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+from http.server import BaseHTTPRequestHandler
+
+from weed.filer import WeedFiler
+from weed.operation import WeedOperation
+from weed.session import WeedSession, can_sendfile, get_default_session
+from weed.stream import WeedMultipartEncoder
+from weed.util import post_multipart
+
+
+def test_default_session_is_shared():
+    op = WeedOperation()
+    assert op.session is get_default_session()
+    assert op.master.session is op.session
+    assert WeedFiler().session is op.session
+
+
+def test_custom_session():
+    session = WeedSession(pool_connections=2, pool_maxsize=3)
+    op = WeedOperation(session=session)
+    assert op.master.session is session
+    adapter = session.session.get_adapter('http://localhost:9333')
+    assert adapter._pool_maxsize == 3
+    session.close()
+
+
+class _EchoHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_post_with_sendfile(tmp_path, http_server):
+    _, url = http_server(_EchoHandler)
+    url += '/3,01637037d6'
+    path = tmp_path / 'a.bin'
+    path.write_bytes(b'0123456789' * 1000)
+    with WeedSession() as session:
+        with open(path, 'rb') as fp:
+            assert can_sendfile(fp, url)
+            assert not can_sendfile(fp, url.replace('http:', 'https:'))
+            for _ in range(2):
+                fp.seek(5)
+                encoder = WeedMultipartEncoder(fp, 'a.bin')
+                rsp = post_multipart(url, encoder, session=session)
+                assert rsp.ok
+                assert rsp.content == encoder.preamble + path.read_bytes()[5:] + encoder.epilogue
+        # the keep-alive connection went back to the pool and was reused
+        pool = session.session.get_adapter(url).poolmanager.connection_from_url(url)
+        assert pool.num_connections == 1
+
+
+def test_post_with_sendfile_through_a_proxy(tmp_path, http_server):
+    _, proxy_url = http_server(_EchoHandler)
+    path = tmp_path / 'a.bin'
+    path.write_bytes(b'0123456789' * 10000)
+    with WeedSession() as session:
+        session.session.proxies = {'http': proxy_url}
+        with open(path, 'rb') as fp:
+            fp.seek(5)
+            # the volume server is only known to the proxy, the body is streamed there instead
+            rsp = session.post_with_sendfile('http://volume.invalid:8080/3,01', fp, 99990, b'<', b'>')
+        assert rsp.ok and rsp.content == b'<' + path.read_bytes()[5:-5] + b'>'
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import tempfile
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from weed.session import WeedSession
+from weed.stream import WeedMultipartEncoder, WeedRangeFile, WeedRangeReader, get_ranges
+
+
+def test_multipart_encoder():
+    encoder = WeedMultipartEncoder(io.BytesIO(b'hello world'), 'a.txt', file_content_type='text/plain')
+    body = b''.join(encoder)
+    assert encoder.len == len(body)
+    assert encoder.content_type == 'multipart/form-data; boundary=%s' % encoder.boundary
+    assert body == (b'--%s\r\nContent-Disposition: form-data; name="a.txt"; filename="a.txt"\r\n'
+                    b'Content-Type: text/plain\r\n\r\nhello world\r\n--%s--\r\n'
+                    % (encoder.boundary.encode(), encoder.boundary.encode()))
+
+
+def test_multipart_encoder_reads_in_chunks():
+    with tempfile.TemporaryFile() as fp:
+        fp.write(os.urandom(100000))
+        fp.seek(1000)
+        encoder = WeedMultipartEncoder(fp, field_name='file', chunk_size=4096)
+        chunks = list(encoder)
+        assert max(len(chunk) for chunk in chunks) <= 4096
+        assert encoder.len == sum(len(chunk) for chunk in chunks)
+        assert encoder.len == len(encoder.preamble) + 99000 + len(encoder.epilogue)
+
+
+def test_multipart_encoder_unknown_size():
+    encoder = WeedMultipartEncoder(io.StringIO('hello'), field_name='file')
+    assert encoder.len is None
+    assert b'\r\n\r\nhello\r\n' in encoder.read()
+
+    # eg: piping a response stream whose Content-Length is known
+    encoder = WeedMultipartEncoder(io.BufferedReader(io.BytesIO(b'hello')), field_name='file', file_size=5)
+    assert encoder.len == len(encoder.read())
+
+
+def test_parse_byteranges():
+    from weed.stream import _parse_byteranges
+    body = (b'--B\r\nContent-Type: text/plain\r\nContent-Range: bytes 0-3/100\r\n\r\nab\r\n\r\n'
+            b'--B\r\nContent-Range: bytes 50-51/100\r\n\r\nxy\r\n--B--\r\n')
+    assert _parse_byteranges(body, 'B') == [(0, b'ab\r\n'), (50, b'xy')]
+
+
+def test_range_file():
+    data = bytes(range(256)) * 10
+    requested = []
+
+    def read_range(offset, length):
+        requested.append((offset, length))
+        return data[offset:offset + length]
+
+    f = io.BufferedReader(WeedRangeFile(read_range, len(data)), 256)
+    f.seek(-4, io.SEEK_END)
+    assert f.read() == data[-4:]
+    f.seek(100)
+    assert f.read(10) == data[100:110]
+    assert f.read(10) == data[110:120]
+    assert requested == [(len(data) - 4, 4), (100, 256)]
+    f.seek(0)
+    assert f.read() == data
+
+
+def test_parse_content_range():
+    from weed.stream import _parse_content_range
+    assert _parse_content_range('bytes 50-51/100') == 50
+    assert _parse_content_range('bytes 0-0/*') == 0
+    for content_range in [None, '', 'bytes', 'bytes */100']:
+        with pytest.raises(IOError):
+            _parse_content_range(content_range)
+
+
+DATA = bytes(range(256)) * 40
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    """ answers every Range request as server.mode says: 'ignore'(200 with the whole file), 'no-content-range'.
+    records the Range headers in server.ranges """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.ranges.append(self.headers.get('Range'))
+        self.send_response(200 if self.server.mode == 'ignore' else 206)
+        self.send_header('Content-Length', str(len(DATA)))
+        self.end_headers()
+        try:
+            self.wfile.write(DATA)
+        except OSError:
+            pass
+
+
+def test_ranges_of_servers_ignoring_them(http_server):
+    server, url = http_server(_RangeHandler, mode='ignore', ranges=[])
+    url += '/3,01'
+    with WeedSession() as session:
+        assert get_ranges(session, url, [(10, 5), (100, 3)])[1] == [DATA[10:15], DATA[100:103]]
+
+        server.ranges.clear()
+        f = io.BufferedReader(WeedRangeFile(WeedRangeReader(session, url), len(DATA)), 256)
+        assert f.read() == DATA
+        assert len(server.ranges) == 2  # a Range request, then the whole file once
+
+        server.mode = 'no-content-range'
+        with pytest.raises(IOError):
+            get_ranges(session, url, [(10, 5)])
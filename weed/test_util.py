@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+import random
+import threading
+import time
+
+from weed.util import WeedByteBudget, WeedChunkInfo, WeedChunkManifest, WeedHostLimiter, get_volume_id, run_concurrently
+
+
+def test_get_volume_id():
+    assert get_volume_id('3,01637037d6') == '3'
+    assert get_volume_id('3/01637037d6') == '3'
+    assert get_volume_id('3') == '3'
+
+
+def test_run_concurrently():
+    def slow_square(i):
+        time.sleep(random.random() / 100)
+        return i * i
+
+    assert list(run_concurrently(slow_square, range(50), max_workers=8, ordered=True)) == [i * i for i in range(50)]
+    assert sorted(run_concurrently(slow_square, range(50), max_workers=8)) == [i * i for i in range(50)]
+
+
+def test_host_limiter():
+    limiter = WeedHostLimiter(2)
+    assert limiter.limit('http://127.0.0.1:8080/3,01') is limiter.limit('http://127.0.0.1:8080/4,02')
+    assert limiter.limit('http://127.0.0.1:8080/3,01') is not limiter.limit('http://127.0.0.1:8081/3,01')
+
+
+def test_chunk_manifest():
+    manifest = WeedChunkManifest('a.iso', 'application/octet-stream', 15,
+                                 [WeedChunkInfo('3,01', 0, 10), WeedChunkInfo('4,02', 10, 5)])
+    assert WeedChunkManifest.from_json(manifest.to_json()) == manifest
+    # seaweedfs omits empty fields, chunks may come in any order
+    assert WeedChunkManifest.from_json(b'{"chunks": [{"fid": "4,02", "offset": 10, "size": 5}, '
+                                       b'{"fid": "3,01", "size": 10}]}').chunks == manifest.chunks
+
+
+def test_byte_budget():
+    budget = WeedByteBudget(100)
+    peak = []
+
+    def _use(size):
+        with budget.reserve(size):
+            peak.append(budget.used)
+            time.sleep(0.01)
+
+    threads = [threading.Thread(target=_use, args=(size,)) for size in [60, 60, 30, 500]]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert max(peak) <= 100
+    assert budget.used == 0
@@ -25,14 +25,23 @@
 """
 utils of python-weed like adaption of weed response, etc..
 """
+import contextvars
 import json
+import mimetypes
+import threading
 import urllib.parse
-from dataclasses import dataclass
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from enum import Enum
 
 import requests
 
+from weed import conf
 from weed.conf import g_logger
+from weed.session import can_sendfile, get_default_session
+from weed.stream import WeedMultipartEncoder
 
 
 class WeedAssignKey(dict):
@@ -93,6 +102,28 @@ class WeedAssignKeyExtended(WeedAssignKey):
         # self['fid_full_publicUrl'] = parse.urljoin(self['full_publicUrl'], self['fid'])
 
 
+def get_volume_id(volume_id_or_fid) -> str:
+    """ return the volume_id part of a fid like '3,01637037d6' or '3/01637037d6', or the volume_id itself """
+    if ',' in volume_id_or_fid:
+        return volume_id_or_fid.split(',')[0]
+    elif '/' in volume_id_or_fid:
+        return volume_id_or_fid.split('/')[0]
+    else:
+        return volume_id_or_fid
+
+
+def parse_volume_id_ranges(volume_id_ranges) -> [str]:
+    """ parse volume id ranges like ' 1-3 5 7' or '1-3,5' into ['1', '2', '3', '5', '7'] """
+    volume_ids = []
+    for token in volume_id_ranges.replace(',', ' ').split():
+        if '-' in token:
+            begin, end = token.split('-', 1)
+            volume_ids.extend(str(i) for i in range(int(begin), int(end) + 1))
+        else:
+            volume_ids.append(str(int(token)))
+    return volume_ids
+
+
 class Status(Enum):
     SUCCESS = 0
     FAILED = 1
@@ -116,6 +147,7 @@ class WeedOperationResponse(dict):
     # eg: 'text/html; charset=UTF-8'; 'image/jpeg; charset=UTF-8'
     content_type: str = ''
     content: bytes = b''  # content of the file, set when do operation "get"
+    stream: object = None  # a WeedResponseStream over the content, set when do operation "get_stream"
 
     def __bool__(self):
         return self.ok()
@@ -142,7 +174,43 @@ class WeedOperationResponse(dict):
     #     #     setattr(self, k, v)
 
 
-def put_file(fp, fid_full_url, file_name='', http_headers=None):
+@dataclass
+class WeedChunkInfo(object):
+    """ one chunk of a chunked file: @size bytes at @offset of the file are stored at @fid """
+    fid: str = ''
+    offset: int = 0
+    size: int = 0
+
+
+@dataclass
+class WeedChunkManifest(object):
+    """ the chunk manifest of a large file which is stored as many chunks(same json as seaweedfs'):
+
+    {"name": "a.iso", "mime": "application/octet-stream", "size": 104857600,
+     "chunks": [{"fid": "3,01637037d6", "offset": 0, "size": 8388608}, ...]}
+
+    put it with "?cm=true", then a GET of its fid returns the whole file and a DELETE removes all chunks.
+    """
+    name: str = ''
+    mime: str = ''
+    size: int = 0
+    chunks: list = field(default_factory=list)  # [WeedChunkInfo, ...] ordered by offset
+
+    def to_json(self) -> str:
+        return json.dumps({'name': self.name, 'mime': self.mime, 'size': self.size,
+                           'chunks': [{'fid': c.fid, 'offset': c.offset, 'size': c.size} for c in self.chunks]})
+
+    @classmethod
+    def from_json(cls, json_of_manifest):
+        """ json_of_manifest: a str/bytes of json, or the dict already loaded """
+        d = json_of_manifest if isinstance(json_of_manifest, dict) else json.loads(json_of_manifest)
+        chunks = [WeedChunkInfo(c.get('fid', ''), c.get('offset', 0), c.get('size', 0))
+                  for c in d.get('chunks') or []]
+        return cls(d.get('name', ''), d.get('mime', ''), d.get('size', 0),
+                   sorted(chunks, key=lambda c: c.offset))
+
+
+def put_file(fp, fid_full_url, file_name='', http_headers=None, session=None, compression=None):
     """
     save fp(file-pointer, file-description) to a remote weed volume.
     eg:
@@ -158,26 +226,74 @@ def put_file(fp, fid_full_url, file_name='', http_headers=None):
        @http_headers = {'content-type' : 'text/xml'} or
        @http_headers = {'content-type' : 'application/json'}
 
+    @session: the WeedSession to send the request through, defaults to the shared one.
+
+    @compression: a WeedCompression. if it picks the file(by content-type and size), the file is
+    compressed while being sent and stored compressed.
+
+    the multipart body is streamed from @fp chunk by chunk, so memory used does not grow with file size.
 
     """
-    pos = fp.tell()
-    tmp_uploading_file_name = file_name or 'a.unknown'
+    try:
+        pos = fp.tell()
+    except (AttributeError, OSError):  # not seekable, eg: a stream
+        pos = None
     # print('fid_full_url is: "%s"' % fid_full_url)
     # print('fp position: %d' % fp.tell())
     # print('fp info: length: %d' % len(fp.read()))
     # fp.seek(0)
-    if http_headers:
-        rsp = requests.post(fid_full_url, files={tmp_uploading_file_name: fp}, headers=http_headers)
-    else:
-        rsp = requests.post(fid_full_url, files={tmp_uploading_file_name: fp})
+    _session = session or get_default_session()
+    # content-type in @http_headers is the file's, the request's is multipart/form-data
+    headers = {k: v for k, v in (http_headers or {}).items() if k.lower() != 'content-type'}
+    file_content_type = [v for k, v in (http_headers or {}).items() if k.lower() == 'content-type']
+    # stream the body from fp chunk by chunk instead of building it in memory
+    file_content_type = (file_content_type or [None])[0]
+    content_encoding = choose_content_encoding(compression, fp, file_name, file_content_type)
+    encoder = WeedMultipartEncoder(fp, file_name, file_content_type=file_content_type,
+                                   content_encoding=content_encoding,
+                                   compression_level=compression.level if content_encoding else None)
+    rsp = post_multipart(fid_full_url, encoder, headers, _session)
 
     # recove position of fp
-    fp.seek(pos)
+    if pos is not None:
+        fp.seek(pos)
+
+    return parse_put_file_response(rsp.json(), fid_full_url)
+
+
+def choose_content_encoding(compression, fp, file_name='', file_content_type=None) -> None or str:
+    """ return the encoding the WeedCompression @compression picks for @fp, None to send it as it is.
+
+    the content type is @file_content_type, or guessed from @file_name or the name of @fp.
+    """
+    if compression is None:
+        return None
+    content_type = file_content_type or \
+        mimetypes.guess_type(file_name or WeedMultipartEncoder._guess_file_name(fp) or '')[0]
+    return compression.choose(content_type, WeedMultipartEncoder._remaining_size(fp))
 
+
+def post_multipart(url, encoder, headers=None, session=None) -> requests.Response:
+    """ POST the WeedMultipartEncoder @encoder to @url.
+
+    when the file of @encoder is a real file of known size and @url is plain http, its bytes are
+    handed to the kernel with sendfile(unless conf.g_upload_with_sendfile is off), else they are
+    streamed chunk by chunk through python.
+    """
+    _session = session or get_default_session()
+    headers = dict(headers or {})
+    headers['Content-Type'] = encoder.content_type
+    if conf.g_upload_with_sendfile and encoder.len is not None and can_sendfile(encoder.fp, url):
+        count = encoder.len - len(encoder.preamble) - len(encoder.epilogue)
+        return _session.post_with_sendfile(url, encoder.fp, count, encoder.preamble, encoder.epilogue, headers)
+    return _session.post(url, data=encoder, headers=headers)
+
+
+def parse_put_file_response(rsp_json, fid_full_url) -> WeedOperationResponse:
+    """ turn the json which a volume server returns for a put into a WeedOperationResponse """
     # g_logger.debug(rsp.request.headers)
     # rsp_json sample:
     # {'name': 'test_opensource_logo.jpg', 'size': 5447, 'eTag': '071b90970a036c6492af19430bd96351'}
-    rsp_json = rsp.json()
     wor = WeedOperationResponse()
     wor.status = Status.SUCCESS
     wor.url = fid_full_url
@@ -199,3 +315,93 @@ def put_file(fp, fid_full_url, file_name='', http_headers=None):
         pass
 
     return wor
+
+
+class WeedHostLimiter(object):
+    """ bounds concurrent requests per host(eg: per volume server).
+
+    eg:
+        limiter = WeedHostLimiter(4)
+        with limiter.limit('http://127.0.0.1:8080/3,01637037d6'):
+            session.get(...)
+    """
+
+    def __init__(self, max_per_host=4):
+        self.max_per_host = max_per_host
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    def limit(self, url) -> threading.BoundedSemaphore:
+        """ return the semaphore of @url's host, use it as a context manager """
+        host = urllib.parse.urlsplit(url).netloc
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = self._semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+        return semaphore
+
+
+class WeedByteBudget(object):
+    """ bounds the bytes held in memory by concurrent transfers.
+
+    eg:
+        budget = WeedByteBudget(64 * 1024 * 1024)
+        with budget.reserve(len_of_buffer):
+            ...
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def reserve(self, size):
+        """ wait until @size bytes(at most max_bytes) are free, hold them inside the "with" block """
+        size = max(0, min(size, self.max_bytes))
+        with self._condition:
+            self._condition.wait_for(lambda: self.used + size <= self.max_bytes)
+            self.used += size
+        try:
+            yield size
+        finally:
+            with self._condition:
+                self.used -= size
+                self._condition.notify_all()
+
+
+def run_concurrently(fn, iterable, max_workers=16, ordered=False, max_pending=None):
+    """ call fn(item) for each item of @iterable in a thread pool and yield the results.
+
+    @ordered: if True, yield in the order of @iterable, else as soon as each one completes.
+    @max_pending: at most this many items are in flight(defaults to 2 * @max_workers),
+        so @iterable is consumed lazily and may be endless.
+
+    @fn should catch its own exceptions, otherwise they are raised to the caller.
+    @fn runs in the caller's context(contextvars), so eg: a deadline of the caller applies to it.
+    """
+    max_pending = max_pending or max_workers * 2
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = deque()
+
+    def _pop_completed():
+        if ordered:
+            return [pending.popleft()]
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for f in done:
+            pending.remove(f)
+        return done
+
+    try:
+        for item in iterable:
+            while len(pending) >= max_pending:
+                for f in _pop_completed():
+                    yield f.result()
+            pending.append(executor.submit(contextvars.copy_context().run, fn, item))
+        while pending:
+            for f in _pop_completed():
+                yield f.result()
+    finally:
+        for f in pending:
+            f.cancel()
+        executor.shutdown(wait=True)
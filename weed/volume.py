@@ -34,9 +34,11 @@ from urllib.parse import urljoin
 __all__ = ['WeedVolume']
 
 import json
-import requests
 
 from weed.conf import g_logger
+from weed.session import get_default_session
+from weed.stream import WeedMultipartEncoder
+from weed.util import post_multipart
 
 
 class WeedVolume(object):
@@ -44,14 +46,16 @@ class WeedVolume(object):
       Weed-FS's volume server(relative to master-server)
     """
 
-    def __init__(self, url_base='http://localhost:27000'):
+    def __init__(self, url_base='http://localhost:27000', session=None):
         """
 
         Arguments:
         - `url_base`: defaults to 'http://localhost:27000'
+        - `session`: the WeedSession to send requests through, defaults to the shared one
         :param url_base:
         """
         self.url_base = url_base
+        self.session = session or get_default_session()
         self.url_status = urljoin(self.url_base, '/status')
 
     def get_status(self) -> None or {}:
@@ -61,7 +65,7 @@ class WeedVolume(object):
         Arguments:
         - `self`:
         """
-        r = requests.get(self.url_status)
+        r = self.session.get(self.url_status)
         try:
             result = json.loads(r.content)
         except Exception as e:
@@ -83,12 +87,13 @@ class WeedVolume(object):
         Use util.put_file instead.
         """
         url = urljoin(self.url_base, fid)
+        file_content_type = None
         if headers and isinstance(headers, dict):
-            files = {'file': (open(absolute_file_path, 'rb')), 'headers': headers}
-        else:
-            files = {'file': (open(absolute_file_path, 'rb'))}
+            file_content_type = {k.lower(): v for k, v in headers.items()}.get('content-type')
         try:
-            r = requests.post(url, files=files)
+            with open(absolute_file_path, 'rb') as fp:
+                encoder = WeedMultipartEncoder(fp, field_name='file', file_content_type=file_content_type)
+                r = post_multipart(url, encoder, session=self.session)
         except Exception as e:
             g_logger.error("Could not post file. Exception is: %s" % e)
             return None
@@ -112,7 +117,7 @@ class WeedVolume(object):
         """
         url = urljoin(self.url_base, fid)
         try:
-            r = requests.get(url)
+            r = self.session.get(url)
         except Exception as e:
             g_logger.error("Could not get file. Exception is: %s" % e)
             return None
@@ -134,7 +139,7 @@ class WeedVolume(object):
         """
         url = urljoin(self.url_base, fid)
         try:
-            r = requests.delete(url)
+            r = self.session.delete(url)
         except Exception as e:
             g_logger.error("Could not delete file. Exception is: %s" % e)
             return None